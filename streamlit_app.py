@@ -2,8 +2,28 @@ import streamlit as st
 import sqlite3
 import hashlib
 import pandas as pd
+import numpy as np
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+import cProfile
+import functools
+import importlib.util
+import io
+import logging
+from logging.handlers import RotatingFileHandler
+import marshal
+import math
 import os
+import pstats
+import queue
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
 
 # Page configuration
 st.set_page_config(
@@ -160,14 +180,923 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Database file path
-DB_FILE = "pickleball_club.db"
+# Database file path (PICKLEBALL_DB_FILE cho phép chạy app/benchmark trên file khác)
+DB_FILE = os.environ.get("PICKLEBALL_DB_FILE", "pickleball_club.db")
+# File lưu trữ dữ liệu cũ, gắn vào kết nối bằng ATTACH DATABASE khi cần
+ARCHIVE_DB_FILE = os.environ.get("PICKLEBALL_ARCHIVE_DB_FILE", os.path.splitext(DB_FILE)[0] + '_archive.db')
+
+# Cấu hình kết nối SQLite
+DB_POOL_SIZE = 8
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("PICKLEBALL_BUSY_TIMEOUT_MS", "5000"))
+DB_STATEMENT_CACHE_SIZE = 256
+
+# Đo thời gian truy vấn (ngưỡng slow query chỉnh qua biến môi trường)
+SLOW_QUERY_MS = float(os.environ.get("PICKLEBALL_SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG_FILE = os.environ.get("PICKLEBALL_SLOW_QUERY_LOG", "slow_queries.log")
+QUERY_STATS_SAMPLES = 200
+RECENT_SLOW_QUERIES = 50
+# Helper dùng chung cho nhiều hàm đọc: ghi nhận tên hàm gọi nó thay vì chính nó
+QUERY_SITE_PASSTHROUGH = {'read_keyset_page'}
+
+def find_query_call_site():
+    """Tên hàm trong app đã phát ra câu lệnh SQL (bỏ qua các frame đo đạc, pandas, sqlite3)"""
+    app_file = find_query_call_site.__code__.co_filename
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        if (code.co_filename == app_file and code not in QUERY_TIMING_CODE
+                and code.co_name not in QUERY_SITE_PASSTHROUGH):
+            return code.co_name
+        frame = frame.f_back
+    return '<ngoài app>'
+
+def percentile(samples, fraction):
+    """Phân vị theo phương pháp nearest-rank"""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(len(ordered) * fraction) - 1)] if ordered else 0.0
+
+def create_slow_query_logger(log_file):
+    logger = logging.getLogger('pickleball.slow_queries')
+    if not logger.handlers:
+        handler = RotatingFileHandler(log_file, maxBytes=1_000_000, backupCount=3, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+class QueryStats:
+    """Thống kê thời gian theo (hàm gọi, câu SQL); tổng theo lần chạy lại giữ riêng từng thread script"""
+
+    def __init__(self, slow_ms=SLOW_QUERY_MS, logger=None):
+        self.slow_ms = slow_ms
+        self.logger = logger
+        self.recent_slow = deque(maxlen=RECENT_SLOW_QUERIES)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._rerun = threading.local()
+
+    def record(self, call_site, sql, elapsed_ms, rows):
+        sql = ' '.join(sql.split())
+        with self._lock:
+            entry = self._entries.get((call_site, sql))
+            if entry is None:
+                entry = self._entries[(call_site, sql)] = {
+                    'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0,
+                    'samples': deque(maxlen=QUERY_STATS_SAMPLES),
+                }
+            entry['calls'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+            entry['rows'] += rows
+            entry['samples'].append(elapsed_ms)
+            if elapsed_ms >= self.slow_ms:
+                self.recent_slow.append({
+                    'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    'call_site': call_site, 'ms': round(elapsed_ms, 1), 'rows': rows, 'sql': sql,
+                })
+        
+        totals = getattr(self._rerun, 'totals', None)
+        if totals is not None:
+            totals['queries'] += 1
+            totals['total_ms'] += elapsed_ms
+            totals['rows'] += rows
+        
+        if elapsed_ms >= self.slow_ms and self.logger is not None:
+            self.logger.info('%.1fms rows=%d site=%s sql=%s', elapsed_ms, rows, call_site, sql)
+
+    def start_rerun(self):
+        """Gọi đầu mỗi lần Streamlit chạy lại script"""
+        self._rerun.totals = {'queries': 0, 'total_ms': 0.0, 'rows': 0}
+
+    def rerun_totals(self):
+        return dict(getattr(self._rerun, 'totals', None) or {'queries': 0, 'total_ms': 0.0, 'rows': 0})
+
+    def top(self):
+        """Một dòng cho mỗi (hàm gọi, câu SQL)"""
+        with self._lock:
+            return [
+                {
+                    'call_site': call_site,
+                    'sql': sql,
+                    'calls': entry['calls'],
+                    'total_ms': round(entry['total_ms'], 1),
+                    'avg_ms': round(entry['total_ms'] / entry['calls'], 2),
+                    'p95_ms': round(percentile(entry['samples'], 0.95), 2),
+                    'max_ms': round(entry['max_ms'], 1),
+                    'rows': entry['rows'],
+                }
+                for (call_site, sql), entry in self._entries.items()
+            ]
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self.recent_slow.clear()
+
+@st.cache_resource
+def get_query_stats():
+    """Thống kê truy vấn dùng chung cho cả tiến trình"""
+    return QueryStats(SLOW_QUERY_MS, create_slow_query_logger(SLOW_QUERY_LOG_FILE))
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor đo thời gian từ execute tới khi đọc hết kết quả (SQLite chạy câu lệnh dần theo từng lần fetch)"""
+
+    _pending = None
+
+    def _start(self, sql, started, rows=None):
+        self._finish()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        pending = [find_query_call_site(), sql, elapsed_ms, 0]
+        if rows is not None or self.description is None:
+            # Câu lệnh ghi/DDL đã chạy xong trong execute
+            pending[3] = rows if rows is not None else max(self.rowcount, 0)
+            self.connection.stats.record(*pending)
+        else:
+            self._pending = pending
+
+    def _finish(self):
+        pending = self._pending
+        if pending is not None:
+            self._pending = None
+            self.connection.stats.record(*pending)
+
+    def _fetched(self, started, rows, exhausted):
+        pending = self._pending
+        if pending is not None:
+            pending[2] += (time.perf_counter() - started) * 1000
+            pending[3] += rows
+            if exhausted:
+                self._finish()
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        super().execute(sql, parameters)
+        self._start(sql, started)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._start(sql, started, max(self.rowcount, 0))
+        return self
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        size = self.arraysize if size is None else size
+        rows = super().fetchmany(size)
+        self._fetched(started, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows), True)
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(started, 0, True)
+            raise
+        self._fetched(started, 1, False)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+class PooledConnection(sqlite3.Connection):
+    """Kết nối SQLite lấy từ pool: close() trả kết nối về pool thay vì đóng thật"""
+
+    pool = None
+    checked_out = False
+    stats = None
+
+    def cursor(self, factory=None):
+        if factory is None and self.stats is not None:
+            factory = TimedCursor
+        return super().cursor(factory) if factory is not None else super().cursor()
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            super().close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Commit khi thành công, rollback khi lỗi, sau đó trả kết nối về pool
+        try:
+            return super().__exit__(exc_type, exc_value, traceback)
+        finally:
+            self.close()
+
+# Các frame của lớp đo đạc, bỏ qua khi tìm hàm gọi
+QUERY_TIMING_CODE = {
+    func.__code__ for func in (TimedCursor._start, TimedCursor.execute, TimedCursor.executemany,
+                               PooledConnection.execute, PooledConnection.executemany)
+}
+
+class ConnectionPool:
+    """Pool kết nối SQLite (WAL) dùng chung cho mọi session Streamlit"""
+
+    def __init__(self, db_file, size=DB_POOL_SIZE, stats=None):
+        self.db_file = db_file
+        self.size = size
+        self.stats = stats
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            factory=PooledConnection,
+            cached_statements=DB_STATEMENT_CACHE_SIZE,
+        )
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}')
+        conn.pool = self
+        conn.stats = self.stats
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._open()
+        conn.checked_out = True
+        return conn
+
+    def release(self, conn):
+        if not conn.checked_out:
+            return  # Đã trả về pool rồi (close() gọi hai lần)
+        conn.checked_out = False
+        
+        # Bỏ transaction còn dang dở để người dùng sau nhận kết nối sạch
+        if conn.in_transaction:
+            conn.rollback()
+        
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.pool = None
+        conn.close()
+
+@st.cache_resource
+def get_connection_pool():
+    """Pool kết nối tạo một lần cho cả tiến trình"""
+    return ConnectionPool(DB_FILE, stats=get_query_stats())
+
+# Schema migrations (phiên bản lưu trong PRAGMA user_version)
+def migrate_hot_query_indexes(cursor):
+    """Thêm index cho các cột join/lọc của các truy vấn nóng"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_approved_admin_name ON users (is_approved, is_admin, full_name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_votes_session_user ON votes (session_date, user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_votes_user_created ON votes (user_id, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_vote_sessions_date ON vote_sessions (session_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_rankings_user ON rankings (user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_finances_user_type ON finances (user_id, transaction_type, amount)')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_finances_expense_session
+        ON finances (transaction_type, session_date, description, amount, created_at, total_participants)
+    ''')
+
+def migrate_rankings_win_count(cursor):
+    """Mỗi dòng rankings lưu số trận thắng của một lần nhập kết quả thay vì một dòng cho mỗi trận thắng"""
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(rankings)')]
+    if 'wins' not in columns:
+        cursor.execute('ALTER TABLE rankings ADD COLUMN wins INTEGER NOT NULL DEFAULT 1')
+    
+    # Gộp các dòng trùng do add_ranking cũ tạo ra (cùng thành viên, trận đấu và thời điểm nhập)
+    cursor.execute('DROP TABLE IF EXISTS temp.ranking_groups')
+    cursor.execute('''
+        CREATE TEMP TABLE ranking_groups AS
+        SELECT MIN(id) as keep_id, SUM(wins) as total_wins
+        FROM rankings
+        GROUP BY user_id, match_date, location, score, created_at
+    ''')
+    cursor.execute('''
+        UPDATE rankings
+        SET wins = (SELECT total_wins FROM ranking_groups WHERE keep_id = rankings.id)
+        WHERE id IN (SELECT keep_id FROM ranking_groups)
+    ''')
+    cursor.execute('DELETE FROM rankings WHERE id NOT IN (SELECT keep_id FROM ranking_groups)')
+    cursor.execute('DROP TABLE temp.ranking_groups')
+    
+    # Index phủ cho bảng xếp hạng: SUM(wins) theo user_id không cần đọc bảng
+    cursor.execute('DROP INDEX IF EXISTS idx_rankings_user')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_rankings_user_wins ON rankings (user_id, wins)')
+
+# Tổng hợp số dư từng thành viên trực tiếp từ sổ cái finances
+LEDGER_BALANCES_SQL = '''
+    SELECT f.user_id,
+           COALESCE(SUM(CASE WHEN f.transaction_type = 'contribution' THEN f.amount ELSE 0 END), 0) as total_contribution,
+           COALESCE(SUM(CASE WHEN f.transaction_type = 'expense' THEN f.amount ELSE 0 END), 0) as total_expenses,
+           COUNT(CASE WHEN f.transaction_type = 'expense' THEN 1 END) as sessions_attended,
+           COALESCE(SUM(f.amount), 0) as balance
+    FROM finances f
+    WHERE f.user_id IS NOT NULL
+    GROUP BY f.user_id
+'''
+
+# Số dư đầy đủ = phần chuyển sang khi lưu trữ sổ cái cũ + sổ cái hiện tại
+MEMBER_BALANCES_SQL = f'''
+    SELECT user_id,
+           SUM(total_contribution) as total_contribution,
+           SUM(total_expenses) as total_expenses,
+           SUM(sessions_attended) as sessions_attended,
+           SUM(balance) as balance
+    FROM (
+        SELECT user_id, total_contribution, total_expenses, sessions_attended, balance
+        FROM finance_carry_forward
+        UNION ALL
+        {LEDGER_BALANCES_SQL}
+    )
+    GROUP BY user_id
+'''
+
+def rebuild_member_balances_table(cursor, balances_sql=LEDGER_BALANCES_SQL):
+    """Tính lại toàn bộ member_balances từ sổ cái (chạy trong transaction của caller)"""
+    cursor.execute('DELETE FROM member_balances')
+    cursor.execute(f'''
+        INSERT INTO member_balances (user_id, total_contribution, total_expenses, sessions_attended, balance)
+        {balances_sql}
+    ''')
+
+def migrate_member_balances(cursor):
+    """Bảng số dư từng thành viên, cập nhật bằng trigger trong cùng transaction ghi sổ cái"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS member_balances (
+            user_id INTEGER PRIMARY KEY,
+            total_contribution INTEGER NOT NULL DEFAULT 0,
+            total_expenses INTEGER NOT NULL DEFAULT 0,
+            sessions_attended INTEGER NOT NULL DEFAULT 0,
+            balance INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    
+    # Cộng dòng mới vào số dư
+    add_new_row = '''
+        INSERT INTO member_balances (user_id, total_contribution, total_expenses, sessions_attended, balance)
+        SELECT NEW.user_id,
+               CASE WHEN NEW.transaction_type = 'contribution' THEN COALESCE(NEW.amount, 0) ELSE 0 END,
+               CASE WHEN NEW.transaction_type = 'expense' THEN COALESCE(NEW.amount, 0) ELSE 0 END,
+               CASE WHEN NEW.transaction_type = 'expense' THEN 1 ELSE 0 END,
+               COALESCE(NEW.amount, 0)
+        WHERE NEW.user_id IS NOT NULL
+        ON CONFLICT (user_id) DO UPDATE SET
+            total_contribution = total_contribution + excluded.total_contribution,
+            total_expenses = total_expenses + excluded.total_expenses,
+            sessions_attended = sessions_attended + excluded.sessions_attended,
+            balance = balance + excluded.balance;
+    '''
+    # Trừ dòng cũ khỏi số dư
+    remove_old_row = '''
+        UPDATE member_balances SET
+            total_contribution = total_contribution - CASE WHEN OLD.transaction_type = 'contribution' THEN COALESCE(OLD.amount, 0) ELSE 0 END,
+            total_expenses = total_expenses - CASE WHEN OLD.transaction_type = 'expense' THEN COALESCE(OLD.amount, 0) ELSE 0 END,
+            sessions_attended = sessions_attended - CASE WHEN OLD.transaction_type = 'expense' THEN 1 ELSE 0 END,
+            balance = balance - COALESCE(OLD.amount, 0)
+        WHERE user_id = OLD.user_id;
+    '''
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS trg_finances_balance_insert AFTER INSERT ON finances BEGIN {add_new_row} END')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS trg_finances_balance_delete AFTER DELETE ON finances BEGIN {remove_old_row} END')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS trg_finances_balance_update AFTER UPDATE ON finances BEGIN {remove_old_row} {add_new_row} END')
+    
+    rebuild_member_balances_table(cursor)
+
+def migrate_expense_history_keyset_index(cursor):
+    """Index theo đúng thứ tự phân trang lịch sử chi phí để LIMIT dừng sớm"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_finances_expense_keyset
+        ON finances (transaction_type, session_date, created_at, description, amount, total_participants)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_finances_expense_session')
+
+def migrate_votes_session_id(cursor):
+    """Liên kết votes với vote_sessions bằng khóa số session_id, mỗi thành viên vote một lần mỗi phiên"""
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(votes)')]
+    if 'session_id' in columns:
+        return
+    
+    # SQLite không thêm được ràng buộc UNIQUE/FOREIGN KEY vào bảng cũ nên tạo lại bảng votes
+    cursor.execute('''
+        CREATE TABLE votes_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            session_id INTEGER,
+            session_date TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (session_id) REFERENCES vote_sessions (id),
+            UNIQUE (user_id, session_id)
+        )
+    ''')
+    # Vote cũ gắn theo ngày: gán vào phiên đầu tiên của ngày đó, vote trùng chỉ giữ lần đầu
+    cursor.execute('''
+        INSERT OR IGNORE INTO votes_new (id, user_id, session_id, session_date, created_at)
+        SELECT v.id, v.user_id,
+               (SELECT MIN(vs.id) FROM vote_sessions vs WHERE vs.session_date = v.session_date),
+               v.session_date, v.created_at
+        FROM votes v
+        WHERE v.user_id IS NOT NULL
+        ORDER BY v.id
+    ''')
+    cursor.execute('DROP TABLE votes')
+    cursor.execute('ALTER TABLE votes_new RENAME TO votes')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_votes_session_user ON votes (session_id, user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_votes_user_created ON votes (user_id, created_at)')
+
+def migrate_expense_events(cursor):
+    """Một dòng expense_events cho mỗi lần chia chi phí; các dòng finances trỏ về qua expense_event_id"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS expense_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER,
+            session_date TEXT NOT NULL,
+            description TEXT,
+            court_fee INTEGER NOT NULL DEFAULT 0,
+            water_fee INTEGER NOT NULL DEFAULT 0,
+            other_fee INTEGER NOT NULL DEFAULT 0,
+            total_amount INTEGER NOT NULL,
+            participants INTEGER NOT NULL,
+            cost_per_person INTEGER NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES vote_sessions (id)
+        )
+    ''')
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(finances)')]
+    if 'expense_event_id' not in columns:
+        cursor.execute('ALTER TABLE finances ADD COLUMN expense_event_id INTEGER REFERENCES expense_events (id)')
+    
+    # Dựng header cho chi phí cũ theo đúng cách lịch sử chi phí từng gom các dòng
+    cursor.execute('''
+        INSERT INTO expense_events (session_id, session_date, description, court_fee, water_fee, other_fee,
+                                    total_amount, participants, cost_per_person, created_at)
+        SELECT (SELECT MIN(vs.id) FROM vote_sessions vs WHERE vs.session_date = f.session_date),
+               COALESCE(f.session_date, ''), f.description,
+               COALESCE(SUM(f.court_fee), 0), COALESCE(SUM(f.water_fee), 0), COALESCE(SUM(f.other_fee), 0),
+               SUM(-f.amount), COUNT(*), MIN(-f.amount), f.created_at
+        FROM finances f
+        WHERE f.transaction_type = 'expense' AND f.expense_event_id IS NULL
+        GROUP BY f.session_date, f.created_at, f.description
+        ORDER BY f.session_date, f.created_at
+    ''')
+    cursor.execute('CREATE INDEX idx_expense_events_backfill ON expense_events (session_date, created_at)')
+    cursor.execute('''
+        UPDATE finances SET expense_event_id = e.id
+        FROM expense_events e
+        WHERE finances.transaction_type = 'expense' AND finances.expense_event_id IS NULL
+          AND e.session_date = COALESCE(finances.session_date, '')
+          AND e.created_at = finances.created_at
+          AND e.description IS finances.description
+    ''')
+    cursor.execute('DROP INDEX idx_expense_events_backfill')
+    
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_expense_events_keyset ON expense_events (session_date, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_finances_expense_event ON finances (expense_event_id)')
+    # Lịch sử chi phí không còn đọc sổ cái nên bỏ index phân trang cũ
+    cursor.execute('DROP INDEX IF EXISTS idx_finances_expense_keyset')
+
+# Cảnh báo tính sẵn trong bảng alerts; ngưỡng lưu trong app_settings
+ALERT_SETTING_DEFAULTS = {
+    'low_balance_threshold': 100000,
+    'low_activity_min_votes': 3,
+    'low_activity_days': 30,
+    'alert_sweep_minutes': 60,
+}
+
+LOW_BALANCE_ALERTS_SQL = '''
+    INSERT INTO alerts (user_id, alert_type, value, generated_at)
+    SELECT u.id, 'low_balance', COALESCE(b.balance, 0), ?
+    FROM users u
+    LEFT JOIN member_balances b ON u.id = b.user_id
+    WHERE u.is_approved = 1 AND u.is_admin = 0 AND COALESCE(b.balance, 0) < ? {user_filter}
+'''
+
+LOW_ACTIVITY_ALERTS_SQL = '''
+    INSERT INTO alerts (user_id, alert_type, value, generated_at)
+    SELECT u.id, 'low_activity', COUNT(v.id), ?
+    FROM users u
+    LEFT JOIN votes v ON u.id = v.user_id AND v.created_at >= ?
+    WHERE u.is_approved = 1 AND u.is_admin = 0 {user_filter}
+    GROUP BY u.id
+    HAVING COUNT(v.id) < ?
+'''
+
+def read_alert_settings(cursor):
+    """Ngưỡng cảnh báo (mặc định nếu chưa cấu hình), thời điểm quét toàn bộ gần nhất và mốc đã lưu trữ"""
+    settings = dict(ALERT_SETTING_DEFAULTS, alerts_swept_at=None, archived_through=None)
+    for key, value in cursor.execute('SELECT key, value FROM app_settings'):
+        if key in ALERT_SETTING_DEFAULTS:
+            settings[key] = int(value)
+        elif key in ('alerts_swept_at', 'archived_through'):
+            settings[key] = value
+    return settings
+
+def write_setting(cursor, key, value):
+    cursor.execute('''
+        INSERT INTO app_settings (key, value, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT (key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+    ''', (key, str(value), datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+def refresh_alerts(cursor, user_ids=None):
+    """Tính lại cảnh báo cho user_ids (None = toàn bộ) trong transaction của người gọi"""
+    settings = read_alert_settings(cursor)
+    now = datetime.now()
+    generated_at = now.strftime('%Y-%m-%d %H:%M:%S')
+    since = (now - timedelta(days=settings['low_activity_days'])).strftime('%Y-%m-%d')
+    
+    if user_ids is None:
+        ids = []
+        user_filter = ''
+        cursor.execute('DELETE FROM alerts')
+    else:
+        ids = sorted(set(user_ids))
+        if not ids:
+            return
+        placeholders = ', '.join('?' * len(ids))
+        user_filter = f'AND u.id IN ({placeholders})'
+        cursor.execute(f'DELETE FROM alerts WHERE user_id IN ({placeholders})', ids)
+    
+    cursor.execute(LOW_BALANCE_ALERTS_SQL.format(user_filter=user_filter),
+                   [generated_at, settings['low_balance_threshold'], *ids])
+    cursor.execute(LOW_ACTIVITY_ALERTS_SQL.format(user_filter=user_filter),
+                   [generated_at, since, *ids, settings['low_activity_min_votes']])
+    
+    if user_ids is None:
+        write_setting(cursor, 'alerts_swept_at', generated_at)
+
+def migrate_alerts(cursor):
+    """Bảng alerts tính sẵn và bảng app_settings chứa ngưỡng cảnh báo"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS app_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS alerts (
+            user_id INTEGER NOT NULL,
+            alert_type TEXT NOT NULL,
+            value INTEGER NOT NULL,
+            generated_at TEXT NOT NULL,
+            PRIMARY KEY (user_id, alert_type),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    cursor.executemany('INSERT OR IGNORE INTO app_settings (key, value) VALUES (?, ?)',
+                       [(key, str(value)) for key, value in ALERT_SETTING_DEFAULTS.items()])
+    refresh_alerts(cursor)
+
+def migrate_carry_forward(cursor):
+    """Số dư và số trận thắng chuyển sang từ các dòng đã chuyển vào file lưu trữ"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS finance_carry_forward (
+            user_id INTEGER PRIMARY KEY,
+            total_contribution INTEGER NOT NULL DEFAULT 0,
+            total_expenses INTEGER NOT NULL DEFAULT 0,
+            sessions_attended INTEGER NOT NULL DEFAULT 0,
+            balance INTEGER NOT NULL DEFAULT 0,
+            archived_through TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ranking_carry_forward (
+            user_id INTEGER PRIMARY KEY,
+            wins INTEGER NOT NULL DEFAULT 0,
+            archived_through TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+def migrate_balance_checkpoints(cursor):
+    """Số dư từng thành viên tại đầu mỗi tháng; checkpoint được tạo dần khi cần (xem ensure_balance_checkpoints)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS balance_checkpoints (
+            checkpoint_date TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            total_contribution INTEGER NOT NULL DEFAULT 0,
+            total_expenses INTEGER NOT NULL DEFAULT 0,
+            sessions_attended INTEGER NOT NULL DEFAULT 0,
+            balance INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (checkpoint_date, user_id)
+        ) WITHOUT ROWID
+    ''')
+    # Index phủ cho phần chênh lệch giữa checkpoint và ngày cần tra (mọi thành viên / một thành viên);
+    # index theo user_id có thêm created_at nên thay được idx_finances_user_type
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_finances_created
+        ON finances (created_at, user_id, transaction_type, amount)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_finances_user_created
+        ON finances (user_id, created_at, transaction_type, amount)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_finances_user_type')
+    # Dòng ghi lùi ngày làm sai các checkpoint sau nó: xóa để lần tra sau tạo lại
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_finances_checkpoint_insert AFTER INSERT ON finances BEGIN
+            DELETE FROM balance_checkpoints WHERE checkpoint_date > NEW.created_at;
+        END
+    ''')
+
+# Thống kê theo tháng: tháng của một dòng sổ cái là tháng buổi tập (chi phí) hoặc tháng ghi nhận (đóng quỹ)
+ROLLUP_MONTH_SQL = "substr(COALESCE(NULLIF({row}.session_date, ''), {row}.created_at), 1, 7)"
+ROLLUP_COLUMNS = ['sessions_attended', 'spend', 'contributions']
+ROLLUP_CHUNK_SIZE = 50000
+
+def ledger_month_totals(chunk):
+    """Gom một khối dòng sổ cái thành tổng theo (user_id, month) bằng phép toán vector"""
+    session_date = chunk['session_date'].fillna('')
+    is_expense = chunk['transaction_type'] == 'expense'
+    amount = chunk['amount'].fillna(0).astype('int64')
+    totals = pd.DataFrame({
+        'user_id': chunk['user_id'],
+        'month': session_date.where(session_date != '', chunk['created_at']).str[:7],
+        'sessions_attended': is_expense.astype('int64'),
+        'spend': (-amount).where(is_expense, 0),
+        'contributions': amount.where(chunk['transaction_type'] == 'contribution', 0),
+    })
+    return totals.groupby(['user_id', 'month'], as_index=False)[ROLLUP_COLUMNS].sum()
+
+def rebuild_monthly_rollups(cursor):
+    """Tính lại toàn bộ thống kê tháng từ sổ cái (gồm file lưu trữ nếu đang gắn) bằng groupby theo từng khối"""
+    conn = cursor.connection
+    partials = [pd.DataFrame(columns=['user_id', 'month', *ROLLUP_COLUMNS])]
+    for source in ledger_sources(cursor):
+        for chunk in pd.read_sql_query(f'''
+            SELECT user_id, transaction_type, amount, session_date, created_at
+            FROM {source}
+            WHERE user_id IS NOT NULL
+        ''', conn, chunksize=ROLLUP_CHUNK_SIZE):
+            partials.append(ledger_month_totals(chunk))
+    # Cộng các tổng từng khối (một (user_id, month) có thể nằm ở nhiều khối)
+    members = pd.concat(partials).groupby(['user_id', 'month'], as_index=False)[ROLLUP_COLUMNS].sum()
+    
+    events = pd.read_sql_query('SELECT session_date FROM expense_events', conn)
+    sessions_held = events['session_date'].str[:7].value_counts().rename('sessions_held')
+    club = members.groupby('month')[ROLLUP_COLUMNS].sum().rename(columns={'sessions_attended': 'attendances'})
+    club = club.join(sessions_held, how='outer').fillna(0).astype('int64')
+    
+    cursor.execute('DELETE FROM monthly_member_rollups')
+    cursor.execute('DELETE FROM monthly_club_rollups')
+    cursor.executemany('''
+        INSERT INTO monthly_member_rollups (user_id, month, sessions_attended, spend, contributions)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(int(user_id), month, int(sessions), int(spend), int(contributions))
+          for user_id, month, sessions, spend, contributions in members.itertuples(index=False)])
+    cursor.executemany('''
+        INSERT INTO monthly_club_rollups (month, sessions_held, attendances, spend, contributions)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(month, int(row.sessions_held), int(row.attendances), int(row.spend), int(row.contributions))
+          for month, row in club.iterrows()])
+
+def migrate_monthly_rollups(cursor):
+    """Thống kê theo tháng cho từng thành viên và toàn CLB, cập nhật bằng trigger trong cùng transaction ghi"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_member_rollups (
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            sessions_attended INTEGER NOT NULL DEFAULT 0,
+            spend INTEGER NOT NULL DEFAULT 0,
+            contributions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, month)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_club_rollups (
+            month TEXT PRIMARY KEY,
+            sessions_held INTEGER NOT NULL DEFAULT 0,
+            attendances INTEGER NOT NULL DEFAULT 0,
+            spend INTEGER NOT NULL DEFAULT 0,
+            contributions INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    
+    # Chỉ cộng khi ghi thêm: dòng chuyển sang file lưu trữ vẫn được tính trong thống kê
+    month = ROLLUP_MONTH_SQL.format(row='NEW')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_finances_rollup_insert AFTER INSERT ON finances
+        WHEN NEW.user_id IS NOT NULL BEGIN
+            INSERT INTO monthly_member_rollups (user_id, month, sessions_attended, spend, contributions)
+            VALUES (NEW.user_id, {month},
+                    CASE WHEN NEW.transaction_type = 'expense' THEN 1 ELSE 0 END,
+                    CASE WHEN NEW.transaction_type = 'expense' THEN -COALESCE(NEW.amount, 0) ELSE 0 END,
+                    CASE WHEN NEW.transaction_type = 'contribution' THEN COALESCE(NEW.amount, 0) ELSE 0 END)
+            ON CONFLICT (user_id, month) DO UPDATE SET
+                sessions_attended = sessions_attended + excluded.sessions_attended,
+                spend = spend + excluded.spend,
+                contributions = contributions + excluded.contributions;
+            INSERT INTO monthly_club_rollups (month, attendances, spend, contributions)
+            VALUES ({month},
+                    CASE WHEN NEW.transaction_type = 'expense' THEN 1 ELSE 0 END,
+                    CASE WHEN NEW.transaction_type = 'expense' THEN -COALESCE(NEW.amount, 0) ELSE 0 END,
+                    CASE WHEN NEW.transaction_type = 'contribution' THEN COALESCE(NEW.amount, 0) ELSE 0 END)
+            ON CONFLICT (month) DO UPDATE SET
+                attendances = attendances + excluded.attendances,
+                spend = spend + excluded.spend,
+                contributions = contributions + excluded.contributions;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_expense_events_rollup_insert AFTER INSERT ON expense_events BEGIN
+            INSERT INTO monthly_club_rollups (month, sessions_held) VALUES (substr(NEW.session_date, 1, 7), 1)
+            ON CONFLICT (month) DO UPDATE SET sessions_held = sessions_held + 1;
+        END
+    ''')
+    
+    rebuild_monthly_rollups(cursor)
+
+def rebuild_rollups():
+    """Tính lại thống kê tháng từ sổ cái, kể cả phần đã lưu trữ"""
+    try:
+        run_write_transaction(rebuild_monthly_rollups, archive=os.path.exists(ARCHIVE_DB_FILE))
+        invalidate_tables('monthly_member_rollups', 'monthly_club_rollups')
+        return True, "Đã tính lại thống kê theo tháng!"
+    except Exception as e:
+        return False, f"Lỗi tính lại thống kê tháng: {str(e)}"
+
+def migrate_match_ratings(cursor):
+    """Trận đấu có đối thủ và điểm Elo của từng thành viên, cập nhật ngay khi ghi kết quả trận"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS matches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            match_date TEXT NOT NULL,
+            location TEXT,
+            score TEXT,
+            winning_team INTEGER NOT NULL CHECK (winning_team IN (1, 2)),
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_matches_date ON matches (match_date, id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS match_participants (
+            match_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            team INTEGER NOT NULL CHECK (team IN (1, 2)),
+            rating_before REAL NOT NULL,
+            rating_after REAL NOT NULL,
+            PRIMARY KEY (match_id, user_id),
+            FOREIGN KEY (match_id) REFERENCES matches (id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_match_participants_user ON match_participants (user_id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS player_ratings (
+            user_id INTEGER PRIMARY KEY,
+            rating REAL NOT NULL,
+            matches_played INTEGER NOT NULL DEFAULT 0,
+            wins INTEGER NOT NULL DEFAULT 0,
+            last_match_date TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_player_ratings_rating ON player_ratings (rating)')
+    # Dòng rankings của đội thắng trỏ về trận để sửa/xóa trận thì sửa luôn số trận thắng
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(rankings)')]
+    if 'match_id' not in columns:
+        cursor.execute('ALTER TABLE rankings ADD COLUMN match_id INTEGER')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_rankings_match ON rankings (match_id)')
+
+# Tìm thành viên: unicode61 bỏ dấu nhưng coi đ là chữ riêng, nên đ/Đ được đổi thành d/D trước khi đánh chỉ mục
+MEMBER_SEARCH_COLUMNS = ('full_name', 'email', 'phone')
+FOLD_D_SQL = "replace(replace({value}, 'đ', 'd'), 'Đ', 'D')"
+
+def fts5_available(cursor):
+    return any(row[0] == 'ENABLE_FTS5' for row in cursor.execute('PRAGMA compile_options'))
+
+def migrate_member_search(cursor):
+    """Chỉ mục FTS5 users_fts (rowid = users.id) đồng bộ bằng trigger để tìm thành viên không phân biệt dấu"""
+    if not fts5_available(cursor):
+        return  # SQLite không có FTS5: search_members dùng LIKE
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+            full_name, email, phone,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    ''')
+    columns = ', '.join(MEMBER_SEARCH_COLUMNS)
+    values = ', '.join(FOLD_D_SQL.format(value=f'NEW.{column}') for column in MEMBER_SEARCH_COLUMNS)
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_users_fts_insert AFTER INSERT ON users BEGIN
+            INSERT INTO users_fts (rowid, {columns}) VALUES (NEW.id, {values});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_users_fts_update AFTER UPDATE OF {columns} ON users BEGIN
+            DELETE FROM users_fts WHERE rowid = OLD.id;
+            INSERT INTO users_fts (rowid, {columns}) VALUES (NEW.id, {values});
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_fts_delete AFTER DELETE ON users BEGIN
+            DELETE FROM users_fts WHERE rowid = OLD.id;
+        END
+    ''')
+    
+    cursor.execute('DELETE FROM users_fts')
+    cursor.execute(f'''
+        INSERT INTO users_fts (rowid, {columns})
+        SELECT id, {values.replace('NEW.', '')} FROM users
+    ''')
+
+def migrate_alerts_order_index(cursor):
+    """Index theo loại cảnh báo và giá trị: trang cảnh báo đọc theo index, không quét bảng alerts"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_alerts_type_value ON alerts (alert_type, value)')
+
+def migrate_checkpoint_invalidation(cursor):
+    """Sửa hoặc xóa dòng sổ cái cũng làm sai các checkpoint sau nó (trước đây chỉ bắt INSERT)"""
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_finances_checkpoint_update
+        AFTER UPDATE OF user_id, amount, transaction_type, created_at ON finances BEGIN
+            DELETE FROM balance_checkpoints WHERE checkpoint_date > min(OLD.created_at, NEW.created_at);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_finances_checkpoint_delete AFTER DELETE ON finances BEGIN
+            DELETE FROM balance_checkpoints WHERE checkpoint_date > OLD.created_at;
+        END
+    ''')
+
+# Danh sách migration theo thứ tự; chỉ thêm mới ở cuối, không sửa migration cũ
+MIGRATIONS = [
+    (1, migrate_hot_query_indexes),
+    (2, migrate_rankings_win_count),
+    (3, migrate_member_balances),
+    (4, migrate_expense_history_keyset_index),
+    (5, migrate_votes_session_id),
+    (6, migrate_alerts),
+    (7, migrate_expense_events),
+    (8, migrate_carry_forward),
+    (9, migrate_balance_checkpoints),
+    (10, migrate_monthly_rollups),
+    (11, migrate_match_ratings),
+    (12, migrate_member_search),
+    (13, migrate_alerts_order_index),
+    (14, migrate_checkpoint_invalidation),
+]
+
+def run_migrations(conn):
+    """Áp dụng lần lượt các migration chưa chạy, mỗi migration một transaction"""
+    cursor = conn.cursor()
+    
+    # Gắn file lưu trữ (nếu có) để migration dựng lại dữ liệu tổng hợp từ cả phần đã lưu trữ
+    pending = cursor.execute('PRAGMA user_version').fetchone()[0] < MIGRATIONS[-1][0]
+    attached = pending and os.path.exists(ARCHIVE_DB_FILE)
+    if attached:
+        attach_archive(conn)
+    
+    try:
+        for version, migration in MIGRATIONS:
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                # Đọc lại version trong transaction để tránh hai tiến trình cùng chạy một migration
+                current_version = cursor.execute('PRAGMA user_version').fetchone()[0]
+                if version <= current_version:
+                    conn.rollback()
+                    continue
+                
+                migration(cursor)
+                cursor.execute(f'PRAGMA user_version = {version}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    finally:
+        if attached:
+            detach_archive(conn)
 
 # Database initialization
 def init_database():
     """Khởi tạo database SQLite với file cố định"""
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_db_connection()
         cursor = conn.cursor()
         
         # Users table
@@ -250,6 +1179,7 @@ def init_database():
                   datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
         
         conn.commit()
+        run_migrations(conn)
         conn.close()
         return True
     except Exception as e:
@@ -257,34 +1187,306 @@ def init_database():
         return False
 
 def get_db_connection():
-    """Tạo kết nối database an toàn"""
-    return sqlite3.connect(DB_FILE, check_same_thread=False)
+    """Lấy kết nối từ pool (gọi close() để trả lại pool)"""
+    return get_connection_pool().acquire()
+
+# Cache kết quả đọc, tự vô hiệu hóa khi bảng liên quan được ghi
+QUERY_CACHE_SIZE = 128
+
+class QueryCache:
+    """LRU cache cho các helper đọc; khóa gồm thế hệ (generation) hiện tại của các bảng được đọc"""
+
+    def __init__(self, max_size=QUERY_CACHE_SIZE):
+        self.max_size = max_size
+        self.generations = {}
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def make_key(self, name, args, tables):
+        return (name, args, self.generation(*tables))
+
+    def generation(self, *tables):
+        with self._lock:
+            return tuple(self.generations.get(table, 0) for table in tables)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def bump(self, *tables):
+        # Các khóa cũ không còn được tra tới và sẽ bị LRU đẩy ra dần
+        with self._lock:
+            for table in tables:
+                self.generations[table] = self.generations.get(table, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'generations': dict(self.generations),
+            }
+
+@st.cache_resource
+def get_query_cache():
+    """Cache truy vấn dùng chung cho cả tiến trình"""
+    return QueryCache()
+
+def invalidate_tables(*tables):
+    """Gọi sau khi commit để các kết quả đọc từ những bảng này được truy vấn lại"""
+    get_query_cache().bump(*tables)
+
+def cached_query(*tables, error_message, empty_result=pd.DataFrame):
+    """Decorator cache kết quả helper đọc theo tham số và thế hệ của các bảng được đọc"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            cache = get_query_cache()
+            key = cache.make_key(func.__name__, args, tables)
+            found, result = cache.get(key)
+            if not found:
+                try:
+                    result = func(*args)
+                except Exception as e:
+                    st.error(f"{error_message}: {str(e)}")
+                    return empty_result()
+                cache.put(key, result)
+            # Trả bản sao để trang hiển thị sửa DataFrame không làm hỏng cache
+            return result.copy() if isinstance(result, pd.DataFrame) else result
+        return wrapper
+    return decorator
+
+# Transaction ghi có thử lại khi database đang bận (SQLITE_BUSY/SQLITE_LOCKED)
+WRITE_RETRY_ATTEMPTS = 4
+WRITE_RETRY_BASE_DELAY_MS = 25
+WRITE_RETRY_MAX_DELAY_MS = 1000
+
+def is_busy_error(error):
+    """Lỗi do database đang bị khóa bởi kết nối khác (thử lại có thể thành công)"""
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        # Mã mở rộng (vd. SQLITE_BUSY_SNAPSHOT) giữ mã chính ở 8 bit thấp
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return 'database is locked' in str(error) or 'database table is locked' in str(error)
+
+class WriteRetryStats:
+    """Đếm transaction ghi, số lần thử lại và số lần bỏ cuộc theo từng hàm ghi"""
+
+    def __init__(self):
+        self.functions = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, retries, succeeded):
+        with self._lock:
+            entry = self.functions.setdefault(name, {'transactions': 0, 'retries': 0, 'gave_up': 0})
+            entry['transactions'] += 1
+            entry['retries'] += retries
+            if not succeeded:
+                entry['gave_up'] += 1
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(entry) for name, entry in self.functions.items()}
+
+@st.cache_resource
+def get_write_retry_stats():
+    """Thống kê thử lại dùng chung cho cả tiến trình"""
+    return WriteRetryStats()
+
+def retry_delay(attempt):
+    """Exponential backoff có jitter để các kết nối đang tranh nhau không thử lại cùng lúc"""
+    delay_ms = min(WRITE_RETRY_MAX_DELAY_MS, WRITE_RETRY_BASE_DELAY_MS * 2 ** attempt)
+    return random.uniform(delay_ms / 2, delay_ms) / 1000
+
+def attach_archive(conn):
+    """Gắn file lưu trữ vào kết nối với tên schema archive (phải gọi ngoài transaction)"""
+    conn.execute('ATTACH DATABASE ? AS archive', (ARCHIVE_DB_FILE,))
+    try:
+        conn.execute('PRAGMA archive.journal_mode = WAL')
+    except Exception:
+        # Không để kết nối trong pool còn gắn file lưu trữ (lần ATTACH sau sẽ lỗi "already in use")
+        detach_archive(conn)
+        raise
+
+def detach_archive(conn):
+    """Gỡ file lưu trữ trước khi trả kết nối về pool (bỏ qua nếu kết nối chưa gắn)"""
+    if conn.in_transaction:
+        conn.rollback()
+    if 'archive' in [row[1] for row in conn.execute('PRAGMA database_list')]:
+        conn.execute('DETACH DATABASE archive')
+
+def archive_tables(cursor):
+    """Các bảng đang có trong file lưu trữ (rỗng nếu kết nối chưa gắn file lưu trữ)"""
+    if 'archive' not in [row[1] for row in cursor.execute('PRAGMA database_list')]:
+        return set()
+    return {row[0] for row in cursor.execute("SELECT name FROM archive.sqlite_master WHERE type = 'table'")}
+
+def run_write_transaction(func, *args, pool=None, retry_stats=None, archive=False):
+    """Chạy func(cursor, *args) trong BEGIN IMMEDIATE rồi commit; thử lại có giới hạn khi database bận (archive=True gắn thêm file lưu trữ)"""
+    pool = pool or get_connection_pool()
+    retry_stats = retry_stats or get_write_retry_stats()
+    
+    for attempt in range(WRITE_RETRY_ATTEMPTS + 1):
+        conn = pool.acquire()
+        attached = False
+        try:
+            if archive:
+                attach_archive(conn)
+                attached = True
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            result = func(cursor, *args)
+            conn.commit()
+            retry_stats.record(func.__name__, attempt, True)
+            return result
+        except Exception as e:
+            if not is_busy_error(e) or attempt == WRITE_RETRY_ATTEMPTS:
+                retry_stats.record(func.__name__, attempt, False)
+                raise
+        finally:
+            if attached:
+                detach_archive(conn)
+            # Trả về pool; transaction dang dở (nếu lỗi) được rollback khi trả
+            conn.close()
+        time.sleep(retry_delay(attempt))
+
+# Ghi theo lô (group commit): một luồng ghi gom các yêu cầu ghi và commit chung một lần
+WRITE_BATCH_MAX = 64
+WRITE_BATCH_WAIT_MS = 5
+WRITE_RESULT_TIMEOUT_S = 30
+
+class WriteQueue:
+    """Luồng ghi duy nhất; mỗi yêu cầu chạy trong SAVEPOINT riêng nên lỗi của một yêu cầu không làm hỏng cả lô"""
+
+    def __init__(self, pool, retry_stats, max_batch=WRITE_BATCH_MAX, wait_ms=WRITE_BATCH_WAIT_MS):
+        self.pool = pool
+        self.retry_stats = retry_stats
+        self.max_batch = max_batch
+        self.wait_ms = wait_ms
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='pickleball-write-queue', daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args):
+        """Xếp hàng func(cursor, *args); Future trả kết quả sau khi lô chứa nó đã commit"""
+        future = Future()
+        self._queue.put((func, args, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Chờ thêm vài ms để gom các yêu cầu đến cùng lúc vào một commit
+            deadline = time.monotonic() + self.wait_ms / 1000
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._commit_batch(batch)
+
+    def apply_batch(self, cursor, futures):
+        outcomes = []
+        for func, args, future in futures:
+            cursor.execute('SAVEPOINT write_item')
+            try:
+                result = func(cursor, *args)
+            except Exception as e:
+                cursor.execute('ROLLBACK TO write_item')
+                cursor.execute('RELEASE write_item')
+                outcomes.append((future, None, e))
+            else:
+                cursor.execute('RELEASE write_item')
+                outcomes.append((future, result, None))
+        return outcomes
+
+    def _commit_batch(self, batch):
+        futures = [(func, args, future) for func, args, future in batch if future.set_running_or_notify_cancel()]
+        try:
+            outcomes = run_write_transaction(self.apply_batch, futures, pool=self.pool, retry_stats=self.retry_stats)
+        except Exception as e:
+            # BEGIN/COMMIT vẫn thất bại sau khi thử lại: báo lỗi cho mọi yêu cầu trong lô
+            for func, args, future in futures:
+                future.set_exception(e)
+            return
+        
+        self.batches += 1
+        self.items += len(outcomes)
+        self.largest_batch = max(self.largest_batch, len(outcomes))
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'largest_batch': self.largest_batch,
+            'pending': self._queue.qsize(),
+        }
+
+@st.cache_resource
+def get_write_queue():
+    """Hàng đợi ghi dùng chung cho cả tiến trình"""
+    return WriteQueue(get_connection_pool(), get_write_retry_stats())
+
+def run_queued_write(func, *args):
+    """Ghi qua hàng đợi và chờ kết quả; lỗi của yêu cầu được ném lại cho người gọi"""
+    return get_write_queue().submit(func, *args).result(timeout=WRITE_RESULT_TIMEOUT_S)
 
 # Authentication functions
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
-def register_user(full_name, email, phone, birth_date, password):
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
+def insert_user(cursor, full_name, email, phone, birth_date, password, approved_by=None):
+    """Thêm tài khoản thành viên; approved_by khác None nghĩa là phê duyệt ngay"""
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if approved_by is None:
         cursor.execute('''
             INSERT INTO users (full_name, email, phone, birth_date, password, created_at)
             VALUES (?, ?, ?, ?, ?, ?)
-        ''', (full_name, email, phone, str(birth_date), hash_password(password), 
-              datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-        
-        conn.commit()
-        conn.close()
+        ''', (full_name, email, phone, str(birth_date), hash_password(password), now))
+    else:
+        cursor.execute('''
+            INSERT INTO users (full_name, email, phone, birth_date, password, is_approved, created_at, approved_at, approved_by)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (full_name, email, phone, str(birth_date), hash_password(password), 1, now, now, approved_by))
+        refresh_alerts(cursor, [cursor.lastrowid])
+    return cursor.lastrowid
+
+def register_user(full_name, email, phone, birth_date, password):
+    try:
+        run_write_transaction(insert_user, full_name, email, phone, birth_date, password)
+        invalidate_tables('users')
         return True, "Đăng ký thành công! Vui lòng chờ admin phê duyệt."
     except sqlite3.IntegrityError:
-        if conn:
-            conn.close()
         return False, "Email đã tồn tại!"
     except Exception as e:
-        if conn:
-            conn.close()
         return False, f"Lỗi đăng ký: {str(e)}"
 
 def login_user(email, password):
@@ -313,66 +1515,337 @@ def login_user(email, password):
     except Exception as e:
         return False, f"Lỗi đăng nhập: {str(e)}"
 
+# Các truy vấn nóng, dùng chung cho helper và check_query_plans()
+RANKINGS_SQL = '''
+    SELECT u.full_name,
+           COALESCE(SUM(r.wins), 0)
+           + COALESCE((SELECT c.wins FROM ranking_carry_forward c WHERE c.user_id = u.id), 0) as total_wins
+    FROM users u
+    LEFT JOIN rankings r ON u.id = r.user_id
+    WHERE u.is_approved = 1 AND u.is_admin = 0
+    GROUP BY u.id, u.full_name
+    ORDER BY total_wins DESC
+'''
+
+# Elo theo đội: mọi người trong đội được cộng/trừ cùng một lượng, tính từ điểm trung bình của hai đội
+ELO_INITIAL_RATING = 1500
+ELO_K_FACTOR = 32
+
+# Điểm của thành viên cho bảng xếp hạng trong bộ nhớ; {user_filter} để nạp lại vài người sau một trận
+PLAYER_RATINGS_SQL = f'''
+    SELECT u.id as user_id, u.full_name,
+           COALESCE(p.rating, {ELO_INITIAL_RATING}) as rating,
+           COALESCE(p.matches_played, 0) as matches_played,
+           COALESCE(p.wins, 0) as wins
+    FROM users u
+    LEFT JOIN player_ratings p ON p.user_id = u.id
+    WHERE u.is_approved = 1 AND u.is_admin = 0 {{user_filter}}
+'''
+
+RECENT_MATCHES_SQL = '''
+    SELECT m.id, m.match_date, m.location, m.score, m.winning_team,
+           GROUP_CONCAT(CASE WHEN p.team = 1 THEN u.full_name END, ', ') as team_one,
+           GROUP_CONCAT(CASE WHEN p.team = 2 THEN u.full_name END, ', ') as team_two
+    FROM (SELECT * FROM matches ORDER BY match_date DESC, id DESC LIMIT ?) m
+    JOIN match_participants p ON p.match_id = m.id
+    JOIN users u ON u.id = p.user_id
+    GROUP BY m.id
+    ORDER BY m.match_date DESC, m.id DESC
+'''
+
+# Số dòng mỗi trang cho các danh sách dài
+PAGE_SIZE = 20
+
+# Các truy vấn phân trang keyset: {keyset} là điều kiện "sau cursor" (rỗng ở trang đầu)
+APPROVED_MEMBERS_PAGE_SQL = '''
+    SELECT id, full_name, email, phone, birth_date
+    FROM users
+    WHERE is_approved = 1 AND is_admin = 0 {keyset}
+    ORDER BY full_name, id
+    LIMIT ?
+'''
+APPROVED_MEMBERS_KEYSET = 'AND (full_name, id) > (?, ?)'
+
+# Tìm thành viên đã phê duyệt: FTS5 xếp theo bm25, LIKE khi SQLite không có FTS5
+MEMBER_SEARCH_LIMIT = 20
+MEMBER_SEARCH_SQL = '''
+    SELECT u.id, u.full_name, u.email, u.phone, u.birth_date
+    FROM users_fts f
+    JOIN users u ON u.id = f.rowid
+    WHERE users_fts MATCH ? AND u.is_approved = 1 AND u.is_admin = 0
+    ORDER BY f.rank, u.full_name
+    LIMIT ?
+'''
+MEMBER_SEARCH_LIKE_SQL = '''
+    SELECT id, full_name, email, phone, birth_date
+    FROM users
+    WHERE is_approved = 1 AND is_admin = 0 AND (full_name LIKE ? OR email LIKE ? OR phone LIKE ?)
+    ORDER BY full_name, id
+    LIMIT ?
+'''
+
+VOTE_SESSIONS_SQL = '''
+    SELECT vs.id, vs.session_date, vs.description,
+           (SELECT COUNT(*) FROM votes v
+            JOIN users u ON v.user_id = u.id
+            WHERE v.session_id = vs.id AND u.is_admin = 0) as vote_count
+    FROM vote_sessions vs
+    {keyset}
+    ORDER BY vs.session_date DESC, vs.id DESC
+    LIMIT ?
+'''
+VOTE_SESSIONS_KEYSET = 'WHERE (vs.session_date, vs.id) < (?, ?)'
+
+
+VOTE_DETAILS_SQL = '''
+    SELECT u.full_name, v.created_at
+    FROM votes v
+    JOIN users u ON v.user_id = u.id
+    WHERE v.session_id = ? AND u.is_admin = 0
+    ORDER BY v.created_at
+'''
+
+SESSION_VOTERS_SQL = '''
+    SELECT v.user_id FROM votes v
+    JOIN users u ON v.user_id = u.id
+    WHERE v.session_id = ? AND u.is_admin = 0
+    ORDER BY v.user_id
+'''
+
+FINANCIAL_SUMMARY_SQL = '''
+    SELECT u.full_name,
+           COALESCE(b.total_contribution, 0) as total_contribution,
+           COALESCE(b.sessions_attended, 0) as sessions_attended,
+           COALESCE(b.total_expenses, 0) as total_expenses,
+           COALESCE(b.balance, 0) as balance
+    FROM users u
+    LEFT JOIN member_balances b ON u.id = b.user_id
+    WHERE u.is_approved = 1 AND u.is_admin = 0
+    ORDER BY balance DESC
+'''
+
+EXPENSE_HISTORY_SQL = '''
+    SELECT 
+        e.id,
+        e.session_date,
+        e.description,
+        e.participants as participants_count,
+        e.total_amount as total_cost,
+        e.cost_per_person,
+        e.court_fee,
+        e.water_fee,
+        e.other_fee,
+        e.created_at
+    FROM expense_events e
+    {keyset}
+    ORDER BY e.session_date DESC, e.id DESC
+    LIMIT ?
+'''
+EXPENSE_HISTORY_KEYSET = 'WHERE (e.session_date, e.id) < (?, ?)'
+
+# Xuất sổ cái: duyệt finances theo rowid nên không cần sort, đọc dần theo từng khối
+EXPORT_CHUNK_SIZE = 5000
+LEDGER_EXPORT_SQL = '''
+    SELECT f.id, f.created_at, f.user_id, u.full_name, u.email, f.transaction_type, f.amount,
+           f.description, f.session_date, f.court_fee, f.water_fee, f.other_fee,
+           f.total_participants, f.expense_event_id
+    FROM {source} f
+    LEFT JOIN users u ON u.id = f.user_id
+    WHERE f.created_at >= ? AND f.created_at < ? {member_filter}
+    ORDER BY f.id
+'''
+# Kiểu cố định cho từng cột để các khối Parquet dùng chung một schema
+LEDGER_EXPORT_COLUMNS = {
+    'id': 'int64', 'created_at': 'string', 'user_id': 'int64', 'full_name': 'string', 'email': 'string',
+    'transaction_type': 'string', 'amount': 'int64', 'description': 'string', 'session_date': 'string',
+    'court_fee': 'int64', 'water_fee': 'int64', 'other_fee': 'int64', 'total_participants': 'int64',
+    'expense_event_id': 'int64',
+}
+LEDGER_EXPORT_FORMATS = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+
+ALERTS_SQL = '''
+    SELECT u.full_name, a.alert_type, a.value, a.generated_at
+    FROM alerts a
+    JOIN users u ON u.id = a.user_id
+    WHERE a.alert_type IN ('low_balance', 'low_activity')
+    ORDER BY a.alert_type, a.value, u.full_name
+'''
+
+# Toàn bộ số liệu trang chủ trong một truy vấn; top 5 dùng LIMIT ngay trong SQL
+DASHBOARD_SNAPSHOT_SQL = '''
+    SELECT 'member_count' as kind, NULL as full_name, COUNT(*) as value
+    FROM users u
+    WHERE u.is_approved = 1 AND u.is_admin = 0
+    UNION ALL
+    SELECT 'total_balance', NULL, COALESCE(SUM(b.balance), 0)
+    FROM users u
+    JOIN member_balances b ON b.user_id = u.id
+    WHERE u.is_approved = 1 AND u.is_admin = 0
+    UNION ALL
+    SELECT * FROM (
+        SELECT 'winner', u.full_name,
+               COALESCE(SUM(r.wins), 0)
+               + COALESCE((SELECT c.wins FROM ranking_carry_forward c WHERE c.user_id = u.id), 0) as total_wins
+        FROM users u
+        LEFT JOIN rankings r ON r.user_id = u.id
+        WHERE u.is_approved = 1 AND u.is_admin = 0
+        GROUP BY u.id, u.full_name
+        ORDER BY total_wins DESC
+        LIMIT 5
+    )
+    UNION ALL
+    SELECT * FROM (
+        SELECT 'contributor', u.full_name, b.total_contribution
+        FROM users u
+        JOIN member_balances b ON b.user_id = u.id
+        WHERE u.is_approved = 1 AND u.is_admin = 0 AND b.total_contribution > 0
+        ORDER BY b.total_contribution DESC
+        LIMIT 5
+    )
+'''
+
+# Xu hướng theo tháng chỉ đọc bảng thống kê tháng, không quét sổ cái
+TREND_MONTHS = 24
+MEMBER_TREND_SQL = '''
+    SELECT month, sessions_attended, spend, contributions
+    FROM monthly_member_rollups
+    WHERE user_id = ? AND month >= ?
+    ORDER BY month
+'''
+CLUB_TREND_SQL = '''
+    SELECT month, sessions_held, attendances, spend, contributions
+    FROM monthly_club_rollups
+    WHERE month >= ?
+    ORDER BY month
+'''
+
+# Tên truy vấn -> (SQL, tham số mẫu, các bảng được phép SCAN vì phải liệt kê toàn bộ)
+HOT_QUERIES = {
+    'get_rankings': (RANKINGS_SQL, ()),
+    'Leaderboard (build)': (PLAYER_RATINGS_SQL.format(user_filter=''), ()),
+    'Leaderboard (update)': (PLAYER_RATINGS_SQL.format(user_filter='AND u.id IN (?, ?)'), (1, 2)),
+    'get_approved_members_page': (APPROVED_MEMBERS_PAGE_SQL.format(keyset=APPROVED_MEMBERS_KEYSET), ('', 0, PAGE_SIZE)),
+    'search_members': (MEMBER_SEARCH_SQL, ('"nguyen"*', MEMBER_SEARCH_LIMIT)),
+    'get_vote_sessions': (VOTE_SESSIONS_SQL.format(keyset=VOTE_SESSIONS_KEYSET), ('9999-12-31', 0, PAGE_SIZE)),
+    'get_vote_details': (VOTE_DETAILS_SQL, (1,)),
+    'add_expense': (SESSION_VOTERS_SQL, (1,)),
+    'get_financial_summary': (FINANCIAL_SUMMARY_SQL, ()),
+    'get_dashboard_snapshot': (DASHBOARD_SNAPSHOT_SQL, ()),
+    'get_expense_history': (EXPENSE_HISTORY_SQL.format(keyset=EXPENSE_HISTORY_KEYSET), ('9999-12-31', 0, PAGE_SIZE)),
+    'get_alerts': (ALERTS_SQL, ()),
+    'get_member_monthly_trend': (MEMBER_TREND_SQL, (1, '2024-01')),
+    'get_club_monthly_trend': (CLUB_TREND_SQL, ('2024-01',)),
+    'refresh_alerts (low balance)': (LOW_BALANCE_ALERTS_SQL.format(user_filter='AND u.id IN (?)'),
+                                     ('', 100000, 1)),
+    'refresh_alerts (low activity)': (LOW_ACTIVITY_ALERTS_SQL.format(user_filter='AND u.id IN (?)'),
+                                      ('', '2024-01-01', 1, 3)),
+}
+
+def check_query_plans():
+    """Chạy EXPLAIN QUERY PLAN cho các truy vấn nóng, trả về các bước quét toàn bảng"""
+    problems = []
+    conn = get_db_connection()
+    try:
+        for name, (sql, params) in HOT_QUERIES.items():
+            for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params):
+                detail = row[3]
+                if not detail.startswith('SCAN ') or detail.startswith('SCAN (subquery-'):
+                    continue  # Quét kết quả subquery (đã LIMIT) không phải quét bảng
+                if ' VIRTUAL TABLE INDEX ' in detail and 'M' in detail.rsplit(':', 1)[1]:
+                    continue  # Bảng FTS5 có ràng buộc MATCH: tra chỉ mục full-text, không quét
+                problems.append({'query': name, 'plan': detail})
+    finally:
+        conn.close()
+    return problems
+
 # Database helper functions
+def empty_page():
+    """Kết quả rỗng của một helper phân trang"""
+    return pd.DataFrame(), None
+
+def read_keyset_page(sql, keyset, cursor, limit):
+    """Đọc một trang theo keyset; trả về (DataFrame, dòng cuối nếu còn trang sau)"""
+    cursor = tuple(cursor) if cursor else ()
+    conn = get_db_connection()
+    try:
+        result = conn.execute(sql.format(keyset=keyset if cursor else ''), (*cursor, limit + 1))
+        columns = [column[0] for column in result.description]
+        rows = result.fetchall()
+    finally:
+        conn.close()
+    
+    # Đọc dư một dòng để biết còn trang sau hay không
+    last_row = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_row = rows[-1]
+    return pd.DataFrame(rows, columns=columns), last_row
+
+@cached_query('users', error_message="Lỗi lấy pending members")
 def get_pending_members():
     """Lấy danh sách thành viên chờ phê duyệt"""
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
-        df = pd.read_sql_query('''
+        return pd.read_sql_query('''
             SELECT id, full_name, email, phone, birth_date, created_at
             FROM users 
             WHERE is_approved = 0 AND is_admin = 0
             ORDER BY created_at DESC
         ''', conn)
+    finally:
         conn.close()
-        return df
-    except Exception as e:
-        st.error(f"Lỗi lấy pending members: {str(e)}")
-        return pd.DataFrame()
 
-def get_approved_members():
-    """Lấy danh sách thành viên đã được phê duyệt"""
+@cached_query('users', error_message="Lỗi lấy approved members", empty_result=empty_page)
+def get_approved_members_page(after=None, limit=PAGE_SIZE):
+    """Lấy một trang thành viên đã phê duyệt, sắp theo tên"""
+    df, last_row = read_keyset_page(APPROVED_MEMBERS_PAGE_SQL, APPROVED_MEMBERS_KEYSET, after, limit)
+    return df, (last_row[1], last_row[0]) if last_row else None
+
+def member_search_terms(text):
+    """Các từ người dùng gõ, đã đổi đ/Đ thành d/D như trong users_fts"""
+    return re.findall(r'\w+', text.translate(str.maketrans('đĐ', 'dD')))
+
+@cached_query('users', error_message="Lỗi tìm thành viên")
+def search_members(query, limit=MEMBER_SEARCH_LIMIT):
+    """Tối đa limit thành viên khớp query (mỗi từ là tiền tố); query rỗng thì trả các thành viên đầu theo tên"""
+    terms = member_search_terms(query or '')
+    if not terms:
+        return get_approved_members_page(None, limit)[0]
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
-        df = pd.read_sql_query('''
-            SELECT id, full_name, email, phone, birth_date
-            FROM users 
-            WHERE is_approved = 1 AND is_admin = 0
-            ORDER BY full_name
-        ''', conn)
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'").fetchone():
+            match = ' '.join(f'"{term}"*' for term in terms)
+            return pd.read_sql_query(MEMBER_SEARCH_SQL, conn, params=[match, limit])
+        pattern = f"%{query.strip()}%"
+        return pd.read_sql_query(MEMBER_SEARCH_LIKE_SQL, conn, params=[pattern, pattern, pattern, limit])
+    finally:
         conn.close()
-        return df
-    except Exception as e:
-        st.error(f"Lỗi lấy approved members: {str(e)}")
-        return pd.DataFrame()
+
+def set_member_approved(cursor, user_id, admin_name):
+    cursor.execute('''
+        UPDATE users 
+        SET is_approved = 1, approved_at = ?, approved_by = ?
+        WHERE id = ?
+    ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), admin_name, user_id))
+    refresh_alerts(cursor, [user_id])
 
 def approve_member(user_id, admin_name):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE users 
-            SET is_approved = 1, approved_at = ?, approved_by = ?
-            WHERE id = ?
-        ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), admin_name, user_id))
-        
-        conn.commit()
-        conn.close()
+        run_write_transaction(set_member_approved, user_id, admin_name)
+        invalidate_tables('users', 'alerts')
         return True
     except Exception as e:
         st.error(f"Lỗi phê duyệt: {str(e)}")
         return False
 
+def delete_user(cursor, user_id):
+    cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
+
 def reject_member(user_id):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
-        
-        conn.commit()
-        conn.close()
+        run_write_transaction(delete_user, user_id)
+        invalidate_tables('users')
         return True
     except Exception as e:
         st.error(f"Lỗi từ chối: {str(e)}")
@@ -382,77 +1855,85 @@ def reject_member(user_id):
 def add_member_direct(full_name, email, phone, birth_date, password):
     """Admin thêm thành viên trực tiếp (đã được phê duyệt ngay)"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO users (full_name, email, phone, birth_date, password, is_approved, created_at, approved_at, approved_by)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (full_name, email, phone, str(birth_date), hash_password(password), 1, 
-              datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-              datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-              'Admin'))
-        
-        conn.commit()
-        conn.close()
+        run_write_transaction(insert_user, full_name, email, phone, birth_date, password, 'Admin')
+        invalidate_tables('users', 'alerts')
         return True, "Đã thêm thành viên thành công!"
     except sqlite3.IntegrityError:
-        if conn:
-            conn.close()
         return False, "Email đã tồn tại!"
     except Exception as e:
-        if conn:
-            conn.close()
         return False, f"Lỗi thêm thành viên: {str(e)}"
 
-def update_member(user_id, full_name, email, phone, birth_date, password=None):
-    """Cập nhật thông tin thành viên"""
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        if password:
-            cursor.execute('''
-                UPDATE users 
-                SET full_name = ?, email = ?, phone = ?, birth_date = ?, password = ?
-                WHERE id = ? AND is_admin = 0
-            ''', (full_name, email, phone, str(birth_date), hash_password(password), user_id))
-        else:
-            cursor.execute('''
-                UPDATE users 
-                SET full_name = ?, email = ?, phone = ?, birth_date = ?
-                WHERE id = ? AND is_admin = 0
-            ''', (full_name, email, phone, str(birth_date), user_id))
-        
-        conn.commit()
-        conn.close()
+def update_member_row(cursor, user_id, full_name, email, phone, birth_date, password=None):
+    if password:
+        cursor.execute('''
+            UPDATE users 
+            SET full_name = ?, email = ?, phone = ?, birth_date = ?, password = ?
+            WHERE id = ? AND is_admin = 0
+        ''', (full_name, email, phone, str(birth_date), hash_password(password), user_id))
+    else:
+        cursor.execute('''
+            UPDATE users 
+            SET full_name = ?, email = ?, phone = ?, birth_date = ?
+            WHERE id = ? AND is_admin = 0
+        ''', (full_name, email, phone, str(birth_date), user_id))
+
+def update_member(user_id, full_name, email, phone, birth_date, password=None):
+    """Cập nhật thông tin thành viên"""
+    try:
+        run_write_transaction(update_member_row, user_id, full_name, email, phone, birth_date, password)
+        invalidate_tables('users')
         return True, "Đã cập nhật thông tin thành viên!"
     except sqlite3.IntegrityError:
-        if conn:
-            conn.close()
         return False, "Email đã tồn tại!"
     except Exception as e:
-        if conn:
-            conn.close()
         return False, f"Lỗi cập nhật: {str(e)}"
 
+def delete_member_data(cursor, user_id):
+    """Xóa thành viên cùng dữ liệu liên quan, trả về số tài khoản đã xóa"""
+    # Xóa các dữ liệu liên quan trước (kể cả phần đã chuyển sang file lưu trữ)
+    stored = archive_tables(cursor)
+    # Số dư của thành viên khác không đổi: giữ checkpoint, chỉ bỏ các dòng của thành viên này ở dưới
+    save_checkpoints(cursor)
+    for table in ('rankings', 'votes', 'finances'):
+        cursor.execute(f'DELETE FROM main.{table} WHERE user_id = ?', (user_id,))
+        if table in stored:
+            cursor.execute(f'DELETE FROM archive.{table} WHERE user_id = ?', (user_id,))
+    restore_checkpoints(cursor)
+    cursor.execute('DELETE FROM finance_carry_forward WHERE user_id = ?', (user_id,))
+    cursor.execute('DELETE FROM balance_checkpoints WHERE user_id = ?', (user_id,))
+    # Bỏ phần của thành viên khỏi thống kê toàn CLB trước khi xóa thống kê riêng
+    cursor.execute('''
+        UPDATE monthly_club_rollups SET
+            attendances = attendances - m.sessions_attended,
+            spend = monthly_club_rollups.spend - m.spend,
+            contributions = monthly_club_rollups.contributions - m.contributions
+        FROM (SELECT month, sessions_attended, spend, contributions
+              FROM monthly_member_rollups WHERE user_id = ?) m
+        WHERE monthly_club_rollups.month = m.month
+    ''', (user_id,))
+    cursor.execute('DELETE FROM monthly_member_rollups WHERE user_id = ?', (user_id,))
+    cursor.execute('DELETE FROM ranking_carry_forward WHERE user_id = ?', (user_id,))
+    cursor.execute('DELETE FROM member_balances WHERE user_id = ?', (user_id,))
+    cursor.execute('DELETE FROM alerts WHERE user_id = ?', (user_id,))
+    cursor.execute('DELETE FROM player_ratings WHERE user_id = ?', (user_id,))
+    cursor.execute('DELETE FROM match_participants WHERE user_id = ?', (user_id,))
+    played = cursor.rowcount
+    
+    # Xóa user (chỉ xóa thành viên, không xóa admin)
+    cursor.execute('DELETE FROM users WHERE id = ? AND is_admin = 0', (user_id,))
+    deleted = cursor.rowcount
+    
+    # Điểm của các đối thủ đã chịu ảnh hưởng của thành viên này: tính lại từ đầu
+    if played:
+        replay_ratings(cursor)
+    return deleted
+
 def delete_member(user_id):
     """Xóa thành viên và tất cả dữ liệu liên quan"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Xóa các dữ liệu liên quan trước
-        cursor.execute('DELETE FROM rankings WHERE user_id = ?', (user_id,))
-        cursor.execute('DELETE FROM votes WHERE user_id = ?', (user_id,))
-        cursor.execute('DELETE FROM finances WHERE user_id = ?', (user_id,))
-        
-        # Xóa user (chỉ xóa thành viên, không xóa admin)
-        cursor.execute('DELETE FROM users WHERE id = ? AND is_admin = 0', (user_id,))
-        
-        affected_rows = cursor.rowcount
-        conn.commit()
-        conn.close()
+        affected_rows = run_write_transaction(delete_member_data, user_id, archive=os.path.exists(ARCHIVE_DB_FILE))
+        invalidate_tables('users', 'rankings', 'votes', 'finances', 'member_balances', 'alerts',
+                          'monthly_member_rollups', 'monthly_club_rollups', 'matches', 'player_ratings')
         
         if affected_rows > 0:
             return True, "Đã xóa thành viên và tất cả dữ liệu liên quan!"
@@ -460,319 +1941,1372 @@ def delete_member(user_id):
             return False, "Không thể xóa (có thể là admin hoặc thành viên không tồn tại)!"
             
     except Exception as e:
-        if conn:
-            conn.close()
         return False, f"Lỗi xóa thành viên: {str(e)}"
 
+# Danh bạ thành viên trong bộ nhớ: tra theo id/email/tên không cần truy vấn, dựng lại khi bảng users đổi thế hệ
+@dataclass(frozen=True)
+class MemberRecord:
+    """Thông tin gọn của một tài khoản (không gồm mật khẩu)"""
+    id: int
+    full_name: str
+    email: str
+    phone: str
+    birth_date: str
+    is_approved: int
+    is_admin: int
+
+    @property
+    def is_member(self):
+        return self.is_approved == 1 and self.is_admin == 0
+
+class MemberDirectory:
+    """Danh bạ cho cả tiến trình: id -> MemberRecord, kèm chỉ mục theo email (chữ thường) và theo tên"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = None
+        self._by_id = {}
+        self._by_email = {}
+        self._by_name = {}
+        self.rebuilds = 0
+
+    def _ensure_current(self):
+        # Lấy thế hệ trước khi đọc: lần ghi chen giữa sẽ làm lệch thế hệ và dựng lại lần sau
+        generation = get_query_cache().generation('users')
+        if generation == self._generation:
+            return
+        conn = get_db_connection()
+        try:
+            rows = conn.execute(
+                'SELECT id, full_name, email, phone, birth_date, is_approved, is_admin FROM users').fetchall()
+        finally:
+            conn.close()
+        
+        by_id = {row[0]: MemberRecord(*row) for row in rows}
+        by_name = {}
+        for record in by_id.values():
+            by_name.setdefault(record.full_name.casefold(), []).append(record)
+        self._by_id = by_id
+        self._by_email = {record.email.lower(): record for record in by_id.values()}
+        self._by_name = by_name
+        self._generation = generation
+        self.rebuilds += 1
+
+    def get(self, user_id):
+        with self._lock:
+            self._ensure_current()
+            return self._by_id.get(int(user_id))
+
+    def find_by_email(self, email):
+        with self._lock:
+            self._ensure_current()
+            return self._by_email.get(email.strip().lower())
+
+    def find_by_name(self, full_name):
+        """Mọi tài khoản có tên này (tên có thể trùng nhau)"""
+        with self._lock:
+            self._ensure_current()
+            return list(self._by_name.get(full_name.strip().casefold(), []))
+
+    def email_map(self):
+        """Bảng tra email (chữ thường) -> (id, đã phê duyệt, là admin) cho các lần nhập file"""
+        with self._lock:
+            self._ensure_current()
+            return {email: (record.id, record.is_approved, record.is_admin) for email, record in self._by_email.items()}
+
+@st.cache_resource
+def get_member_directory():
+    """Danh bạ thành viên dùng chung cho cả tiến trình"""
+    return MemberDirectory()
+
 def get_member_by_id(user_id):
     """Lấy thông tin thành viên theo ID"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, full_name, email, phone, birth_date
-            FROM users 
-            WHERE id = ? AND is_admin = 0
-        ''', (user_id,))
-        
-        member = cursor.fetchone()
-        conn.close()
-        
-        if member:
+        member = get_member_directory().get(user_id)
+        if member and not member.is_admin:
             return {
-                'id': member[0],
-                'full_name': member[1],
-                'email': member[2],
-                'phone': member[3],
-                'birth_date': member[4]
+                'id': member.id,
+                'full_name': member.full_name,
+                'email': member.email,
+                'phone': member.phone,
+                'birth_date': member.birth_date
             }
         return None
     except Exception as e:
         st.error(f"Lỗi lấy thông tin thành viên: {str(e)}")
         return None
 
+@cached_query('users', 'rankings', error_message="Lỗi lấy rankings")
 def get_rankings():
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
-        df = pd.read_sql_query('''
-            SELECT u.full_name, COUNT(r.id) as total_wins
-            FROM users u
-            LEFT JOIN rankings r ON u.id = r.user_id
-            WHERE u.is_approved = 1 AND u.is_admin = 0
-            GROUP BY u.id, u.full_name
-            ORDER BY total_wins DESC
-        ''', conn)
+        return pd.read_sql_query(RANKINGS_SQL, conn)
+    finally:
         conn.close()
-        return df
-    except Exception as e:
-        st.error(f"Lỗi lấy rankings: {str(e)}")
-        return pd.DataFrame()
 
-def add_ranking(user_name, wins, match_date, location, score):
+@cached_query('matches', 'users', error_message="Lỗi lấy danh sách trận đấu")
+def get_recent_matches(limit=PAGE_SIZE):
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Get user_id
-        cursor.execute('SELECT id FROM users WHERE full_name = ? AND is_approved = 1 AND is_admin = 0', (user_name,))
-        user = cursor.fetchone()
-        
-        if user:
-            for _ in range(wins):
-                cursor.execute('''
-                    INSERT INTO rankings (user_id, match_date, location, score, created_at)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (user[0], str(match_date), location, score, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-        
-        conn.commit()
+        return pd.read_sql_query(RECENT_MATCHES_SQL, conn, params=[limit])
+    finally:
         conn.close()
+
+def elo_expected(rating, opponent_rating):
+    """Xác suất thắng kỳ vọng của đội có điểm rating trước đội có điểm opponent_rating (số hoặc mảng NumPy)"""
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+def apply_match_rating(cursor, match_id, match_date, teams, winning_team):
+    """Cập nhật Elo cho người chơi của một trận, chỉ đọc/ghi O(số người trong trận)"""
+    players = [user_id for team in teams for user_id in team]
+    placeholders = ', '.join('?' * len(players))
+    stored = dict(cursor.execute(f'SELECT user_id, rating FROM player_ratings WHERE user_id IN ({placeholders})',
+                                 players).fetchall())
+    before = {user_id: stored.get(user_id, ELO_INITIAL_RATING) for user_id in players}
+    team_one, team_two = (sum(before[user_id] for user_id in team) / len(team) for team in teams)
+    delta = ELO_K_FACTOR * ((winning_team == 1) - elo_expected(team_one, team_two))
+    
+    for number, team in enumerate(teams, 1):
+        change = delta if number == 1 else -delta
+        for user_id in team:
+            cursor.execute('''
+                INSERT INTO match_participants (match_id, user_id, team, rating_before, rating_after)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (match_id, user_id, number, before[user_id], before[user_id] + change))
+            cursor.execute('''
+                INSERT INTO player_ratings (user_id, rating, matches_played, wins, last_match_date)
+                VALUES (?, ?, 1, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    rating = excluded.rating,
+                    matches_played = matches_played + 1,
+                    wins = wins + excluded.wins,
+                    last_match_date = MAX(last_match_date, excluded.last_match_date)
+            ''', (user_id, before[user_id] + change, int(number == winning_team), match_date))
+
+def replay_ratings(cursor):
+    """Tính lại Elo từ đầu theo thứ tự trận; các trận không chung người chơi được tính cùng lượt bằng NumPy"""
+    participants = pd.DataFrame(cursor.execute('''
+        SELECT p.match_id, p.user_id, p.team, m.winning_team, m.match_date
+        FROM matches m
+        JOIN match_participants p ON p.match_id = m.id
+        ORDER BY m.match_date, m.id
+    ''').fetchall(), columns=['match_id', 'user_id', 'team', 'winning_team', 'match_date'])
+    # Bỏ qua trận không còn đủ hai đội (thành viên đã bị xóa)
+    participants = participants[participants.groupby('match_id')['team'].transform('nunique') == 2]
+    participants = participants.reset_index(drop=True)
+    cursor.execute('DELETE FROM player_ratings')
+    if participants.empty:
+        return 0
+    
+    players, user_ids = pd.factorize(participants['user_id'])
+    games, match_ids = pd.factorize(participants['match_id'])
+    team_one = participants['team'].to_numpy() == 1
+    won = participants['team'].to_numpy() == participants['winning_team'].to_numpy()
+    team_one_won = participants['winning_team'].to_numpy() == 1
+    
+    # Lượt của một trận = sau lượt muộn nhất của các người chơi trong trận, nên các trận cùng lượt
+    # không chung người chơi và thứ tự trận của từng người được giữ nguyên
+    last_round = np.zeros(len(user_ids), dtype=np.int64)
+    game_round = np.empty(len(match_ids), dtype=np.int64)
+    for game, game_players in enumerate(np.split(players, np.flatnonzero(np.diff(games)) + 1)):
+        game_round[game] = last_round[game_players].max() + 1
+        last_round[game_players] = game_round[game]
+    
+    ratings = np.full(len(user_ids), ELO_INITIAL_RATING, dtype=float)
+    before = np.empty(len(participants))
+    after = np.empty(len(participants))
+    row_round = game_round[games]
+    order = np.argsort(row_round, kind='stable')
+    for rows in np.split(order, np.flatnonzero(np.diff(row_round[order])) + 1):
+        current = ratings[players[rows]]
+        # Mỗi trận có hai ô (đội 1, đội 2) liền nhau sau khi sắp xếp: điểm trung bình từng đội
+        slots, slot_index = np.unique(games[rows] * 2 + ~team_one[rows], return_inverse=True)
+        means = (np.bincount(slot_index, weights=current) / np.bincount(slot_index)).reshape(-1, 2)
+        pair = slot_index // 2
+        delta = ELO_K_FACTOR * (team_one_won[rows] - elo_expected(means[pair, 0], means[pair, 1]))
+        before[rows] = current
+        after[rows] = current + np.where(team_one[rows], delta, -delta)
+        ratings[players[rows]] = after[rows]
+    
+    cursor.executemany('UPDATE match_participants SET rating_before = ?, rating_after = ? WHERE match_id = ? AND user_id = ?',
+                       zip(before.tolist(), after.tolist(), participants['match_id'].tolist(),
+                           participants['user_id'].tolist()))
+    stats = participants.assign(won=won).groupby('user_id').agg(
+        matches_played=('match_id', 'size'), wins=('won', 'sum'), last_match_date=('match_date', 'max'))
+    final = pd.Series(ratings, index=user_ids)
+    cursor.executemany('''
+        INSERT INTO player_ratings (user_id, rating, matches_played, wins, last_match_date)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(int(user_id), float(final[user_id]), int(row.matches_played), int(row.wins), row.last_match_date)
+          for user_id, row in stats.iterrows()])
+    return len(match_ids)
+
+def check_match_editable(cursor, match_date):
+    """Trận trước mốc lưu trữ đã được cộng vào ranking_carry_forward nên không sửa được"""
+    archived_through = read_alert_settings(cursor)['archived_through']
+    if archived_through and str(match_date) < archived_through:
+        raise ValueError(f"Trận trước {archived_through} đã được lưu trữ, không thể sửa")
+
+def insert_match_winners(cursor, match_id, teams, winning_team, match_date, location, score):
+    """Ghi một trận thắng vào rankings cho từng người của đội thắng (bảng đếm số trận thắng)"""
+    created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    cursor.executemany('''
+        INSERT INTO rankings (user_id, match_date, location, score, wins, created_at, match_id)
+        VALUES (?, ?, ?, ?, 1, ?, ?)
+    ''', [(user_id, str(match_date), location, score, created_at, match_id) for user_id in teams[winning_team - 1]])
+
+def insert_match(cursor, match_date, team_one, team_two, winning_team, location, score):
+    """Ghi trận đấu, người chơi từng đội và cập nhật Elo; trả về True nếu phải tính lại toàn bộ"""
+    teams = [list(dict.fromkeys(team_one)), list(dict.fromkeys(team_two))]
+    players = teams[0] + teams[1]
+    if not teams[0] or not teams[1]:
+        raise ValueError("Mỗi đội cần ít nhất một người chơi")
+    if len(set(players)) < len(players):
+        raise ValueError("Một người không thể chơi cho cả hai đội")
+    placeholders = ', '.join('?' * len(players))
+    cursor.execute(f'SELECT COUNT(*) FROM users WHERE id IN ({placeholders}) AND is_approved = 1 AND is_admin = 0',
+                   players)
+    if cursor.fetchone()[0] != len(players):
+        raise ValueError("Người chơi phải là thành viên đã được phê duyệt")
+    check_match_editable(cursor, match_date)
+    
+    cursor.execute('''
+        INSERT INTO matches (match_date, location, score, winning_team, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (str(match_date), location, score, winning_team, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    match_id = cursor.lastrowid
+    insert_match_winners(cursor, match_id, teams, winning_team, match_date, location, score)
+    apply_match_rating(cursor, match_id, str(match_date), teams, winning_team)
+    
+    # Trận ghi lùi ngày làm sai điểm của các trận sau nó: tính lại theo đúng thứ tự
+    cursor.execute('SELECT 1 FROM matches WHERE match_date > ? LIMIT 1', (str(match_date),))
+    if cursor.fetchone():
+        replay_ratings(cursor)
         return True
+    return False
+
+def change_match_result(cursor, match_id, winning_team=None):
+    """Đổi đội thắng của một trận (winning_team=None thì xóa trận) rồi tính lại toàn bộ Elo"""
+    cursor.execute('SELECT match_date, location, score FROM matches WHERE id = ?', (match_id,))
+    match = cursor.fetchone()
+    if not match:
+        raise ValueError("Không tìm thấy trận đấu")
+    check_match_editable(cursor, match[0])
+    
+    cursor.execute('DELETE FROM rankings WHERE match_id = ?', (match_id,))
+    if winning_team is None:
+        cursor.execute('DELETE FROM match_participants WHERE match_id = ?', (match_id,))
+        cursor.execute('DELETE FROM matches WHERE id = ?', (match_id,))
+    else:
+        cursor.execute('UPDATE matches SET winning_team = ? WHERE id = ?', (winning_team, match_id))
+        teams = [[row[0] for row in cursor.execute(
+            'SELECT user_id FROM match_participants WHERE match_id = ? AND team = ? ORDER BY user_id',
+            (match_id, number))] for number in (1, 2)]
+        insert_match_winners(cursor, match_id, teams, winning_team, *match)
+    return replay_ratings(cursor)
+
+def record_match(match_date, team_one, team_two, winning_team, location, score):
+    """Ghi kết quả trận đấu giữa hai đội, trả về (thành công, thông báo)"""
+    try:
+        replayed = run_write_transaction(insert_match, match_date, team_one, team_two, winning_team, location, score)
+        invalidate_tables('matches', 'player_ratings', 'rankings')
+        get_leaderboard().refresh_players(None if replayed else team_one + team_two)
+        if replayed:
+            return True, "Đã lưu kết quả và tính lại điểm cho các trận sau ngày này!"
+        return True, "Đã lưu kết quả trận đấu!"
+    except ValueError as e:
+        return False, str(e)
     except Exception as e:
-        st.error(f"Lỗi thêm ranking: {str(e)}")
-        return False
+        return False, f"Lỗi lưu kết quả trận: {str(e)}"
 
-def get_vote_sessions():
+def update_match_result(match_id, winning_team=None):
+    """Đổi đội thắng hoặc xóa trận (winning_team=None), trả về (thành công, thông báo)"""
     try:
-        conn = get_db_connection()
-        df = pd.read_sql_query('''
-            SELECT vs.id, vs.session_date, vs.description, 
-                   COUNT(CASE WHEN u.is_admin = 0 THEN v.id END) as vote_count
-            FROM vote_sessions vs
-            LEFT JOIN votes v ON vs.session_date = v.session_date
-            LEFT JOIN users u ON v.user_id = u.id
-            GROUP BY vs.id, vs.session_date, vs.description
-            ORDER BY vs.session_date DESC
-        ''', conn)
-        conn.close()
-        return df
+        replayed = run_write_transaction(change_match_result, match_id, winning_team)
+        invalidate_tables('matches', 'player_ratings', 'rankings')
+        action = "xóa trận" if winning_team is None else "sửa kết quả"
+        return True, f"Đã {action} và tính lại điểm từ {replayed:,} trận!"
+    except ValueError as e:
+        return False, str(e)
     except Exception as e:
-        st.error(f"Lỗi lấy vote sessions: {str(e)}")
-        return pd.DataFrame()
+        return False, f"Lỗi sửa trận đấu: {str(e)}"
 
-def create_vote_session(session_date, description):
+def recompute_ratings():
+    """Tính lại toàn bộ điểm Elo từ lịch sử trận đấu"""
     try:
+        replayed = run_write_transaction(replay_ratings)
+        invalidate_tables('player_ratings')
+        return True, f"Đã tính lại điểm từ {replayed:,} trận!"
+    except Exception as e:
+        return False, f"Lỗi tính lại điểm: {str(e)}"
+
+# Bảng xếp hạng trong bộ nhớ: thứ hạng, top K và các người xung quanh một thành viên đều O(log n)
+LEADERBOARD_TOP_K = 10
+LEADERBOARD_NEIGHBOURS = 2
+SKIPLIST_MAX_LEVELS = 32
+
+class SkipNode:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        # width[i]: số bước ở tầng dưới cùng từ node này tới next[i] (tới cuối danh sách nếu next[i] là None)
+        self.width = [1] * levels
+
+class IndexableSkipList:
+    """Skip list có độ rộng trên mỗi liên kết: thêm, xóa, tra thứ hạng và lấy phần tử thứ i đều O(log n)"""
+
+    def __init__(self, seed=None):
+        self._head = SkipNode(None, SKIPLIST_MAX_LEVELS)
+        self._random = random.Random(seed)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _path(self, key):
+        """Node đứng ngay trước key ở từng tầng và vị trí (head = 0) của các node đó"""
+        update = [None] * SKIPLIST_MAX_LEVELS
+        positions = [0] * SKIPLIST_MAX_LEVELS
+        node, position = self._head, 0
+        for level in reversed(range(SKIPLIST_MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            update[level], positions[level] = node, position
+        return update, positions
+
+    def insert(self, key):
+        update, positions = self._path(key)
+        height = 1
+        while height < SKIPLIST_MAX_LEVELS and self._random.random() < 0.5:
+            height += 1
+        node = SkipNode(key, height)
+        position = positions[0] + 1
+        for level in range(SKIPLIST_MAX_LEVELS):
+            previous = update[level]
+            if level < height:
+                node.next[level] = previous.next[level]
+                node.width[level] = previous.width[level] - (position - positions[level]) + 1
+                previous.next[level] = node
+                previous.width[level] = position - positions[level]
+            else:
+                previous.width[level] += 1
+        self._size += 1
+
+    def remove(self, key):
+        update, _ = self._path(key)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for level in range(SKIPLIST_MAX_LEVELS):
+            previous = update[level]
+            if previous.next[level] is node:
+                previous.width[level] += node.width[level] - 1
+                previous.next[level] = node.next[level]
+            else:
+                previous.width[level] -= 1
+        self._size -= 1
+
+    def rank(self, key):
+        """Thứ hạng (tính từ 0) của key đang có trong danh sách"""
+        update, positions = self._path(key)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        return positions[0]
+
+    def slice(self, start, count):
+        """count phần tử liên tiếp bắt đầu từ thứ hạng start"""
+        node, position = self._head, 0
+        for level in reversed(range(SKIPLIST_MAX_LEVELS)):
+            while node.next[level] is not None and position + node.width[level] <= start:
+                position += node.width[level]
+                node = node.next[level]
+        keys = []
+        node = node.next[0]
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+class Leaderboard:
+    """Bảng xếp hạng của cả tiến trình: dựng một lần, sau mỗi trận chỉ nạp lại người chơi của trận đó"""
+    
+    TABLES = ('users', 'player_ratings')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self._keys = {}
+        self._players = {}
+        self._generation = None
+        self.rebuilds = 0
+    
+    @staticmethod
+    def make_key(row):
+        # Cùng thứ tự với bảng xếp hạng: điểm giảm dần, nhiều trận hơn trước, rồi theo tên
+        return (-row['rating'], -row['matches_played'], row['full_name'], row['user_id'])
+
+    def _read(self, user_ids=None):
+        user_filter = f"AND u.id IN ({', '.join('?' * len(user_ids))})" if user_ids else ''
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO vote_sessions (session_date, description, created_at)
-            VALUES (?, ?, ?)
-        ''', (str(session_date), description, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-        
-        conn.commit()
-        conn.close()
+        try:
+            return pd.read_sql_query(PLAYER_RATINGS_SQL.format(user_filter=user_filter), conn,
+                                     params=list(user_ids or [])).to_dict('records')
+        finally:
+            conn.close()
+
+    def _rebuild(self):
+        # Lấy thế hệ trước khi đọc: lần ghi chen giữa sẽ làm lệch thế hệ và dựng lại lần sau
+        generation = get_query_cache().generation(*self.TABLES)
+        index, keys, players = IndexableSkipList(), {}, {}
+        for row in self._read():
+            keys[row['user_id']] = self.make_key(row)
+            players[row['user_id']] = row
+            index.insert(keys[row['user_id']])
+        self._index, self._keys, self._players, self._generation = index, keys, players, generation
+        self.rebuilds += 1
+
+    def _ensure_current(self):
+        if self._index is None or self._generation != get_query_cache().generation(*self.TABLES):
+            self._rebuild()
+
+    def refresh_players(self, user_ids):
+        """Gọi sau khi commit một trận: nạp lại điểm của user_ids (None thì dựng lại ở lần đọc sau)"""
+        with self._lock:
+            if self._index is None:
+                return
+            users_generation, ratings_generation = get_query_cache().generation(*self.TABLES)
+            # Chỉ cập nhật từng phần khi trận này là lần ghi duy nhất kể từ lần đồng bộ trước
+            if user_ids is None or (users_generation, ratings_generation - 1) != self._generation:
+                self._index = None
+                return
+            for row in self._read(user_ids):
+                old_key = self._keys.get(row['user_id'])
+                if old_key is not None:
+                    self._index.remove(old_key)
+                self._keys[row['user_id']] = self.make_key(row)
+                self._players[row['user_id']] = row
+                self._index.insert(self._keys[row['user_id']])
+            self._generation = (users_generation, ratings_generation)
+
+    def _rows(self, start, count):
+        return [dict(self._players[key[-1]], rank=start + offset + 1)
+                for offset, key in enumerate(self._index.slice(start, count))]
+
+    def top(self, k=LEADERBOARD_TOP_K):
+        """k thành viên đứng đầu, kèm thứ hạng"""
+        with self._lock:
+            self._ensure_current()
+            return pd.DataFrame(self._rows(0, k), columns=['rank', 'user_id', 'full_name', 'rating',
+                                                           'matches_played', 'wins'])
+
+    def position(self, user_id, radius=LEADERBOARD_NEIGHBOURS):
+        """Thứ hạng của user_id, tổng số thành viên và radius người đứng trên/dưới; None nếu không có trong bảng"""
+        with self._lock:
+            self._ensure_current()
+            key = self._keys.get(user_id)
+            if key is None:
+                return None
+            rank = self._index.rank(key)
+            start = max(rank - radius, 0)
+            return {
+                'rank': rank + 1,
+                'total': len(self._index),
+                'player': self._players[user_id],
+                'neighbours': self._rows(start, rank - start + radius + 1),
+            }
+
+    def __len__(self):
+        with self._lock:
+            self._ensure_current()
+            return len(self._index)
+
+@st.cache_resource
+def get_leaderboard():
+    """Bảng xếp hạng trong bộ nhớ dùng chung cho cả tiến trình"""
+    return Leaderboard()
+
+@cached_query('vote_sessions', 'votes', 'users', error_message="Lỗi lấy vote sessions", empty_result=empty_page)
+def get_vote_sessions(before=None, limit=PAGE_SIZE):
+    """Lấy một trang phiên bình chọn, mới nhất trước"""
+    df, last_row = read_keyset_page(VOTE_SESSIONS_SQL, VOTE_SESSIONS_KEYSET, before, limit)
+    return df, (last_row[1], last_row[0]) if last_row else None
+
+def insert_vote_session(cursor, session_date, description):
+    cursor.execute('''
+        INSERT INTO vote_sessions (session_date, description, created_at)
+        VALUES (?, ?, ?)
+    ''', (str(session_date), description, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+def create_vote_session(session_date, description):
+    try:
+        run_write_transaction(insert_vote_session, session_date, description)
+        invalidate_tables('vote_sessions')
         return True
     except Exception as e:
         st.error(f"Lỗi tạo vote session: {str(e)}")
         return False
 
-def vote_for_session(user_id, session_date):
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Check if already voted
-        cursor.execute('''
-            SELECT id FROM votes WHERE user_id = ? AND session_date = ?
-        ''', (user_id, str(session_date)))
-        
+def insert_vote(cursor, user_id, session_id):
+    """Ghi vote trong transaction của hàng đợi ghi; trả về False nếu đã vote, ValueError nếu phiên không còn"""
+    # UNIQUE (user_id, session_id) chặn vote trùng ngay trong câu INSERT, kể cả khi bấm hai lần cùng lúc
+    cursor.execute('''
+        INSERT INTO votes (user_id, session_id, session_date, created_at)
+        SELECT ?, id, session_date, ? FROM vote_sessions WHERE id = ?
+        ON CONFLICT (user_id, session_id) DO NOTHING
+    ''', (user_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), session_id))
+    
+    if cursor.rowcount == 0:
+        # Không ghi được: phiên đã bị xóa/lưu trữ hoặc thành viên đã vote
+        cursor.execute('SELECT 1 FROM vote_sessions WHERE id = ?', (session_id,))
         if not cursor.fetchone():
-            cursor.execute('''
-                INSERT INTO votes (user_id, session_date, created_at)
-                VALUES (?, ?, ?)
-            ''', (user_id, str(session_date), datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-            conn.commit()
-            conn.close()
-            return True
-        else:
-            conn.close()
-            return False
-    except Exception as e:
-        st.error(f"Lỗi vote: {str(e)}")
+            raise ValueError("Phiên bình chọn không còn tồn tại!")
         return False
+    refresh_alerts(cursor, [user_id])
+    return True
+
+def vote_for_session(user_id, session_id):
+    """Vote cho một phiên, trả về (thành công, thông báo)"""
+    try:
+        if not run_queued_write(insert_vote, user_id, session_id):
+            return False, "Bạn đã vote cho phiên này!"
+        invalidate_tables('votes', 'alerts')
+        return True, "Đã vote thành công!"
+    except ValueError as e:
+        invalidate_tables('vote_sessions')
+        return False, str(e)
+    except Exception as e:
+        return False, f"Lỗi vote: {str(e)}"
 
-def get_vote_details(session_date):
+def get_vote_details(session_id):
     try:
         conn = get_db_connection()
-        df = pd.read_sql_query('''
-            SELECT u.full_name, v.created_at
-            FROM votes v
-            JOIN users u ON v.user_id = u.id
-            WHERE v.session_date = ? AND u.is_admin = 0
-            ORDER BY v.created_at
-        ''', conn, params=[str(session_date)])
+        df = pd.read_sql_query(VOTE_DETAILS_SQL, conn, params=[session_id])
         conn.close()
         return df
     except Exception as e:
         st.error(f"Lỗi lấy vote details: {str(e)}")
         return pd.DataFrame()
 
-def add_contribution(user_name, amount):
+def insert_contribution(cursor, user_id, amount):
+    """Ghi một lần đóng quỹ trong transaction của hàng đợi ghi"""
+    # Kiểm tra lại trong transaction: thành viên có thể vừa bị xóa sau lần tra danh bạ
+    cursor.execute('''
+        INSERT INTO finances (user_id, amount, transaction_type, description, created_at)
+        SELECT id, ?, ?, ?, ? FROM users WHERE id = ? AND is_approved = 1 AND is_admin = 0
+    ''', (amount, 'contribution', 'Đóng quỹ', datetime.now().strftime('%Y-%m-%d %H:%M:%S'), user_id))
+    if cursor.rowcount == 0:
+        raise ValueError("Thành viên không còn tồn tại hoặc chưa được phê duyệt")
+    refresh_alerts(cursor, [user_id])
+
+def add_contribution(user_id, amount):
+    member = get_member_directory().get(user_id)
+    if member is None or not member.is_member:
+        st.error("Không tìm thấy thành viên đã được phê duyệt!")
+        return False
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT id FROM users WHERE full_name = ? AND is_approved = 1 AND is_admin = 0', (user_name,))
-        user = cursor.fetchone()
-        
-        if user:
-            cursor.execute('''
-                INSERT INTO finances (user_id, amount, transaction_type, description, created_at)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user[0], amount, 'contribution', 'Đóng quỹ', datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-        
-        conn.commit()
-        conn.close()
+        run_queued_write(insert_contribution, member.id, amount)
+        invalidate_tables('finances', 'member_balances', 'alerts', 'monthly_member_rollups', 'monthly_club_rollups')
         return True
     except Exception as e:
         st.error(f"Lỗi thêm đóng góp: {str(e)}")
         return False
 
+# Nhập hàng loạt thành viên/đóng quỹ từ file CSV hoặc XLSX
+IMPORT_CHUNK_SIZE = 500
+EMAIL_PATTERN = r'^[^@\s]+@[^@\s]+\.[^@\s]+$'
+MEMBER_IMPORT_COLUMNS = ['full_name', 'email', 'phone', 'birth_date']
+CONTRIBUTION_IMPORT_COLUMNS = ['email', 'amount']
+# Tên cột tiếng Việt thường gặp trong file danh sách -> tên cột chuẩn
+IMPORT_COLUMN_ALIASES = {
+    'họ và tên': 'full_name', 'họ tên': 'full_name', 'tên': 'full_name',
+    'số điện thoại': 'phone', 'điện thoại': 'phone', 'sđt': 'phone',
+    'ngày sinh': 'birth_date', 'mật khẩu': 'password',
+    'số tiền': 'amount', 'ngày': 'date', 'ngày đóng': 'date', 'ghi chú': 'description',
+}
+
+def read_import_chunks(uploaded_file, chunk_size=IMPORT_CHUNK_SIZE):
+    """Đọc file theo từng khối, mọi cột dạng chuỗi; CSV đọc dần, XLSX đọc một lần rồi cắt khối"""
+    if uploaded_file.name.lower().endswith(('.xlsx', '.xlsm')):
+        try:
+            import openpyxl  # noqa: F401  (pandas cần openpyxl để đọc .xlsx)
+        except ImportError:
+            raise ValueError("Cần cài openpyxl để đọc file .xlsx (pip install openpyxl) hoặc lưu file dạng CSV")
+        df = pd.read_excel(uploaded_file, dtype=str).fillna('')
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size]
+    else:
+        yield from pd.read_csv(uploaded_file, dtype=str, keep_default_na=False, chunksize=chunk_size,
+                               encoding='utf-8-sig')
+
+def normalize_import_chunk(chunk, required_columns):
+    """Chuẩn hóa tên cột và bỏ khoảng trắng thừa; báo lỗi nếu thiếu cột bắt buộc"""
+    chunk = chunk.rename(columns=lambda column: str(column).strip().lower())
+    chunk = chunk.rename(columns=IMPORT_COLUMN_ALIASES)
+    missing = [column for column in required_columns if column not in chunk.columns]
+    if missing:
+        raise ValueError(f"File thiếu cột: {', '.join(missing)}")
+    return chunk.apply(lambda column: column.astype(str).str.strip())
+
+def parse_import_dates(values):
+    """Nhận ngày dạng YYYY-MM-DD hoặc DD/MM/YYYY, trả về NaT nếu không đọc được"""
+    parsed = pd.to_datetime(values, format='%Y-%m-%d', errors='coerce')
+    return parsed.fillna(pd.to_datetime(values, format='%d/%m/%Y', errors='coerce'))
+
+def collect_import_errors(chunk, checks):
+    """Gộp các kiểm tra dạng (mask, thông báo) thành báo cáo lỗi theo dòng; trả về (mask hợp lệ, danh sách lỗi)"""
+    messages = pd.Series('', index=chunk.index)
+    for mask, message in checks:
+        messages[mask] += message + '; '
+    invalid = messages != ''
+    # Dòng 1 của file là tiêu đề nên dòng dữ liệu đầu tiên là dòng 2
+    errors = [{'row': row + 2, 'error': message.rstrip('; ')} for row, message in messages[invalid].items()]
+    return ~invalid, errors
+
+def insert_member_rows(cursor, rows, approved_by):
+    """Thêm nhiều thành viên đã phê duyệt bằng một executemany; trả về {email chữ thường: id}"""
+    last_id = cursor.execute('SELECT COALESCE(MAX(id), 0) FROM users').fetchone()[0]
+    cursor.executemany('''
+        INSERT INTO users (full_name, email, phone, birth_date, password, is_approved, created_at, approved_at, approved_by)
+        VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?)
+    ''', [(*row, approved_by) for row in rows])
+    # Đang giữ khóa ghi (BEGIN IMMEDIATE) nên mọi id mới đều thuộc lần ghi này
+    new_ids = {email.lower(): user_id for user_id, email in cursor.execute(
+        'SELECT id, email FROM users WHERE id > ?', (last_id,))}
+    refresh_alerts(cursor, new_ids.values())
+    return new_ids
+
+def insert_contribution_rows(cursor, rows):
+    cursor.executemany('''
+        INSERT INTO finances (user_id, amount, transaction_type, description, created_at)
+        VALUES (?, ?, 'contribution', ?, ?)
+    ''', rows)
+    refresh_alerts(cursor, {row[0] for row in rows})
+
+def import_members(uploaded_file, default_password, approved_by):
+    """Nhập thành viên (đã phê duyệt) từ file; trả về (thành công, thông báo, DataFrame lỗi theo dòng)"""
+    errors = []
+    imported = 0
+    try:
+        email_map = get_member_directory().email_map()
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        
+        for chunk in read_import_chunks(uploaded_file):
+            chunk = normalize_import_chunk(chunk, MEMBER_IMPORT_COLUMNS)
+            emails = chunk['email'].str.lower()
+            birth_dates = parse_import_dates(chunk['birth_date'])
+            passwords = chunk['password'] if 'password' in chunk.columns else pd.Series('', index=chunk.index)
+            passwords = passwords.where(passwords != '', default_password or '')
+            
+            valid, chunk_errors = collect_import_errors(chunk, [
+                (chunk['full_name'] == '', "Thiếu họ tên"),
+                (~chunk['email'].str.match(EMAIL_PATTERN), "Email không hợp lệ"),
+                (emails.isin(email_map.keys()), "Email đã tồn tại"),
+                (emails.duplicated(keep='first') & (chunk['email'] != ''), "Email bị lặp trong file"),
+                (chunk['phone'] == '', "Thiếu số điện thoại"),
+                (birth_dates.isna(), "Ngày sinh không hợp lệ (YYYY-MM-DD hoặc DD/MM/YYYY)"),
+                (passwords == '', "Thiếu mật khẩu"),
+            ])
+            errors += chunk_errors
+            if not valid.any():
+                continue
+            
+            rows = [
+                (full_name, email, phone, birth_date.strftime('%Y-%m-%d'), hash_password(password), now, now)
+                for full_name, email, phone, birth_date, password in zip(
+                    chunk['full_name'][valid], chunk['email'][valid], chunk['phone'][valid],
+                    birth_dates[valid], passwords[valid])
+            ]
+            try:
+                new_ids = run_write_transaction(insert_member_rows, rows, approved_by)
+            except Exception as e:
+                errors += [{'row': row + 2, 'error': f"Lỗi ghi: {str(e)}"} for row in chunk.index[valid]]
+                continue
+            
+            imported += len(new_ids)
+            # Các khối sau cũng phải thấy email vừa thêm để bắt trùng giữa các khối
+            email_map.update({email: (user_id, 1, 0) for email, user_id in new_ids.items()})
+    except Exception as e:
+        return False, f"Lỗi đọc file: {str(e)}", pd.DataFrame(errors, columns=['row', 'error'])
+    finally:
+        if imported:
+            invalidate_tables('users', 'alerts')
+    
+    return True, f"Đã thêm {imported} thành viên, {len(errors)} dòng lỗi", pd.DataFrame(errors, columns=['row', 'error'])
+
+def import_contributions(uploaded_file):
+    """Nhập các khoản đóng quỹ (tra thành viên theo email); trả về (thành công, thông báo, DataFrame lỗi theo dòng)"""
+    errors = []
+    imported = 0
+    total_amount = 0
+    try:
+        email_map = {
+            email: user[0] for email, user in get_member_directory().email_map().items()
+            if user[1] == 1 and user[2] == 0
+        }
+        now = datetime.now()
+        
+        for chunk in read_import_chunks(uploaded_file):
+            chunk = normalize_import_chunk(chunk, CONTRIBUTION_IMPORT_COLUMNS)
+            user_ids = chunk['email'].str.lower().map(email_map)
+            amounts = pd.to_numeric(chunk['amount'].str.replace(r'[,.\s]', '', regex=True), errors='coerce')
+            dates = parse_import_dates(chunk['date']) if 'date' in chunk.columns else pd.Series(pd.NaT, index=chunk.index)
+            has_date = chunk['date'] != '' if 'date' in chunk.columns else pd.Series(False, index=chunk.index)
+            descriptions = chunk['description'] if 'description' in chunk.columns else pd.Series('', index=chunk.index)
+            
+            valid, chunk_errors = collect_import_errors(chunk, [
+                (user_ids.isna(), "Không tìm thấy thành viên đã phê duyệt với email này"),
+                (amounts.isna() | (amounts <= 0), "Số tiền phải là số dương"),
+                (has_date & dates.isna(), "Ngày không hợp lệ (YYYY-MM-DD hoặc DD/MM/YYYY)"),
+            ])
+            errors += chunk_errors
+            if not valid.any():
+                continue
+            
+            created_at = dates.fillna(now).dt.strftime('%Y-%m-%d %H:%M:%S')
+            rows = list(zip(
+                user_ids[valid].astype(int).tolist(),
+                amounts[valid].astype(int).tolist(),
+                descriptions[valid].where(descriptions[valid] != '', 'Đóng quỹ').tolist(),
+                created_at[valid].tolist(),
+            ))
+            try:
+                run_write_transaction(insert_contribution_rows, rows)
+            except Exception as e:
+                errors += [{'row': row + 2, 'error': f"Lỗi ghi: {str(e)}"} for row in chunk.index[valid]]
+                continue
+            
+            imported += len(rows)
+            total_amount += sum(row[1] for row in rows)
+    except Exception as e:
+        return False, f"Lỗi đọc file: {str(e)}", pd.DataFrame(errors, columns=['row', 'error'])
+    finally:
+        if imported:
+            invalidate_tables('finances', 'member_balances', 'alerts', 'monthly_member_rollups', 'monthly_club_rollups')
+    
+    return (True, f"Đã ghi {imported} khoản đóng quỹ ({total_amount:,} VNĐ), {len(errors)} dòng lỗi",
+            pd.DataFrame(errors, columns=['row', 'error']))
+
+@cached_query('vote_sessions', 'votes', 'users', error_message="Lỗi lấy vote sessions for expense")
 def get_vote_sessions_for_expense():
     """Lấy danh sách các buổi đã có vote để chọn khi thêm chi phí"""
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
-        df = pd.read_sql_query('''
-            SELECT vs.session_date, vs.description, 
-                   COUNT(CASE WHEN u.is_admin = 0 THEN v.id END) as vote_count
+        return pd.read_sql_query('''
+            SELECT vs.id, vs.session_date, vs.description, COUNT(*) as vote_count
             FROM vote_sessions vs
-            LEFT JOIN votes v ON vs.session_date = v.session_date
-            LEFT JOIN users u ON v.user_id = u.id
-            GROUP BY vs.session_date, vs.description
-            HAVING vote_count > 0
-            ORDER BY vs.session_date DESC
+            JOIN votes v ON v.session_id = vs.id
+            JOIN users u ON v.user_id = u.id
+            WHERE u.is_admin = 0
+            GROUP BY vs.id, vs.session_date, vs.description
+            ORDER BY vs.session_date DESC, vs.id DESC
         ''', conn)
+    finally:
         conn.close()
-        return df
-    except Exception as e:
-        st.error(f"Lỗi lấy vote sessions for expense: {str(e)}")
-        return pd.DataFrame()
 
-def add_expense(session_date, court_fee, water_fee, other_fee, description):
+def split_evenly(total, count, offset=0):
+    """Chia total cho count phần; phần dư chia thêm 1 VNĐ lần lượt từ phần thứ offset (vòng lại đầu) để tổng luôn khớp"""
+    base, remainder = divmod(total, count)
+    return [base + 1 if (i - offset) % count < remainder else base for i in range(count)]
+
+def split_session_fees(court_fee, water_fee, other_fee, count):
+    """Chia từng khoản cho count người; trả về các dòng (tổng, sân, nước, khác) với tổng = sân + nước + khác"""
+    # Phần dư của khoản sau nối tiếp phần dư của khoản trước, nên tổng mỗi dòng vẫn chỉ lệch nhau tối đa 1 VNĐ
+    shares = []
+    offset = 0
+    for fee in (court_fee, water_fee, other_fee):
+        shares.append(split_evenly(fee, count, offset))
+        offset = (offset + fee) % count
+    return [(sum(row), *row) for row in zip(*shares)]
+
+def insert_session_expense(cursor, session_id, court_fee, water_fee, other_fee, description):
+    """Chia chi phí buổi tập cho các thành viên đã vote; trả về số người được chia (0 nếu không có ai)"""
+    # Đọc danh sách vote và ghi chi phí trong cùng transaction để không chia thiếu/thừa
+    cursor.execute('SELECT session_date FROM vote_sessions WHERE id = ?', (session_id,))
+    session = cursor.fetchone()
+    
+    # Lấy danh sách thành viên đã vote cho buổi này (chỉ thành viên, không bao gồm admin)
+    cursor.execute(SESSION_VOTERS_SQL, (session_id,))
+    
+    voters = [row[0] for row in cursor.fetchall()]
+    
+    if not session or not voters:
+        return 0
+    
+    session_date = session[0]
+    participants = len(voters)
+    created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    
+    total_fee = court_fee + water_fee + other_fee
+    
+    cursor.execute('''
+        INSERT INTO expense_events (session_id, session_date, description, court_fee, water_fee, other_fee,
+                                    total_amount, participants, cost_per_person, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (session_id, str(session_date), description, court_fee, water_fee, other_fee,
+          total_fee, participants, total_fee // participants, created_at))
+    expense_event_id = cursor.lastrowid
+    
+    # Chia từng khoản một lần; voters sắp theo user_id nên phần dư luôn rơi vào cùng người
+    shares = split_session_fees(court_fee, water_fee, other_fee, participants)
+    
+    cursor.executemany('''
+        INSERT INTO finances (user_id, amount, transaction_type, description, session_date, 
+                            court_fee, water_fee, other_fee, total_participants, created_at, expense_event_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (user_id, -amount, 'expense', description, str(session_date),
+         court_share, water_share, other_share, participants, created_at, expense_event_id)
+        for user_id, (amount, court_share, water_share, other_share) in zip(voters, shares)
+    ])
+    refresh_alerts(cursor, voters)
+    return participants
+
+def add_expense(session_id, court_fee, water_fee, other_fee, description):
     """Thêm chi phí cho buổi tập và chia đều cho các thành viên đã vote"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
         total_fee = court_fee + water_fee + other_fee
+        participants = run_queued_write(insert_session_expense, session_id, court_fee, water_fee, other_fee,
+                                        description)
         
-        # Lấy danh sách thành viên đã vote cho buổi này (chỉ thành viên, không bao gồm admin)
-        cursor.execute('''
-            SELECT v.user_id FROM votes v
-            JOIN users u ON v.user_id = u.id
-            WHERE v.session_date = ? AND u.is_admin = 0
-        ''', (str(session_date),))
-        
-        voters = cursor.fetchall()
-        
-        if voters:
-            cost_per_person = total_fee // len(voters)  # Chi phí mỗi người
-            
-            # Thêm chi phí cho từng thành viên đã vote
-            for voter in voters:
-                cursor.execute('''
-                    INSERT INTO finances (user_id, amount, transaction_type, description, session_date, 
-                                        court_fee, water_fee, other_fee, total_participants, created_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (voter[0], -cost_per_person, 'expense', description, str(session_date), 
-                      court_fee//len(voters), water_fee//len(voters), other_fee//len(voters), 
-                      len(voters), datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        if participants:
+            invalidate_tables('finances', 'member_balances', 'alerts', 'expense_events',
+                              'monthly_member_rollups', 'monthly_club_rollups')
             
-            conn.commit()
-            conn.close()
-            return True, f"Đã chia {total_fee:,} VNĐ cho {len(voters)} thành viên ({cost_per_person:,} VNĐ/người)"
+            cost_per_person, remainder = divmod(total_fee, participants)
+            message = f"Đã chia {total_fee:,} VNĐ cho {participants} thành viên ({cost_per_person:,} VNĐ/người)"
+            if remainder:
+                message += f", {remainder} thành viên trả thêm 1 VNĐ"
+            return True, message
         else:
-            conn.close()
             return False, "Không có thành viên nào vote cho buổi này"
     except Exception as e:
         return False, f"Lỗi thêm chi phí: {str(e)}"
 
+@dataclass(frozen=True)
+class DashboardSnapshot:
+    """Số liệu tổng quan cho trang chủ"""
+    member_count: int = 0
+    top_wins: int = 0
+    total_balance: int = 0
+    top_winners: tuple = ()        # ((full_name, total_wins), ...)
+    top_contributors: tuple = ()   # ((full_name, total_contribution), ...)
+
+@cached_query('users', 'rankings', 'member_balances', error_message="Lỗi lấy số liệu tổng quan",
+              empty_result=DashboardSnapshot)
+def get_dashboard_snapshot():
+    """Lấy số liệu tổng quan trang chủ trong một lần truy vấn"""
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(DASHBOARD_SNAPSHOT_SQL).fetchall()
+    finally:
+        conn.close()
+    
+    scalars = {kind: value for kind, _, value in rows if kind in ('member_count', 'total_balance')}
+    top_winners = sorted(((name, value) for kind, name, value in rows if kind == 'winner'),
+                         key=lambda item: item[1], reverse=True)
+    top_contributors = sorted(((name, value) for kind, name, value in rows if kind == 'contributor'),
+                              key=lambda item: item[1], reverse=True)
+    return DashboardSnapshot(
+        member_count=scalars.get('member_count', 0),
+        top_wins=top_winners[0][1] if top_winners else 0,
+        total_balance=scalars.get('total_balance', 0),
+        top_winners=tuple(top_winners),
+        top_contributors=tuple(top_contributors),
+    )
+
+@cached_query('users', 'member_balances', error_message="Lỗi lấy financial summary")
 def get_financial_summary():
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
-        df = pd.read_sql_query('''
-            SELECT u.full_name,
-                   COALESCE(SUM(CASE WHEN f.transaction_type = 'contribution' THEN f.amount ELSE 0 END), 0) as total_contribution,
-                   COUNT(CASE WHEN f.transaction_type = 'expense' THEN 1 END) as sessions_attended,
-                   COALESCE(SUM(CASE WHEN f.transaction_type = 'expense' THEN f.amount ELSE 0 END), 0) as total_expenses,
-                   COALESCE(SUM(f.amount), 0) as balance
-            FROM users u
-            LEFT JOIN finances f ON u.id = f.user_id
-            WHERE u.is_approved = 1 AND u.is_admin = 0
-            GROUP BY u.id, u.full_name
-            ORDER BY balance DESC
-        ''', conn)
+        return pd.read_sql_query(FINANCIAL_SUMMARY_SQL, conn)
+    finally:
         conn.close()
-        return df
+
+def trend_start_month(months):
+    """Tháng đầu tiên (YYYY-MM) của khoảng months tháng gần nhất, tính cả tháng hiện tại"""
+    today = datetime.now().date()
+    index = today.year * 12 + today.month - months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+@cached_query('monthly_member_rollups', error_message="Lỗi lấy thống kê tháng của thành viên")
+def get_member_monthly_trend(user_id, months=TREND_MONTHS):
+    conn = get_db_connection()
+    try:
+        df = pd.read_sql_query(MEMBER_TREND_SQL, conn, params=[user_id, trend_start_month(months)])
+    finally:
+        conn.close()
+    df['avg_cost'] = (df['spend'] / df['sessions_attended'].where(df['sessions_attended'] > 0)).round()
+    return df
+
+@cached_query('monthly_club_rollups', error_message="Lỗi lấy thống kê tháng của CLB")
+def get_club_monthly_trend(months=TREND_MONTHS):
+    conn = get_db_connection()
+    try:
+        df = pd.read_sql_query(CLUB_TREND_SQL, conn, params=[trend_start_month(months)])
+    finally:
+        conn.close()
+    df['avg_cost'] = (df['spend'] / df['sessions_held'].where(df['sessions_held'] > 0)).round()
+    return df
+
+def rebuild_balances_and_alerts(cursor):
+    rebuild_member_balances_table(cursor, MEMBER_BALANCES_SQL)
+    refresh_alerts(cursor)
+
+def rebuild_member_balances():
+    """Tính lại bảng member_balances từ sổ cái finances"""
+    try:
+        run_write_transaction(rebuild_balances_and_alerts)
+        invalidate_tables('member_balances', 'alerts', 'app_settings')
+        return True, "Đã tính lại số dư từ sổ cái!"
     except Exception as e:
-        st.error(f"Lỗi lấy financial summary: {str(e)}")
-        return pd.DataFrame()
+        return False, f"Lỗi tính lại số dư: {str(e)}"
 
-def get_expense_history():
-    """Lấy lịch sử chi phí theo từng buổi tập"""
+def check_member_balances():
+    """So sánh member_balances với sổ cái, trả về các thành viên bị lệch"""
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
-        df = pd.read_sql_query('''
-            SELECT 
-                f.session_date,
-                f.description,
-                MAX(f.total_participants) as participants_count,
-                SUM(-f.amount) as total_cost,
-                (-f.amount) as cost_per_person,
-                f.created_at
-            FROM finances f
-            WHERE f.transaction_type = 'expense' AND f.session_date != ''
-            GROUP BY f.session_date, f.description, f.amount, f.created_at
-            ORDER BY f.session_date DESC, f.created_at DESC
+        ledger = pd.read_sql_query(MEMBER_BALANCES_SQL, conn)
+        stored = pd.read_sql_query('''
+            SELECT user_id, total_contribution, total_expenses, sessions_attended, balance
+            FROM member_balances
         ''', conn)
+    finally:
         conn.close()
-        return df
+    
+    columns = ['total_contribution', 'total_expenses', 'sessions_attended', 'balance']
+    merged = ledger.merge(stored, on='user_id', how='outer', suffixes=('_ledger', '_stored'))
+    merged = merged.fillna(0)
+    mismatched = pd.Series(False, index=merged.index)
+    for column in columns:
+        mismatched |= merged[f'{column}_ledger'] != merged[f'{column}_stored']
+    return merged[mismatched].reset_index(drop=True)
+
+# Lưu trữ: bảng -> điều kiện chọn các dòng cũ cần chuyển sang file lưu trữ
+ARCHIVE_SELECTORS = {
+    'finances': 'created_at < ?',
+    'rankings': 'match_date < ?',
+    'votes': 'session_id IN (SELECT id FROM temp.archived_sessions)',
+    'vote_sessions': 'id IN (SELECT id FROM temp.archived_sessions)',
+}
+ARCHIVE_INDEXES = {
+    'finances': ['user_id', 'created_at'],
+    'rankings': ['user_id'],
+    'votes': ['session_id'],
+}
+
+# Phiên chỉ được lưu trữ khi mọi vote của phiên đều trước mốc (cảnh báo ít hoạt động vẫn đếm đủ)
+ARCHIVED_SESSIONS_SQL = '''
+    CREATE TEMP TABLE archived_sessions AS
+    SELECT vs.id FROM vote_sessions vs
+    WHERE vs.session_date < ?
+      AND NOT EXISTS (SELECT 1 FROM votes v WHERE v.session_id = vs.id AND v.created_at >= ?)
+'''
+
+FINANCE_CARRY_FORWARD_SQL = '''
+    INSERT INTO finance_carry_forward (user_id, total_contribution, total_expenses, sessions_attended, balance,
+                                       archived_through)
+    SELECT f.user_id,
+           COALESCE(SUM(CASE WHEN f.transaction_type = 'contribution' THEN f.amount ELSE 0 END), 0),
+           COALESCE(SUM(CASE WHEN f.transaction_type = 'expense' THEN f.amount ELSE 0 END), 0),
+           COUNT(CASE WHEN f.transaction_type = 'expense' THEN 1 END),
+           COALESCE(SUM(f.amount), 0),
+           ?
+    FROM finances f
+    WHERE f.user_id IS NOT NULL AND f.created_at < ? AND f.id IN (SELECT id FROM archive.finances)
+    GROUP BY f.user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        total_contribution = total_contribution + excluded.total_contribution,
+        total_expenses = total_expenses + excluded.total_expenses,
+        sessions_attended = sessions_attended + excluded.sessions_attended,
+        balance = balance + excluded.balance,
+        archived_through = excluded.archived_through
+'''
+
+RANKING_CARRY_FORWARD_SQL = '''
+    INSERT INTO ranking_carry_forward (user_id, wins, archived_through)
+    SELECT r.user_id, COALESCE(SUM(r.wins), 0), ?
+    FROM rankings r
+    WHERE r.user_id IS NOT NULL AND r.match_date < ? AND r.id IN (SELECT id FROM archive.rankings)
+    GROUP BY r.user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        wins = wins + excluded.wins,
+        archived_through = excluded.archived_through
+'''
+
+def ensure_archive_table(cursor, table):
+    """Tạo bảng trong file lưu trữ theo cột của bảng chính (thêm cột còn thiếu); trả về danh sách cột"""
+    columns = cursor.execute(f'PRAGMA main.table_info({table})').fetchall()
+    existing = {row[1] for row in cursor.execute(f'PRAGMA archive.table_info({table})')}
+    if not existing:
+        definitions = ', '.join(f"{name} {column_type}{' PRIMARY KEY' if pk else ''}"
+                                for _, name, column_type, _, _, pk in columns)
+        cursor.execute(f'CREATE TABLE archive.{table} ({definitions})')
+        for column in ARCHIVE_INDEXES.get(table, []):
+            cursor.execute(f'CREATE INDEX archive.idx_{table}_{column} ON {table} ({column})')
+    else:
+        for _, name, column_type, *_ in columns:
+            if name not in existing:
+                cursor.execute(f'ALTER TABLE archive.{table} ADD COLUMN {name} {column_type}')
+    return [row[1] for row in columns]
+
+# Main ở chế độ WAL nên một transaction ghi cả hai file không commit nguyên tử được: chép sang file lưu trữ
+# và commit trước, sau đó mới xóa ở main (chỉ các dòng đã có bản sao); dừng giữa chừng ở bước nào cũng chạy lại được
+def copy_rows_to_archive(cursor, cutoff):
+    """Bước 1: chép các dòng trước cutoff sang file lưu trữ (transaction chỉ ghi vào file lưu trữ)"""
+    cutoff = str(cutoff)
+    settings = read_alert_settings(cursor)
+    earliest = (datetime.now() - timedelta(days=settings['low_activity_days'])).strftime('%Y-%m-%d')
+    if cutoff > earliest:
+        raise ValueError(f"Chỉ lưu trữ được dữ liệu trước {earliest} (ngoài cửa sổ tính cảnh báo ít hoạt động)")
+    
+    cursor.execute('DROP TABLE IF EXISTS temp.archived_sessions')
+    cursor.execute(ARCHIVED_SESSIONS_SQL, (cutoff, cutoff))
+    # INSERT OR REPLACE: chạy lại sau sự cố thì chép đè bản sao cũ, không bị trùng khóa
+    for table, selector in ARCHIVE_SELECTORS.items():
+        params = (cutoff,) if '?' in selector else ()
+        columns = ', '.join(ensure_archive_table(cursor, table))
+        cursor.execute(f'''
+            INSERT OR REPLACE INTO archive.{table} ({columns})
+            SELECT {columns} FROM main.{table} WHERE {selector}
+        ''', params)
+    cursor.execute('DROP TABLE temp.archived_sessions')
+
+def remove_archived_rows(cursor, cutoff):
+    """Bước 2 (chỉ ghi vào main): cộng dồn carry forward rồi xóa các dòng đã có trong file lưu trữ; trả về số dòng theo bảng"""
+    cutoff = str(cutoff)
+    settings = read_alert_settings(cursor)
+    cursor.execute('DROP TABLE IF EXISTS temp.archived_sessions')
+    cursor.execute(ARCHIVED_SESSIONS_SQL, (cutoff, cutoff))
+    cursor.execute(FINANCE_CARRY_FORWARD_SQL, (cutoff, cutoff))
+    cursor.execute(RANKING_CARRY_FORWARD_SQL, (cutoff, cutoff))
+    
+    # Checkpoint tính trên cả file lưu trữ nên chuyển dòng sang đó không làm đổi checkpoint nào
+    save_checkpoints(cursor)
+    moved = {}
+    for table, selector in ARCHIVE_SELECTORS.items():
+        params = (cutoff,) if '?' in selector else ()
+        cursor.execute(f'DELETE FROM main.{table} WHERE {selector} AND id IN (SELECT id FROM archive.{table})', params)
+        moved[table] = cursor.rowcount
+    cursor.execute('DROP TABLE temp.archived_sessions')
+    restore_checkpoints(cursor)
+    
+    rebuild_balances_and_alerts(cursor)
+    write_setting(cursor, 'archived_through', max(cutoff, settings['archived_through'] or ''))
+    return moved
+
+def archive_old_data(cutoff):
+    """Lưu trữ dữ liệu trước cutoff sang ARCHIVE_DB_FILE, trả về (thành công, thông báo)"""
+    try:
+        run_write_transaction(copy_rows_to_archive, cutoff, archive=True)
+        moved = run_write_transaction(remove_archived_rows, cutoff, archive=True)
+        invalidate_tables('finances', 'rankings', 'votes', 'vote_sessions', 'member_balances', 'alerts', 'app_settings')
+        summary = ', '.join(f"{table}: {count:,}" for table, count in moved.items())
+        return True, f"Đã chuyển sang file lưu trữ ({summary})"
+    except ValueError as e:
+        return False, str(e)
     except Exception as e:
-        st.error(f"Lỗi lấy expense history: {str(e)}")
-        return pd.DataFrame()
+        return False, f"Lỗi lưu trữ dữ liệu: {str(e)}"
+
+# Checkpoint số dư đầu tháng: số dư tại ngày X = checkpoint gần nhất + các dòng sổ cái từ checkpoint đến X
+BALANCE_DELTA_SQL = '''
+    SELECT f.user_id,
+           COALESCE(SUM(CASE WHEN f.transaction_type = 'contribution' THEN f.amount ELSE 0 END), 0) as total_contribution,
+           COALESCE(SUM(CASE WHEN f.transaction_type = 'expense' THEN f.amount ELSE 0 END), 0) as total_expenses,
+           COUNT(CASE WHEN f.transaction_type = 'expense' THEN 1 END) as sessions_attended,
+           COALESCE(SUM(f.amount), 0) as balance
+    FROM {source} f
+    WHERE f.created_at >= ? AND f.created_at < ? AND f.user_id IS NOT NULL {member_filter}
+    GROUP BY f.user_id
+'''
+CHECKPOINT_ROWS_SQL = '''
+    SELECT user_id, total_contribution, total_expenses, sessions_attended, balance
+    FROM balance_checkpoints
+    WHERE checkpoint_date = ? {member_filter}
+'''
+
+def month_start(value):
+    return value.replace(day=1)
+
+def next_month(value):
+    return (value.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def ledger_sources(cursor):
+    """Các bảng sổ cái cần đọc: cả file lưu trữ nếu kết nối đang gắn"""
+    if 'finances' in archive_tables(cursor):
+        return ['archive.finances', 'main.finances']
+    return ['main.finances']
+
+def balances_since_sql(sources, user_id=None):
+    """SQL + tham số gộp checkpoint tại base_date với các dòng sổ cái trong [base_date, end) của từng nguồn"""
+    member_filter = 'AND user_id = ?' if user_id is not None else ''
+    member_params = [user_id] if user_id is not None else []
+    parts = [CHECKPOINT_ROWS_SQL.format(member_filter=member_filter)]
+    parts += [BALANCE_DELTA_SQL.format(source=source, member_filter=member_filter.replace('user_id', 'f.user_id'))
+              for source in sources]
+    sql = f'''
+        SELECT user_id,
+               SUM(total_contribution) as total_contribution,
+               SUM(total_expenses) as total_expenses,
+               SUM(sessions_attended) as sessions_attended,
+               SUM(balance) as balance
+        FROM ({' UNION ALL '.join(parts)})
+        GROUP BY user_id
+    '''
+    
+    def params(base_date, end):
+        return [base_date, *member_params] + [value for _ in sources for value in (base_date, end, *member_params)]
+    return sql, params
+
+def save_checkpoints(cursor):
+    """Chép checkpoint ra bảng tạm trước một lần xóa sổ cái không làm đổi số dư (trigger sẽ xóa checkpoint)"""
+    cursor.execute('DROP TABLE IF EXISTS temp.saved_checkpoints')
+    cursor.execute('CREATE TEMP TABLE saved_checkpoints AS SELECT * FROM balance_checkpoints')
+
+def restore_checkpoints(cursor):
+    """Khôi phục các checkpoint đã chép bằng save_checkpoints"""
+    cursor.execute('INSERT OR IGNORE INTO balance_checkpoints SELECT * FROM temp.saved_checkpoints')
+    cursor.execute('DROP TABLE temp.saved_checkpoints')
+
+def generate_balance_checkpoints(cursor):
+    """Tạo các checkpoint đầu tháng còn thiếu đến tháng hiện tại, mỗi tháng cộng dồn từ tháng trước; trả về số tháng"""
+    sources = ledger_sources(cursor)
+    latest = cursor.execute('SELECT MAX(checkpoint_date) FROM balance_checkpoints').fetchone()[0]
+    if latest:
+        base_date = latest
+        month = next_month(datetime.strptime(latest, '%Y-%m-%d').date())
+    else:
+        first = min((row[0] for source in sources
+                     for row in cursor.execute(f'SELECT MIN(created_at) FROM {source}') if row[0]), default=None)
+        if first is None:
+            return 0
+        base_date = ''
+        month = next_month(datetime.strptime(first[:10], '%Y-%m-%d').date())
+    
+    sql, params = balances_since_sql(sources)
+    current = month_start(datetime.now().date())
+    generated = 0
+    while month <= current:
+        cursor.execute(f'''
+            INSERT INTO balance_checkpoints (checkpoint_date, user_id, total_contribution, total_expenses,
+                                             sessions_attended, balance)
+            SELECT ?, * FROM ({sql})
+        ''', [str(month), *params(base_date, str(month))])
+        base_date = str(month)
+        month = next_month(month)
+        generated += 1
+    return generated
+
+def ensure_balance_checkpoints():
+    """Tạo checkpoint còn thiếu (lần đầu mỗi tháng hoặc sau khi có dòng ghi lùi ngày)"""
+    conn = get_db_connection()
+    try:
+        latest = conn.execute('SELECT MAX(checkpoint_date) FROM balance_checkpoints').fetchone()[0]
+        has_ledger = conn.execute('SELECT 1 FROM finances LIMIT 1').fetchone() is not None
+    finally:
+        conn.close()
+    if latest == str(month_start(datetime.now().date())) or not (has_ledger or os.path.exists(ARCHIVE_DB_FILE)):
+        return 0
+    return run_write_transaction(generate_balance_checkpoints, archive=os.path.exists(ARCHIVE_DB_FILE))
+
+def get_balances_as_of(as_of_date, user_id=None):
+    """Số dư của từng thành viên (hoặc một thành viên) tính đến hết ngày as_of_date"""
+    ensure_balance_checkpoints()
+    end = str(as_of_date + timedelta(days=1))
+    conn = get_db_connection()
+    attached = False
+    try:
+        base_date = conn.execute('SELECT MAX(checkpoint_date) FROM balance_checkpoints WHERE checkpoint_date <= ?',
+                                 (end,)).fetchone()[0] or ''
+        # Khoảng chênh lệch nằm trước mốc lưu trữ thì phải đọc thêm file lưu trữ
+        archived_through = conn.execute(
+            "SELECT value FROM app_settings WHERE key = 'archived_through'").fetchone()
+        if archived_through and base_date < archived_through[0] and os.path.exists(ARCHIVE_DB_FILE):
+            attach_archive(conn)
+            attached = True
+        sql, params = balances_since_sql(ledger_sources(conn.cursor()), user_id)
+        return pd.read_sql_query(f'''
+            SELECT b.user_id, u.full_name, b.total_contribution, b.total_expenses, b.sessions_attended, b.balance
+            FROM ({sql}) b
+            JOIN users u ON u.id = b.user_id
+            ORDER BY u.full_name
+        ''', conn, params=params(base_date, end))
+    finally:
+        if attached:
+            detach_archive(conn)
+        conn.close()
+
+def verify_balance_checkpoint(checkpoint_date):
+    """Tính lại checkpoint từ đầu sổ cái (gồm cả file lưu trữ) và trả về các thành viên bị lệch"""
+    conn = get_db_connection()
+    attached = False
+    try:
+        if os.path.exists(ARCHIVE_DB_FILE):
+            attach_archive(conn)
+            attached = True
+        sql, params = balances_since_sql(ledger_sources(conn.cursor()))
+        expected = pd.read_sql_query(sql, conn, params=params('', checkpoint_date))
+        stored = pd.read_sql_query(CHECKPOINT_ROWS_SQL.format(member_filter=''), conn, params=[checkpoint_date])
+    finally:
+        if attached:
+            detach_archive(conn)
+        conn.close()
+    
+    columns = ['total_contribution', 'total_expenses', 'sessions_attended', 'balance']
+    merged = expected.merge(stored, on='user_id', how='outer', suffixes=('_ledger', '_checkpoint')).fillna(0)
+    mismatched = pd.Series(False, index=merged.index)
+    for column in columns:
+        mismatched |= merged[f'{column}_ledger'] != merged[f'{column}_checkpoint']
+    return merged[mismatched].reset_index(drop=True)
+
+def get_checkpoint_dates():
+    conn = get_db_connection()
+    try:
+        return [row[0] for row in conn.execute(
+            'SELECT DISTINCT checkpoint_date FROM balance_checkpoints ORDER BY checkpoint_date')]
+    finally:
+        conn.close()
+
+@cached_query('expense_events', error_message="Lỗi lấy expense history", empty_result=empty_page)
+def get_expense_history(before=None, limit=PAGE_SIZE):
+    """Lấy lịch sử chi phí theo từng lần chia (một trang, mới nhất trước); chỉ đọc bảng header"""
+    df, last_row = read_keyset_page(EXPENSE_HISTORY_SQL, EXPENSE_HISTORY_KEYSET, before, limit)
+    return df, (last_row[1], last_row[0]) if last_row else None
+
+def parquet_available():
+    """pyarrow là phụ thuộc tùy chọn, chỉ cần khi xuất Parquet"""
+    return importlib.util.find_spec('pyarrow') is not None
+
+def read_ledger_chunks(conn, start_date, end_date, user_id=None, sources=('main.finances',),
+                       chunk_size=EXPORT_CHUNK_SIZE):
+    """Đọc sổ cái trong khoảng [start_date, end_date] theo từng khối DataFrame, lần lượt từng nguồn"""
+    params = [str(start_date), str(end_date + timedelta(days=1))]
+    member_filter = ''
+    if user_id is not None:
+        member_filter = 'AND f.user_id = ?'
+        params.append(user_id)
+    for source in sources:
+        sql = LEDGER_EXPORT_SQL.format(source=source, member_filter=member_filter)
+        for chunk in pd.read_sql_query(sql, conn, params=params, chunksize=chunk_size):
+            yield chunk.astype({column: ('Int64' if dtype == 'int64' else 'string')
+                                for column, dtype in LEDGER_EXPORT_COLUMNS.items()})
+
+def write_ledger_csv(chunks, path):
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        header = True
+        for chunk in chunks:
+            chunk.to_csv(f, index=False, header=header)
+            header = False
+        if header:
+            pd.DataFrame(columns=list(LEDGER_EXPORT_COLUMNS)).to_csv(f, index=False)
+
+def write_ledger_parquet(chunks, path):
+    if not parquet_available():
+        raise ValueError("Cần cài pyarrow để xuất Parquet (pip install pyarrow) hoặc chọn CSV")
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    schema = pa.schema([(column, pa.int64() if dtype == 'int64' else pa.string())
+                        for column, dtype in LEDGER_EXPORT_COLUMNS.items()])
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+def export_ledger(file_format, start_date, end_date, user_id=None, include_archive=False):
+    """Ghi sổ cái đã lọc ra file tạm theo từng khối, trả về đường dẫn file (người gọi tự xóa)"""
+    if file_format not in LEDGER_EXPORT_FORMATS:
+        raise ValueError(f"Định dạng không hỗ trợ: {file_format}")
+    fd, path = tempfile.mkstemp(prefix='so_cai_', suffix=f'.{file_format}')
+    os.close(fd)
+    conn = get_db_connection()
+    attached = False
+    try:
+        # Dữ liệu lưu trữ luôn cũ hơn dữ liệu hiện tại nên đọc file lưu trữ trước
+        sources = ['main.finances']
+        if include_archive and os.path.exists(ARCHIVE_DB_FILE):
+            attach_archive(conn)
+            attached = True
+            if 'finances' in archive_tables(conn.cursor()):
+                sources.insert(0, 'archive.finances')
+        chunks = read_ledger_chunks(conn, start_date, end_date, user_id, sources)
+        if file_format == 'parquet':
+            write_ledger_parquet(chunks, path)
+        else:
+            write_ledger_csv(chunks, path)
+    except Exception:
+        os.remove(path)
+        raise
+    finally:
+        if attached:
+            detach_archive(conn)
+        conn.close()
+    return path
+
+@cached_query('app_settings', error_message="Lỗi lấy cấu hình cảnh báo",
+              empty_result=lambda: dict(ALERT_SETTING_DEFAULTS, alerts_swept_at=None, archived_through=None))
+def get_alert_settings():
+    conn = get_db_connection()
+    try:
+        return read_alert_settings(conn.cursor())
+    finally:
+        conn.close()
+
+@cached_query('alerts', 'users', error_message="Lỗi lấy alerts")
+def get_alerts():
+    """Đọc các cảnh báo đã tính sẵn"""
+    conn = get_db_connection()
+    try:
+        return pd.read_sql_query(ALERTS_SQL, conn)
+    finally:
+        conn.close()
+
+def sweep_stale_alerts(cursor, seen_swept_at, force):
+    """Quét lại toàn bộ nếu chưa session nào quét kể từ lần đọc seen_swept_at"""
+    # Kiểm tra lại trong transaction: session khác có thể vừa quét xong
+    if not force and read_alert_settings(cursor)['alerts_swept_at'] != seen_swept_at:
+        return False
+    refresh_alerts(cursor)
+    return True
+
+def sweep_alerts(force=False):
+    """Quét lại toàn bộ cảnh báo khi đến hạn (cảnh báo theo thời gian như vote ít trong N ngày)"""
+    settings = get_alert_settings()
+    if not force and settings['alerts_swept_at']:
+        swept_at = datetime.strptime(settings['alerts_swept_at'], '%Y-%m-%d %H:%M:%S')
+        if datetime.now() - swept_at < timedelta(minutes=settings['alert_sweep_minutes']):
+            return False
+    
+    try:
+        swept = run_write_transaction(sweep_stale_alerts, settings['alerts_swept_at'], force)
+        invalidate_tables('app_settings', 'alerts')
+        return swept
+    except Exception as e:
+        st.error(f"Lỗi quét cảnh báo: {str(e)}")
+        return False
 
-def get_alerts():
-    alerts = []
-    
+def save_alert_settings(cursor, values):
+    # Vote trước mốc lưu trữ không còn trong bảng votes nên cửa sổ "ít hoạt động" không được vượt qua mốc đó
+    archived_through = read_alert_settings(cursor)['archived_through']
+    if archived_through and 'low_activity_days' in values:
+        since = (datetime.now() - timedelta(days=int(values['low_activity_days']))).strftime('%Y-%m-%d')
+        if since < archived_through:
+            raise ValueError(f"Số ngày tính hoạt động vượt qua mốc đã lưu trữ ({archived_through})")
+    for key, value in values.items():
+        if key in ALERT_SETTING_DEFAULTS:
+            write_setting(cursor, key, int(value))
+    refresh_alerts(cursor)
+
+def update_alert_settings(values):
+    """Lưu ngưỡng cảnh báo và tính lại toàn bộ cảnh báo theo ngưỡng mới"""
     try:
-        conn = get_db_connection()
-        
-        # Check low balance alert
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT u.full_name, COALESCE(SUM(f.amount), 0) as balance
-            FROM users u
-            LEFT JOIN finances f ON u.id = f.user_id
-            WHERE u.is_approved = 1 AND u.is_admin = 0
-            GROUP BY u.id, u.full_name
-            HAVING balance < 100000
-        ''')
-        
-        low_balance_users = cursor.fetchall()
-        for user in low_balance_users:
-            alerts.append(f"⚠️ {user[0]} có số dư thấp: {user[1]:,} VNĐ")
-        
-        # Check low voting activity
-        thirty_days_ago = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-        cursor.execute('''
-            SELECT u.full_name, COUNT(v.id) as vote_count
-            FROM users u
-            LEFT JOIN votes v ON u.id = v.user_id AND v.created_at >= ?
-            WHERE u.is_approved = 1 AND u.is_admin = 0
-            GROUP BY u.id, u.full_name
-            HAVING vote_count < 3
-        ''', (thirty_days_ago,))
-        
-        low_activity_users = cursor.fetchall()
-        for user in low_activity_users:
-            alerts.append(f"📊 {user[0]} vote ít trong 30 ngày qua: {user[1]} lần")
-        
-        conn.close()
+        run_write_transaction(save_alert_settings, values)
+        invalidate_tables('app_settings', 'alerts')
+        return True, "Đã lưu ngưỡng cảnh báo!"
     except Exception as e:
-        st.error(f"Lỗi lấy alerts: {str(e)}")
-    
-    return alerts
+        return False, f"Lỗi lưu ngưỡng cảnh báo: {str(e)}"
 
 # Initialize database
 if 'db_initialized' not in st.session_state:
@@ -790,6 +3324,8 @@ if 'editing_member_id' not in st.session_state:
 
 # Main app
 def main():
+    get_query_stats().start_rerun()
+    
     if not st.session_state.db_initialized:
         st.error("Không thể khởi tạo database. Vui lòng thử lại!")
         return
@@ -867,6 +3403,18 @@ def show_main_app():
     show_navigation_menu()
     
     # Main content routing
+    profiling = st.session_state.get('profiling')
+    if profiling and profiling['page'] == st.session_state.current_page:
+        run_profiled(profiling, show_current_page)
+    else:
+        show_current_page()
+    
+    if st.session_state.user['is_admin']:
+        totals = get_query_stats().rerun_totals()
+        st.caption(f"🕒 Lần tải trang này: {totals['queries']} truy vấn SQL, "
+                   f"{totals['total_ms']:.1f} ms, {totals['rows']:,} dòng")
+
+def show_current_page():
     if st.session_state.current_page == "🏠 Trang chủ":
         show_home_page()
     elif st.session_state.current_page == "✅ Phê duyệt thành viên":
@@ -883,13 +3431,21 @@ def show_main_app():
         show_finance_page()
     elif st.session_state.current_page == "⚠️ Cảnh báo":
         show_alerts_page()
+    elif st.session_state.current_page == "📈 Hiệu năng":
+        show_performance_page()
 
-def show_navigation_menu():
+def get_menu_items(is_admin):
     menu_items = ["🏠 Trang chủ", "👥 Danh sách thành viên", "🏆 Xếp hạng", "🗳️ Bình chọn", "💰 Tài chính", "⚠️ Cảnh báo"]
     
-    if st.session_state.user['is_admin']:
+    if is_admin:
         menu_items.insert(1, "✅ Phê duyệt thành viên")
         menu_items.insert(2, "✏️ Quản lý thành viên")
+        menu_items.append("📈 Hiệu năng")
+    
+    return menu_items
+
+def show_navigation_menu():
+    menu_items = get_menu_items(st.session_state.user['is_admin'])
     
     st.markdown('<div class="nav-menu">', unsafe_allow_html=True)
     
@@ -912,37 +3468,72 @@ def show_navigation_menu():
     
     st.markdown('</div>', unsafe_allow_html=True)
 
+def get_page_cursor(list_key):
+    """Cursor của trang đang xem trong một danh sách phân trang (None = trang đầu)"""
+    return st.session_state.setdefault(f'{list_key}_cursors', [None])[-1]
+
+def show_page_controls(list_key, next_cursor):
+    """Nút chuyển trang; lưu chồng cursor các trang đã đi qua trong session state"""
+    cursors = st.session_state.setdefault(f'{list_key}_cursors', [None])
+    if len(cursors) == 1 and next_cursor is None:
+        return  # Chỉ có một trang
+    
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    
+    with col_prev:
+        if st.button("◀️ Trang trước", key=f"{list_key}_prev", disabled=len(cursors) == 1, use_container_width=True):
+            cursors.pop()
+            st.rerun()
+    
+    with col_page:
+        st.markdown(f"<div style='text-align: center;'>Trang {len(cursors)}</div>", unsafe_allow_html=True)
+    
+    with col_next:
+        if st.button("Trang sau ▶️", key=f"{list_key}_next", disabled=next_cursor is None, use_container_width=True):
+            cursors.append(next_cursor)
+            st.rerun()
+
+def member_picker(label, key, all_label=None):
+    """Ô tìm thành viên và danh sách kết quả đầu tiên; trả về dòng thành viên đã chọn (None nếu chọn all_label)"""
+    query = st.text_input(label, key=f"{key}_query", placeholder="🔍 Gõ tên, email hoặc số điện thoại")
+    members = {int(row['id']): row for row in search_members(query).to_dict('records')}
+    options = ([None] if all_label else []) + list(members)
+    if not options:
+        st.caption("Không tìm thấy thành viên phù hợp")
+        return None
+    selected = st.selectbox(
+        label, options, key=key, label_visibility="collapsed",
+        format_func=lambda user_id: all_label if user_id is None
+        else f"{members[user_id]['full_name']} ({members[user_id]['email']})")
+    return members.get(selected)
+
 def show_home_page():
     st.title("📊 Trang chủ - Tổng quan")
     
-    members_df = get_approved_members()
-    rankings_df = get_rankings()
-    financial_df = get_financial_summary()
+    snapshot = get_dashboard_snapshot()
     
     col1, col2, col3 = st.columns(3)
     
     with col1:
         st.markdown(f"""
             <div class="stat-card">
-                <div class="stat-number">{len(members_df)}</div>
+                <div class="stat-number">{snapshot.member_count}</div>
                 <div class="stat-label">👥 Tổng số thành viên</div>
             </div>
         """, unsafe_allow_html=True)
     
     with col2:
-        top_wins = rankings_df.iloc[0]['total_wins'] if not rankings_df.empty else 0
         st.markdown(f"""
             <div class="stat-card">
-                <div class="stat-number">{top_wins}</div>
+                <div class="stat-number">{snapshot.top_wins}</div>
                 <div class="stat-label">🏆 Nhiều trận thắng nhất</div>
             </div>
         """, unsafe_allow_html=True)
     
     with col3:
-        total_balance = financial_df['balance'].sum() if not financial_df.empty else 0
         st.markdown(f"""
             <div class="stat-card">
-                <div class="stat-number">{total_balance:,}</div>
+                <div class="stat-number">{snapshot.total_balance:,}</div>
                 <div class="stat-label">💰 Tổng quỹ (VNĐ)</div>
             </div>
         """, unsafe_allow_html=True)
@@ -953,13 +3544,10 @@ def show_home_page():
     with col1:
         st.markdown('<div class="simple-chart">', unsafe_allow_html=True)
         st.subheader("🏆 Top 5 thành viên xuất sắc")
-        if not rankings_df.empty:
-            # Tạo DataFrame cho bar chart
-            top_5 = rankings_df.head(5)
-            chart_data = pd.DataFrame({
-                'Thành viên': top_5['full_name'],
-                'Trận thắng': top_5['total_wins']
-            }).set_index('Thành viên')
+        if snapshot.top_winners:
+            chart_data = pd.DataFrame(
+                snapshot.top_winners, columns=['Thành viên', 'Trận thắng']
+            ).set_index('Thành viên')
             
             st.bar_chart(chart_data, height=300)
         else:
@@ -969,21 +3557,30 @@ def show_home_page():
     with col2:
         st.markdown('<div class="simple-chart">', unsafe_allow_html=True)
         st.subheader("💰 Top 5 thành viên đóng góp nhiều")
-        if not financial_df.empty and financial_df['total_contribution'].sum() > 0:
-            contrib_data = financial_df[financial_df['total_contribution'] > 0].head(5)
-            if not contrib_data.empty:
-                chart_data = pd.DataFrame({
-                    'Thành viên': contrib_data['full_name'],
-                    'Đóng góp (VNĐ)': contrib_data['total_contribution']
-                }).set_index('Thành viên')
-                
-                st.bar_chart(chart_data, height=300)
-            else:
-                st.info("Chưa có đóng góp nào")
+        if snapshot.top_contributors:
+            chart_data = pd.DataFrame(
+                snapshot.top_contributors, columns=['Thành viên', 'Đóng góp (VNĐ)']
+            ).set_index('Thành viên')
+            
+            st.bar_chart(chart_data, height=300)
+        elif snapshot.member_count:
+            st.info("Chưa có đóng góp nào")
         else:
             st.info("Chưa có dữ liệu tài chính")
         st.markdown('</div>', unsafe_allow_html=True)
 
+    # Xu hướng 12 tháng gần nhất, đọc từ bảng thống kê tháng
+    club_trend = get_club_monthly_trend(12)
+    if not club_trend.empty:
+        st.subheader("📈 Hoạt động 12 tháng gần nhất")
+        club_chart = club_trend.set_index('month')
+        col1, col2 = st.columns(2)
+        with col1:
+            st.bar_chart(club_chart[['sessions_held']].rename(columns={'sessions_held': 'Số buổi tập'}), height=250)
+        with col2:
+            st.line_chart(club_chart[['contributions', 'spend']].rename(
+                columns={'contributions': 'Đóng góp', 'spend': 'Chi phí'}), height=250)
+
 def show_approval_page():
     if not st.session_state.user['is_admin']:
         st.error("Chỉ admin mới có quyền truy cập trang này!")
@@ -1066,7 +3663,7 @@ def show_member_management_page():
     st.title("✏️ Quản lý thành viên")
     
     # Tabs for different management functions
-    tab1, tab2, tab3 = st.tabs(["➕ Thêm thành viên", "✏️ Sửa thành viên", "🗑️ Xóa thành viên"])
+    tab1, tab2, tab3, tab4 = st.tabs(["➕ Thêm thành viên", "✏️ Sửa thành viên", "🗑️ Xóa thành viên", "📥 Nhập từ file"])
     
     with tab1:
         st.subheader("Thêm thành viên mới")
@@ -1102,74 +3699,68 @@ def show_member_management_page():
     with tab2:
         st.subheader("Chỉnh sửa thông tin thành viên")
         
-        members_df = get_approved_members()
-        if members_df.empty:
-            st.info("Chưa có thành viên nào để chỉnh sửa")
-        else:
-            # Member selection
-            col1, col2 = st.columns([2, 1])
-            with col1:
-                member_options = [f"{row['full_name']} ({row['email']})" for _, row in members_df.iterrows()]
-                selected_idx = st.selectbox("👤 Chọn thành viên cần sửa", range(len(member_options)), format_func=lambda x: member_options[x])
-                selected_member = members_df.iloc[selected_idx]
-            
-            with col2:
-                if st.button("📝 Chọn để sửa", use_container_width=True):
-                    st.session_state.editing_member_id = selected_member['id']
-                    st.rerun()
+        # Member selection
+        col1, col2 = st.columns([2, 1])
+        with col1:
+            selected_member = member_picker("👤 Chọn thành viên cần sửa", key="edit_member_pick")
+        
+        with col2:
+            if st.button("📝 Chọn để sửa", use_container_width=True, disabled=selected_member is None):
+                st.session_state.editing_member_id = selected_member['id']
+                st.rerun()
             
-            # Edit form
-            if st.session_state.editing_member_id:
-                member_data = get_member_by_id(st.session_state.editing_member_id)
-                if member_data:
-                    st.markdown(f"""
-                        <div class="edit-form">
-                            <h4>✏️ Đang sửa: {member_data['full_name']}</h4>
-                        </div>
-                    """, unsafe_allow_html=True)
+        # Edit form
+        if st.session_state.editing_member_id:
+            member_data = get_member_by_id(st.session_state.editing_member_id)
+            if member_data:
+                st.markdown(f"""
+                    <div class="edit-form">
+                        <h4>✏️ Đang sửa: {member_data['full_name']}</h4>
+                    </div>
+                """, unsafe_allow_html=True)
+                
+                with st.form("edit_member_form"):
+                    col1, col2 = st.columns(2)
                     
-                    with st.form("edit_member_form"):
-                        col1, col2 = st.columns(2)
-                        
-                        with col1:
-                            edit_full_name = st.text_input("👤 Họ và tên", value=member_data['full_name'])
-                            edit_email = st.text_input("📧 Email", value=member_data['email'])
-                            edit_phone = st.text_input("📱 Số điện thoại", value=member_data['phone'])
-                        
-                        with col2:
-                            edit_birth_date = st.date_input("📅 Ngày sinh", value=datetime.strptime(member_data['birth_date'], '%Y-%m-%d').date())
-                            edit_password = st.text_input("🔒 Mật khẩu mới (để trống nếu không đổi)", type="password")
-                            confirm_edit_password = st.text_input("🔒 Xác nhận mật khẩu mới", type="password")
-                        
-                        col_submit, col_cancel = st.columns(2)
-                        
-                        with col_submit:
-                            if st.form_submit_button("💾 Cập nhật", use_container_width=True):
-                                if edit_password and edit_password != confirm_edit_password:
-                                    st.error("Mật khẩu xác nhận không khớp!")
+                    with col1:
+                        edit_full_name = st.text_input("👤 Họ và tên", value=member_data['full_name'])
+                        edit_email = st.text_input("📧 Email", value=member_data['email'])
+                        edit_phone = st.text_input("📱 Số điện thoại", value=member_data['phone'])
+                    
+                    with col2:
+                        edit_birth_date = st.date_input("📅 Ngày sinh", value=datetime.strptime(member_data['birth_date'], '%Y-%m-%d').date())
+                        edit_password = st.text_input("🔒 Mật khẩu mới (để trống nếu không đổi)", type="password")
+                        confirm_edit_password = st.text_input("🔒 Xác nhận mật khẩu mới", type="password")
+                    
+                    col_submit, col_cancel = st.columns(2)
+                    
+                    with col_submit:
+                        if st.form_submit_button("💾 Cập nhật", use_container_width=True):
+                            if edit_password and edit_password != confirm_edit_password:
+                                st.error("Mật khẩu xác nhận không khớp!")
+                            else:
+                                success, message = update_member(
+                                    st.session_state.editing_member_id,
+                                    edit_full_name, edit_email, edit_phone, edit_birth_date,
+                                    edit_password if edit_password else None
+                                )
+                                if success:
+                                    st.success(message)
+                                    st.session_state.editing_member_id = None
+                                    st.rerun()
                                 else:
-                                    success, message = update_member(
-                                        st.session_state.editing_member_id,
-                                        edit_full_name, edit_email, edit_phone, edit_birth_date,
-                                        edit_password if edit_password else None
-                                    )
-                                    if success:
-                                        st.success(message)
-                                        st.session_state.editing_member_id = None
-                                        st.rerun()
-                                    else:
-                                        st.error(message)
-                        
-                        with col_cancel:
-                            if st.form_submit_button("❌ Hủy", use_container_width=True):
-                                st.session_state.editing_member_id = None
-                                st.rerun()
+                                    st.error(message)
+                    
+                    with col_cancel:
+                        if st.form_submit_button("❌ Hủy", use_container_width=True):
+                            st.session_state.editing_member_id = None
+                            st.rerun()
     
     with tab3:
         st.subheader("Xóa thành viên")
         st.warning("⚠️ **Cảnh báo**: Xóa thành viên sẽ xóa toàn bộ dữ liệu liên quan (rankings, votes, finances)")
         
-        members_df = get_approved_members()
+        members_df, next_cursor = get_approved_members_page(get_page_cursor('delete_members'))
         if members_df.empty:
             st.info("Chưa có thành viên nào để xóa")
         else:
@@ -1206,25 +3797,77 @@ def show_member_management_page():
                             with col_cancel_delete:
                                 if st.button("❌ Hủy", key=f"cancel_delete_{member['id']}", use_container_width=True):
                                     st.rerun()
+        
+        show_page_controls('delete_members', next_cursor)
+    
+    with tab4:
+        st.subheader("Nhập hàng loạt từ file CSV/XLSX")
+        import_kind = st.radio("Loại dữ liệu", ["👥 Thành viên", "💰 Đóng quỹ"], horizontal=True, key="import_kind")
+        
+        if import_kind == "👥 Thành viên":
+            st.caption("Cột bắt buộc: full_name, email, phone, birth_date (YYYY-MM-DD hoặc DD/MM/YYYY); "
+                       "cột password không bắt buộc. Thành viên được phê duyệt ngay.")
+        else:
+            st.caption("Cột bắt buộc: email, amount; cột date và description không bắt buộc. "
+                       "Thành viên được tra theo email.")
+        
+        with st.form("import_form"):
+            uploaded_file = st.file_uploader("📄 Chọn file", type=["csv", "xlsx"])
+            default_password = None
+            if import_kind == "👥 Thành viên":
+                default_password = st.text_input("🔒 Mật khẩu mặc định (cho dòng không có cột password)",
+                                                 type="password")
+            
+            if st.form_submit_button("📥 Nhập dữ liệu", use_container_width=True):
+                if uploaded_file is None:
+                    st.error("Vui lòng chọn file!")
+                else:
+                    st.session_state.import_errors_csv = None
+                    if import_kind == "👥 Thành viên":
+                        success, message, errors_df = import_members(uploaded_file, default_password,
+                                                                     st.session_state.user['name'])
+                    else:
+                        success, message, errors_df = import_contributions(uploaded_file)
+                    
+                    if success and errors_df.empty:
+                        st.success(message)
+                    elif success:
+                        st.warning(message)
+                    else:
+                        st.error(message)
+                    
+                    if not errors_df.empty:
+                        errors_df.columns = ['Dòng', 'Lỗi']
+                        st.dataframe(errors_df, use_container_width=True, hide_index=True)
+                        st.session_state.import_errors_csv = errors_df.to_csv(index=False).encode('utf-8-sig')
+        
+        if st.session_state.get('import_errors_csv'):
+            st.download_button("💾 Tải báo cáo lỗi", st.session_state.import_errors_csv,
+                               file_name="import_errors.csv", mime="text/csv")
 
 def show_members_page():
     st.title("👥 Danh sách thành viên")
     
-    members_df = get_approved_members()
+    member_count = get_dashboard_snapshot().member_count
     
-    if members_df.empty:
+    if not member_count:
         st.info("Chưa có thành viên nào được phê duyệt")
     else:
-        st.subheader(f"📊 Tổng số: {len(members_df)} thành viên")
+        st.subheader(f"📊 Tổng số: {member_count} thành viên")
         
-        search_term = st.text_input("🔍 Tìm kiếm thành viên", placeholder="Nhập tên để tìm kiếm...")
+        search_term = st.text_input("🔍 Tìm kiếm thành viên", placeholder="Nhập tên, email hoặc số điện thoại...")
         
         if search_term:
-            members_df = members_df[members_df['full_name'].str.contains(search_term, case=False, na=False)]
+            members_df, next_cursor, offset = search_members(search_term), None, 0
+        else:
+            members_df, next_cursor = get_approved_members_page(get_page_cursor('members'))
+            offset = (len(st.session_state.get('members_cursors', [None])) - 1) * PAGE_SIZE
         
-        if not members_df.empty:
+        if members_df.empty:
+            st.info("Không tìm thấy thành viên phù hợp")
+        else:
             display_df = members_df.copy()
-            display_df.index = range(1, len(display_df) + 1)
+            display_df.index = range(offset + 1, offset + len(display_df) + 1)
             
             st.dataframe(
                 display_df.rename(columns={
@@ -1235,57 +3878,145 @@ def show_members_page():
                 use_container_width=True
             )
 
+        if not search_term:
+            show_page_controls('members', next_cursor)
+
 def show_ranking_page():
     st.title("🏆 Xếp hạng thành viên")
     
-    rankings_df = get_rankings()
+    leaderboard = get_leaderboard()
     
     if st.session_state.user['is_admin']:
         with st.expander("➕ Thêm kết quả trận đấu"):
-            with st.form("add_ranking_form"):
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    members = get_approved_members()['full_name'].tolist() if not get_approved_members().empty else []
-                    if members:
-                        selected_member = st.selectbox("👤 Chọn thành viên", members)
-                        wins = st.number_input("🏆 Số trận thắng", min_value=1, max_value=10, value=1)
-                        match_date = st.date_input("📅 Ngày thi đấu", value=datetime.now().date())
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                st.markdown("**🔵 Đội 1**")
+                team_one = [member_picker("👤 Người chơi 1", key="team_one_1"),
+                            member_picker("👤 Người chơi 2", key="team_one_2", all_label="— Không có")]
+            
+            with col2:
+                st.markdown("**🔴 Đội 2**")
+                team_two = [member_picker("👤 Người chơi 1", key="team_two_1"),
+                            member_picker("👤 Người chơi 2", key="team_two_2", all_label="— Không có")]
+            
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                winner = st.radio("🏆 Đội thắng", ["Đội 1", "Đội 2"], horizontal=True, key="match_winner")
+                match_date = st.date_input("📅 Ngày thi đấu", value=datetime.now().date(), key="match_date")
+            
+            with col2:
+                location = st.text_input("📍 Địa điểm", placeholder="VD: Sân ABC", key="match_location")
+                score = st.text_input("📊 Tỷ số", placeholder="VD: 11-8, 11-6", key="match_score")
+            
+            if st.button("💾 Lưu kết quả", key="save_match", use_container_width=True):
+                if location and score:
+                    success, message = record_match(
+                        match_date,
+                        [player['id'] for player in team_one if player],
+                        [player['id'] for player in team_two if player],
+                        1 if winner == "Đội 1" else 2, location, score)
+                    if success:
+                        st.success(message)
+                        st.rerun()
                     else:
-                        st.warning("Chưa có thành viên nào được phê duyệt")
-                        selected_member = None
+                        st.error(message)
+                else:
+                    st.error("Vui lòng nhập địa điểm và tỷ số!")
+        
+        with st.expander("🛠️ Sửa kết quả trận"):
+            matches_df = get_recent_matches()
+            if matches_df.empty:
+                st.info("Chưa có trận đấu nào")
+            else:
+                match_options = {
+                    f"{row['match_date']} - {row['team_one']} vs {row['team_two']} "
+                    f"(Đội {row['winning_team']} thắng, {row['score']})": row for _, row in matches_df.iterrows()
+                }
+                match_label = st.selectbox("🎾 Chọn trận", list(match_options), key="edit_match")
+                match = match_options[match_label]
                 
+                col1, col2 = st.columns(2)
+                with col1:
+                    if st.button("🔁 Đổi đội thắng", key="swap_winner", use_container_width=True):
+                        success, message = update_match_result(int(match['id']), 3 - int(match['winning_team']))
+                        if success:
+                            st.success(message)
+                            st.rerun()
+                        else:
+                            st.error(message)
                 with col2:
-                    location = st.text_input("📍 Địa điểm", placeholder="VD: Sân ABC")
-                    score = st.text_input("📊 Tỷ số", placeholder="VD: 11-8, 11-6")
-                
-                if st.form_submit_button("💾 Lưu kết quả", use_container_width=True):
-                    if selected_member and location and score:
-                        if add_ranking(selected_member, wins, match_date, location, score):
-                            st.success(f"Đã thêm {wins} trận thắng cho {selected_member}")
+                    if st.button("🗑️ Xóa trận", key="delete_match", use_container_width=True):
+                        success, message = update_match_result(int(match['id']))
+                        if success:
+                            st.success(message)
                             st.rerun()
+                        else:
+                            st.error(message)
+            
+            if st.button("♻️ Tính lại toàn bộ điểm", key="recompute_ratings"):
+                success, message = recompute_ratings()
+                if success:
+                    st.success(message)
+                else:
+                    st.error(message)
+    
+    if not st.session_state.user['is_admin']:
+        position = leaderboard.position(st.session_state.user['id'])
+        if position:
+            player = position['player']
+            st.markdown(f"""
+                <div class="ranking-card">
+                    <h3>📍 Vị trí của bạn: #{position['rank']} / {position['total']}</h3>
+                    <h2>⭐ {player['rating']:.0f} điểm</h2>
+                    <p>🏆 Thắng {player['wins']}/{player['matches_played']} trận</p>
+                </div>
+            """, unsafe_allow_html=True)
+            neighbours = pd.DataFrame(position['neighbours'])
+            neighbours['full_name'] = [f"👉 {row['full_name']}" if row['user_id'] == player['user_id'] else row['full_name']
+                                       for _, row in neighbours.iterrows()]
+            neighbours['rating'] = neighbours['rating'].round().astype(int)
+            st.dataframe(
+                neighbours[['rank', 'full_name', 'rating', 'wins', 'matches_played']].rename(columns={
+                    'rank': 'Hạng', 'full_name': 'Thành viên', 'rating': 'Điểm',
+                    'wins': 'Thắng', 'matches_played': 'Số trận'}),
+                use_container_width=True, hide_index=True)
     
-    if rankings_df.empty:
+    top_players = leaderboard.top(LEADERBOARD_TOP_K)
+    if top_players.empty:
         st.info("Chưa có dữ liệu xếp hạng")
     else:
-        st.subheader("📈 Bảng xếp hạng")
+        st.subheader(f"📈 Top {LEADERBOARD_TOP_K}")
+        st.caption(f"Điểm Elo theo kết quả từng trận, khởi đầu {ELO_INITIAL_RATING} điểm")
         
         # Hiển thị ranking cards
-        for idx, (_, player) in enumerate(rankings_df.iterrows(), 1):
+        for _, player in top_players.iterrows():
+            idx = player['rank']
             medal = "🥇" if idx == 1 else "🥈" if idx == 2 else "🥉" if idx == 3 else "🏅"
             
             st.markdown(f"""
                 <div class="ranking-card">
                     <h3>{medal} #{idx} - {player['full_name']}</h3>
-                    <h2>🏆 {player['total_wins']} trận thắng</h2>
+                    <h2>⭐ {player['rating']:.0f} điểm</h2>
+                    <p>🏆 Thắng {player['wins']}/{player['matches_played']} trận</p>
                 </div>
             """, unsafe_allow_html=True)
         
         # BIỂU ĐỒ STREAMLIT NATIVE
-        if len(rankings_df) > 1:
+        if len(top_players) > 1:
             st.subheader("📊 Biểu đồ xếp hạng")
-            chart_data = rankings_df.head(10).set_index('full_name')
-            st.bar_chart(chart_data['total_wins'], height=400)
+            chart_data = top_players.set_index('full_name')
+            st.bar_chart(chart_data['rating'].round(), height=400)
+
+        with st.expander(f"📋 Toàn bộ bảng xếp hạng ({len(leaderboard)} thành viên)"):
+            all_players = leaderboard.top(len(leaderboard))
+            all_players['rating'] = all_players['rating'].round().astype(int)
+            st.dataframe(
+                all_players[['rank', 'full_name', 'rating', 'wins', 'matches_played']].rename(columns={
+                    'rank': 'Hạng', 'full_name': 'Thành viên', 'rating': 'Điểm',
+                    'wins': 'Thắng', 'matches_played': 'Số trận'}),
+                use_container_width=True, hide_index=True)
 
 def show_voting_page():
     st.title("🗳️ Bình chọn tham gia")
@@ -1307,7 +4038,7 @@ def show_voting_page():
                             st.success("Đã tạo phiên bình chọn mới!")
                             st.rerun()
     
-    vote_sessions = get_vote_sessions()
+    vote_sessions, next_cursor = get_vote_sessions(get_page_cursor('vote_sessions'))
     
     if vote_sessions.empty:
         st.info("Chưa có phiên bình chọn nào")
@@ -1330,18 +4061,18 @@ def show_voting_page():
                 with col2:
                     if not st.session_state.user['is_admin']:
                         if st.button("🗳️ Vote", key=f"vote_{session['id']}", use_container_width=True):
-                            success = vote_for_session(st.session_state.user['id'], session['session_date'])
+                            success, message = vote_for_session(st.session_state.user['id'], int(session['id']))
                             if success:
-                                st.success("Đã vote thành công!")
+                                st.success(message)
                                 st.rerun()
                             else:
-                                st.warning("Bạn đã vote cho phiên này!")
+                                st.warning(message)
                     else:
                         st.info("Admin không thể vote")
                 
                 with col3:
                     if st.button("👁️ Chi tiết", key=f"detail_{session['id']}", use_container_width=True):
-                        vote_details = get_vote_details(session['session_date'])
+                        vote_details = get_vote_details(int(session['id']))
                         
                         with st.expander(f"Chi tiết phiên {session['session_date']}", expanded=True):
                             if not vote_details.empty:
@@ -1354,6 +4085,8 @@ def show_voting_page():
                                     """, unsafe_allow_html=True)
                             else:
                                 st.info("Chưa có thành viên nào vote cho phiên này")
+    
+    show_page_controls('vote_sessions', next_cursor)
 
 def show_finance_page():
     st.title("💰 Quản lý tài chính")
@@ -1363,19 +4096,15 @@ def show_finance_page():
         
         with col1:
             with st.expander("➕ Thêm đóng góp"):
-                with st.form("add_contribution_form"):
-                    members_df = get_approved_members()
-                    members = members_df['full_name'].tolist() if not members_df.empty else []
-                    if members:
-                        member_name = st.selectbox("👤 Thành viên", members)
+                member = member_picker("👤 Thành viên", key="contribution_member")
+                if member:
+                    with st.form("add_contribution_form"):
                         amount = st.number_input("💵 Số tiền (VNĐ)", min_value=10000, step=10000)
                         
                         if st.form_submit_button("💾 Lưu", use_container_width=True):
-                            if add_contribution(member_name, amount):
-                                st.success(f"Đã thêm {amount:,} VNĐ cho {member_name}")
+                            if add_contribution(member['id'], amount):
+                                st.success(f"Đã thêm {amount:,} VNĐ cho {member['full_name']}")
                                 st.rerun()
-                    else:
-                        st.warning("Chưa có thành viên nào được phê duyệt")
         
         with col2:
             with st.expander("➕ Thêm chi phí buổi tập"):
@@ -1405,7 +4134,7 @@ def show_finance_page():
                         
                         if st.form_submit_button("💾 Lưu chi phí", use_container_width=True):
                             if total > 0:
-                                success, message = add_expense(selected_session['session_date'], court_fee, water_fee, other_fee, description)
+                                success, message = add_expense(int(selected_session['id']), court_fee, water_fee, other_fee, description)
                                 if success:
                                     st.success(message)
                                     st.rerun()
@@ -1413,10 +4142,111 @@ def show_finance_page():
                                     st.error(message)
                 else:
                     st.warning("Chưa có buổi tập nào có vote")
+        
+        with st.expander("🧮 Kiểm tra số dư"):
+            st.caption("So sánh bảng số dư với sổ cái, hoặc tính lại toàn bộ số dư từ sổ cái")
+            col_check, col_rebuild = st.columns(2)
+            
+            with col_check:
+                if st.button("🔍 Kiểm tra", key="check_balances", use_container_width=True):
+                    try:
+                        mismatches = check_member_balances()
+                        if mismatches.empty:
+                            st.success("✅ Số dư khớp với sổ cái")
+                        else:
+                            st.error(f"Có {len(mismatches)} thành viên bị lệch số dư!")
+                            st.dataframe(mismatches, use_container_width=True)
+                    except Exception as e:
+                        st.error(f"Lỗi kiểm tra số dư: {str(e)}")
+            
+            with col_rebuild:
+                if st.button("🔄 Tính lại từ sổ cái", key="rebuild_balances", use_container_width=True):
+                    success, message = rebuild_member_balances()
+                    if success:
+                        st.success(message)
+                    else:
+                        st.error(message)
+        
+        with st.expander("📅 Số dư tại một ngày"):
+            st.caption("Tính từ checkpoint đầu tháng gần nhất cộng các giao dịch sau đó, không cần cộng lại toàn bộ sổ cái")
+            col_date, col_member = st.columns(2)
+            with col_date:
+                as_of_date = st.date_input("📅 Tính đến hết ngày", value=datetime.now().date(), key="as_of_date")
+            with col_member:
+                as_of_member = member_picker("👤 Thành viên", key="as_of_member", all_label="Tất cả thành viên")
+            
+            col_show, col_verify = st.columns(2)
+            with col_show:
+                if st.button("📊 Xem số dư", key="show_as_of", use_container_width=True):
+                    try:
+                        balances = get_balances_as_of(as_of_date, None if as_of_member is None else as_of_member['id'])
+                        if balances.empty:
+                            st.info("Chưa có giao dịch nào đến ngày này")
+                        else:
+                            st.dataframe(balances.drop(columns='user_id'), use_container_width=True, hide_index=True)
+                    except Exception as e:
+                        st.error(f"Lỗi tính số dư: {str(e)}")
+            with col_verify:
+                if st.button("🔍 Kiểm tra checkpoint mới nhất", key="verify_checkpoint", use_container_width=True):
+                    try:
+                        ensure_balance_checkpoints()
+                        checkpoint_dates = get_checkpoint_dates()
+                        if not checkpoint_dates:
+                            st.info("Chưa có checkpoint nào")
+                        else:
+                            mismatches = verify_balance_checkpoint(checkpoint_dates[-1])
+                            if mismatches.empty:
+                                st.success(f"✅ Checkpoint {checkpoint_dates[-1]} khớp với sổ cái")
+                            else:
+                                st.error(f"Checkpoint {checkpoint_dates[-1]} lệch {len(mismatches)} thành viên!")
+                                st.dataframe(mismatches, use_container_width=True)
+                    except Exception as e:
+                        st.error(f"Lỗi kiểm tra checkpoint: {str(e)}")
+        
+        with st.expander("📤 Xuất sổ cái"):
+            st.caption("Bấm tạo file rồi tải về; sổ cái được đọc theo từng khối nên không giữ toàn bộ dữ liệu trong bộ nhớ")
+            today = datetime.now().date()
+            col_from, col_to = st.columns(2)
+            with col_from:
+                start_date = st.date_input("📅 Từ ngày", value=today.replace(day=1), key="export_start")
+            with col_to:
+                end_date = st.date_input("📅 Đến ngày", value=today, key="export_end")
+            
+            export_member = member_picker("👤 Thành viên", key="export_member", all_label="Tất cả thành viên")
+            
+            formats = ['csv', 'parquet'] if parquet_available() else ['csv']
+            file_format = st.radio("📄 Định dạng", formats, format_func=str.upper, horizontal=True,
+                                   key="export_format")
+            if len(formats) == 1:
+                st.caption("Cài pyarrow để xuất thêm định dạng Parquet")
+            include_archive = False
+            if os.path.exists(ARCHIVE_DB_FILE):
+                include_archive = st.checkbox("🗄️ Gồm cả dữ liệu đã lưu trữ", key="export_include_archive")
+            
+            if start_date > end_date:
+                st.warning("Ngày bắt đầu phải trước ngày kết thúc")
+            elif st.button("📦 Tạo file", key="build_export", use_container_width=True):
+                try:
+                    path = export_ledger(file_format, start_date, end_date,
+                                         None if export_member is None else export_member['id'], include_archive)
+                    # Đưa file handle cho nút tải thay vì đọc cả file vào biến; file tạm xóa ngay sau khi gắn vào nút
+                    try:
+                        with open(path, 'rb') as export_file:
+                            st.download_button(
+                                "⬇️ Tải sổ cái",
+                                data=export_file,
+                                file_name=f"so_cai_{start_date}_{end_date}.{file_format}",
+                                mime=LEDGER_EXPORT_FORMATS[file_format],
+                                use_container_width=True,
+                            )
+                    finally:
+                        os.remove(path)
+                except Exception as e:
+                    st.error(f"Lỗi xuất sổ cái: {str(e)}")
     
     # Expense history
     st.subheader("📋 Lịch sử chi phí các buổi tập")
-    expense_history = get_expense_history()
+    expense_history, next_cursor = get_expense_history(get_page_cursor('expense_history'))
     
     if not expense_history.empty:
         for _, expense in expense_history.iterrows():
@@ -1429,7 +4259,8 @@ def show_finance_page():
                             <strong>👤 Chi phí/người:</strong> {expense['cost_per_person']:,} VNĐ
                         </div>
                         <div style="text-align: right;">
-                            <strong>💰 Tổng chi phí:</strong> {expense['total_cost']:,} VNĐ
+                            <strong>💰 Tổng chi phí:</strong> {expense['total_cost']:,} VNĐ<br>
+                            🏟️ Sân {expense['court_fee']:,} · 💧 Nước {expense['water_fee']:,} · 📦 Khác {expense['other_fee']:,}
                         </div>
                     </div>
                 </div>
@@ -1437,6 +4268,8 @@ def show_finance_page():
     else:
         st.info("Chưa có chi phí nào được ghi nhận")
     
+    show_page_controls('expense_history', next_cursor)
+    
     # Financial summary
     financial_df = get_financial_summary()
     
@@ -1500,21 +4333,119 @@ def show_finance_page():
             else:
                 st.info("Chưa có đóng góp nào")
 
+    # Xu hướng theo tháng (chỉ đọc bảng thống kê tháng)
+    st.subheader("📈 Xu hướng theo tháng")
+    club_trend = get_club_monthly_trend()
+    if club_trend.empty:
+        st.info("Chưa có dữ liệu theo tháng")
+    else:
+        club_chart = club_trend.set_index('month')
+        col1, col2 = st.columns(2)
+        with col1:
+            st.caption("💰 Đóng góp và chi phí toàn CLB (VNĐ)")
+            st.line_chart(club_chart[['contributions', 'spend']].rename(
+                columns={'contributions': 'Đóng góp', 'spend': 'Chi phí'}), height=300)
+        with col2:
+            st.caption("👥 Lượt tham gia và chi phí trung bình mỗi buổi")
+            st.bar_chart(club_chart['attendances'].rename('Lượt tham gia'), height=140)
+            st.line_chart(club_chart['avg_cost'].rename('Chi phí TB/buổi (VNĐ)'), height=140)
+    
+    if st.session_state.user['is_admin']:
+        trend_member = member_picker("👤 Xu hướng của thành viên", key="trend_member")
+        trend_user_id = None if trend_member is None else trend_member['id']
+    else:
+        trend_user_id = st.session_state.user['id']
+    
+    if trend_user_id is not None:
+        member_trend = get_member_monthly_trend(trend_user_id)
+        if member_trend.empty:
+            st.info("Thành viên chưa có giao dịch nào trong thời gian này")
+        else:
+            member_chart = member_trend.set_index('month')
+            col1, col2 = st.columns(2)
+            with col1:
+                st.caption("💰 Đóng góp và chi phí theo tháng (VNĐ)")
+                st.line_chart(member_chart[['contributions', 'spend']].rename(
+                    columns={'contributions': 'Đóng góp', 'spend': 'Chi phí'}), height=300)
+            with col2:
+                st.caption("🏸 Số buổi tham gia theo tháng")
+                st.bar_chart(member_chart['sessions_attended'].rename('Số buổi'), height=300)
+    
+    if st.session_state.user['is_admin']:
+        if st.button("🔄 Tính lại thống kê tháng", key="rebuild_rollups"):
+            success, message = rebuild_rollups()
+            if success:
+                st.success(message)
+            else:
+                st.error(message)
+
 def show_alerts_page():
     st.title("⚠️ Cảnh báo hệ thống")
     
+    sweep_alerts()
+    settings = get_alert_settings()
     alerts = get_alerts()
     
-    if not alerts:
+    if settings['alerts_swept_at']:
+        st.caption(f"🕒 Quét toàn bộ lần cuối lúc {settings['alerts_swept_at']} "
+                   f"(tự quét lại sau mỗi {settings['alert_sweep_minutes']} phút)")
+    
+    if alerts.empty:
         st.success("🎉 Không có cảnh báo nào!")
     else:
         st.subheader(f"🚨 Có {len(alerts)} cảnh báo cần chú ý")
         
-        for alert in alerts:
-            if "số dư thấp" in alert:
-                st.markdown(f'<div class="danger-card">{alert}</div>', unsafe_allow_html=True)
+        for alert in alerts.itertuples(index=False):
+            if alert.alert_type == 'low_balance':
+                st.markdown(f"""
+                    <div class="danger-card">
+                        ⚠️ {alert.full_name} có số dư thấp: {alert.value:,} VNĐ
+                        <br><small>🕒 {alert.generated_at}</small>
+                    </div>
+                """, unsafe_allow_html=True)
             else:
-                st.markdown(f'<div class="alert-card">{alert}</div>', unsafe_allow_html=True)
+                st.markdown(f"""
+                    <div class="alert-card">
+                        📊 {alert.full_name} vote ít trong {settings['low_activity_days']} ngày qua: {alert.value} lần
+                        <br><small>🕒 {alert.generated_at}</small>
+                    </div>
+                """, unsafe_allow_html=True)
+    
+    if st.session_state.user['is_admin']:
+        with st.expander("⚙️ Ngưỡng cảnh báo"):
+            with st.form("alert_settings_form"):
+                col1, col2 = st.columns(2)
+                with col1:
+                    low_balance_threshold = st.number_input(
+                        "💰 Cảnh báo khi số dư dưới (VNĐ)", min_value=0, step=10000,
+                        value=settings['low_balance_threshold'])
+                    low_activity_min_votes = st.number_input(
+                        "🗳️ Cảnh báo khi số lần vote dưới", min_value=1, step=1,
+                        value=settings['low_activity_min_votes'])
+                with col2:
+                    low_activity_days = st.number_input(
+                        "📅 Trong số ngày gần nhất", min_value=1, max_value=365, step=1,
+                        value=settings['low_activity_days'])
+                    alert_sweep_minutes = st.number_input(
+                        "🔄 Quét lại toàn bộ sau (phút)", min_value=1, max_value=1440, step=5,
+                        value=settings['alert_sweep_minutes'])
+                
+                if st.form_submit_button("💾 Lưu và tính lại", use_container_width=True):
+                    success, message = update_alert_settings({
+                        'low_balance_threshold': low_balance_threshold,
+                        'low_activity_min_votes': low_activity_min_votes,
+                        'low_activity_days': low_activity_days,
+                        'alert_sweep_minutes': alert_sweep_minutes,
+                    })
+                    if success:
+                        st.success(message)
+                        st.rerun()
+                    else:
+                        st.error(message)
+            
+            if st.button("🔄 Quét lại ngay", key="sweep_alerts_now"):
+                if sweep_alerts(force=True):
+                    st.rerun()
     
     # System statistics
     st.subheader("📊 Thống kê hệ thống")
@@ -1549,5 +4480,246 @@ def show_alerts_page():
     except Exception as e:
         st.error(f"Lỗi thống kê: {str(e)}")
 
+# Profile CPU theo trang (cProfile, bật từ trang Hiệu năng)
+PROFILE_MAX_RUNS = 20
+PROFILE_TOP_FUNCTIONS = 30
+PROFILE_KEEP_RESULTS = 5
+# Các thư viện Streamlit dùng để dựng biểu đồ/gửi dữ liệu về trình duyệt
+PROFILE_RENDER_PACKAGES = ('/streamlit/', '/altair/', '/jsonschema/', '/narwhals/', '/google/protobuf/')
+
+def start_profiling(page, runs):
+    """Profile `runs` lần chạy tiếp theo của `page` trong session hiện tại"""
+    st.session_state.profiling = {'page': page, 'runs': runs, 'remaining': runs, 'profiler': cProfile.Profile()}
+
+def profile_category(filename, name):
+    """Nhóm thời gian tự thân của một hàm: SQLite, pandas/numpy, Streamlit (render), code của app"""
+    path = filename.replace('\\', '/')
+    if 'sqlite3' in path or 'sqlite3.' in name:
+        return 'SQLite'
+    if '/pandas/' in path or '/numpy/' in path or 'numpy' in name or 'pandas' in name:
+        return 'pandas/numpy'
+    if any(package in path for package in PROFILE_RENDER_PACKAGES):
+        return 'Streamlit (render)'
+    if filename == profile_category.__code__.co_filename:
+        return 'Code của app'
+    return 'Khác'
+
+def summarize_profile(page, runs, profiler):
+    """Bảng hàm tốn thời gian nhất, phân bổ theo nhóm và dữ liệu pstats để tải về"""
+    stats = pstats.Stats(profiler)
+    report = io.StringIO()
+    stats.stream = report
+    stats.sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS * 2)
+    
+    rows = []
+    breakdown = {}
+    for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        label = name if filename == '~' else f"{os.path.basename(filename)}:{line}({name})"
+        rows.append({'function': label, 'calls': calls,
+                     'tottime_ms': round(tottime * 1000, 2), 'cumtime_ms': round(cumtime * 1000, 2)})
+        category = profile_category(filename, name)
+        breakdown[category] = breakdown.get(category, 0) + tottime * 1000
+    
+    rows.sort(key=lambda row: row['cumtime_ms'], reverse=True)
+    return {
+        'page': page,
+        'runs': runs,
+        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'total_ms': sum(breakdown.values()),
+        'top': rows[:PROFILE_TOP_FUNCTIONS],
+        'breakdown': breakdown,
+        # Cùng định dạng với Profile.dump_stats, mở bằng `python -m pstats` hoặc snakeviz
+        'pstats': marshal.dumps(stats.stats),
+        'report': report.getvalue(),
+    }
+
+def run_profiled(profiling, render):
+    """Chạy trang dưới cProfile; đủ số lần chạy thì lưu kết quả vào session"""
+    st.info(f"🧪 Đang profile trang này: còn {profiling['remaining']}/{profiling['runs']} lần chạy")
+    profiler = profiling['profiler']
+    profiler.enable()
+    try:
+        render()
+    finally:
+        # st.rerun() trong trang cũng đi qua đây, lần chạy đó vẫn được tính
+        profiler.disable()
+        profiling['remaining'] -= 1
+        if profiling['remaining'] <= 0:
+            st.session_state.pop('profiling', None)
+            results = st.session_state.setdefault('profile_results', [])
+            results.insert(0, summarize_profile(profiling['page'], profiling['runs'], profiler))
+            del results[PROFILE_KEEP_RESULTS:]
+
+def show_performance_page():
+    if not st.session_state.user['is_admin']:
+        st.error("Chỉ admin mới có quyền truy cập trang này!")
+        return
+    
+    st.title("📈 Hiệu năng truy vấn")
+    
+    stats = get_query_stats()
+    rows = stats.top()
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("🔢 Số lần chạy SQL", sum(row['calls'] for row in rows))
+    with col2:
+        st.metric("⏱️ Tổng thời gian", f"{sum(row['total_ms'] for row in rows):,.0f} ms")
+    with col3:
+        st.metric("🐢 Slow query gần đây", len(stats.recent_slow))
+    
+    st.subheader("🔥 Truy vấn tốn thời gian nhất")
+    if rows:
+        sort_options = {"Tổng thời gian": 'total_ms', "p95": 'p95_ms', "Số lần gọi": 'calls'}
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            sort_label = st.radio("Sắp xếp theo", list(sort_options), horizontal=True, key="perf_sort")
+        with col2:
+            limit = st.number_input("Số dòng", min_value=5, max_value=200, value=20, step=5, key="perf_limit")
+        
+        df = pd.DataFrame(rows).sort_values(sort_options[sort_label], ascending=False).head(int(limit))
+        df.columns = ['Hàm gọi', 'SQL', 'Số lần gọi', 'Tổng (ms)', 'TB (ms)', 'p95 (ms)', 'Max (ms)', 'Số dòng']
+        st.dataframe(df, use_container_width=True, hide_index=True)
+    else:
+        st.info("Chưa có truy vấn nào được ghi nhận")
+    
+    st.subheader("🐢 Slow query")
+    st.caption(f"Ngưỡng {stats.slow_ms:g} ms (PICKLEBALL_SLOW_QUERY_MS), log xoay vòng tại {SLOW_QUERY_LOG_FILE}")
+    if stats.recent_slow:
+        slow_df = pd.DataFrame(list(stats.recent_slow)[::-1])
+        slow_df.columns = ['Thời điểm', 'Hàm gọi', 'ms', 'Số dòng', 'SQL']
+        st.dataframe(slow_df, use_container_width=True, hide_index=True)
+    else:
+        st.success("🎉 Chưa có truy vấn nào vượt ngưỡng")
+    
+    with st.expander("📝 Ghi dữ liệu (group commit, thử lại khi bận)"):
+        queue_stats = get_write_queue().stats()
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("📦 Số lô đã commit", queue_stats['batches'])
+        with col2:
+            st.metric("✍️ Số yêu cầu ghi", queue_stats['items'])
+        with col3:
+            average_batch = queue_stats['items'] / queue_stats['batches'] if queue_stats['batches'] else 0
+            st.metric("📊 TB yêu cầu/lô", f"{average_batch:.1f} (lớn nhất {queue_stats['largest_batch']})")
+        with col4:
+            st.metric("⏳ Đang chờ", queue_stats['pending'])
+        
+        retry_stats = get_write_retry_stats().stats()
+        if retry_stats:
+            st.caption("Transaction ghi theo hàm (thử lại khi database bận)")
+            retry_df = pd.DataFrame([{'function': name, **entry} for name, entry in retry_stats.items()])
+            retry_df = retry_df.sort_values('retries', ascending=False)
+            retry_df.columns = ['Hàm ghi', 'Số transaction', 'Số lần thử lại', 'Bỏ cuộc']
+            st.dataframe(retry_df, use_container_width=True, hide_index=True)
+    
+    if st.button("🔄 Xóa thống kê", key="reset_query_stats"):
+        stats.reset()
+        st.rerun()
+    
+    st.subheader("🧪 Profile CPU theo trang")
+    st.caption("Chạy cProfile trong vài lần tải tiếp theo của một trang để xem thời gian nằm ở SQLite, pandas hay phần hiển thị")
+    
+    profiling = st.session_state.get('profiling')
+    if profiling:
+        st.info(f"Đang chờ profile {profiling['page']}: còn {profiling['remaining']}/{profiling['runs']} lần chạy")
+        if st.button("⏹️ Hủy profile", key="cancel_profile"):
+            st.session_state.pop('profiling', None)
+            st.rerun()
+    else:
+        with st.form("profile_form"):
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                profile_page = st.selectbox(
+                    "Trang cần profile",
+                    [item for item in get_menu_items(True) if item != "📈 Hiệu năng"]
+                )
+            with col2:
+                profile_runs = st.number_input("Số lần chạy", min_value=1, max_value=PROFILE_MAX_RUNS, value=3)
+            
+            if st.form_submit_button("▶️ Bắt đầu profile", use_container_width=True):
+                start_profiling(profile_page, int(profile_runs))
+                st.success(f"Mở trang {profile_page} để bắt đầu ghi profile")
+    
+    for i, result in enumerate(st.session_state.get('profile_results', [])):
+        with st.expander(f"📄 {result['page']} · {result['runs']} lần chạy · {result['created_at']}", expanded=(i == 0)):
+            st.metric("⏱️ Tổng thời gian CPU", f"{result['total_ms']:,.0f} ms")
+            
+            breakdown_df = pd.DataFrame(sorted(result['breakdown'].items(), key=lambda item: -item[1]),
+                                        columns=['Nhóm', 'Thời gian (ms)'])
+            breakdown_df['Tỷ lệ'] = (breakdown_df['Thời gian (ms)'] / max(result['total_ms'], 1e-9) * 100).map(
+                lambda value: f"{value:.1f}%")
+            breakdown_df['Thời gian (ms)'] = breakdown_df['Thời gian (ms)'].round(1)
+            st.dataframe(breakdown_df, use_container_width=True, hide_index=True)
+            
+            top_df = pd.DataFrame(result['top'])
+            top_df.columns = ['Hàm', 'Số lần gọi', 'Tự thân (ms)', 'Tích lũy (ms)']
+            st.dataframe(top_df, use_container_width=True, hide_index=True)
+            
+            file_stem = f"profile_{result['created_at'].replace(' ', '_').replace(':', '')}"
+            col1, col2 = st.columns(2)
+            with col1:
+                st.download_button("💾 Tải .pstats", result['pstats'], file_name=f"{file_stem}.pstats",
+                                   mime="application/octet-stream", key=f"profile_pstats_{i}")
+            with col2:
+                st.download_button("📝 Tải báo cáo .txt", result['report'], file_name=f"{file_stem}.txt",
+                                   mime="text/plain", key=f"profile_report_{i}")
+    
+    with st.expander("🗄️ Cache truy vấn"):
+        cache_stats = get_query_cache().stats()
+        total_lookups = cache_stats['hits'] + cache_stats['misses']
+        hit_rate = cache_stats['hits'] / total_lookups * 100 if total_lookups else 0
+        
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("✅ Hit", cache_stats['hits'])
+        with col2:
+            st.metric("❌ Miss", cache_stats['misses'])
+        with col3:
+            st.metric("📈 Tỷ lệ hit", f"{hit_rate:.1f}%")
+        with col4:
+            st.metric("📦 Số kết quả đang cache", cache_stats['entries'])
+        
+        if cache_stats['generations']:
+            st.caption("Thế hệ của từng bảng (tăng mỗi lần ghi)")
+            st.dataframe(
+                pd.DataFrame(sorted(cache_stats['generations'].items()), columns=['Bảng', 'Thế hệ']),
+                use_container_width=True
+            )
+    
+    with st.expander("🔧 Kiểm tra query plan"):
+        st.caption("Chạy EXPLAIN QUERY PLAN cho các truy vấn nóng và báo lỗi nếu có bước quét toàn bảng")
+        if st.button("▶️ Kiểm tra", key="check_query_plans"):
+            try:
+                problems = check_query_plans()
+                if problems:
+                    st.error(f"Có {len(problems)} bước quét toàn bảng!")
+                    st.dataframe(pd.DataFrame(problems), use_container_width=True)
+                else:
+                    st.success(f"✅ {len(HOT_QUERIES)} truy vấn nóng đều dùng index")
+            except Exception as e:
+                st.error(f"Lỗi kiểm tra query plan: {str(e)}")
+    
+    with st.expander("🗃️ Lưu trữ dữ liệu cũ"):
+        settings = get_alert_settings()
+        st.caption(f"Chuyển sổ cái, vote và kết quả trận đấu cũ sang {ARCHIVE_DB_FILE}; số dư và số trận thắng "
+                   "được cộng dồn sang bảng carry forward nên các trang vẫn hiển thị đúng mà chỉ quét dữ liệu mới")
+        if settings['archived_through']:
+            st.info(f"📅 Đã lưu trữ dữ liệu trước {settings['archived_through']}")
+        
+        # Mốc lưu trữ phải trước cửa sổ tính cảnh báo ít hoạt động
+        latest_cutoff = datetime.now().date() - timedelta(days=settings['low_activity_days'])
+        with st.form("archive_form"):
+            cutoff = st.date_input("📅 Lưu trữ dữ liệu trước ngày",
+                                   value=min(latest_cutoff, datetime.now().date() - timedelta(days=365)),
+                                   max_value=latest_cutoff)
+            if st.form_submit_button("🗃️ Chuyển sang file lưu trữ", use_container_width=True):
+                with st.spinner("Đang chuyển dữ liệu..."):
+                    success, message = archive_old_data(cutoff)
+                if success:
+                    st.success(message)
+                else:
+                    st.error(message)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
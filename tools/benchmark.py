@@ -0,0 +1,205 @@
+"""Đo thời gian các helper dữ liệu và các trang show_* của streamlit_app, xuất p50/p95 dạng JSON
+
+Benchmark chạy trên một bản sao của database nên dữ liệu gốc không bị thay đổi.
+
+Ví dụ:
+    python tools/generate_data.py bench.db
+    python tools/benchmark.py bench.db --output bench.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from common import APP_FILE, load_app, quiet_streamlit
+
+# Nhãn menu -> tên hàm trang tương ứng trong show_main_app()
+PAGES = {
+    "🏠 Trang chủ": 'show_home_page',
+    "✅ Phê duyệt thành viên": 'show_approval_page',
+    "✏️ Quản lý thành viên": 'show_member_management_page',
+    "👥 Danh sách thành viên": 'show_members_page',
+    "🏆 Xếp hạng": 'show_ranking_page',
+    "🗳️ Bình chọn": 'show_voting_page',
+    "💰 Tài chính": 'show_finance_page',
+    "⚠️ Cảnh báo": 'show_alerts_page',
+    "📈 Hiệu năng": 'show_performance_page',
+}
+
+
+def summarize(samples):
+    """p50/p95/min/max (ms) của một danh sách thời gian tính bằng giây"""
+    values = np.array(samples) * 1000
+    return {
+        'runs': len(samples),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'min_ms': round(float(values.min()), 3),
+        'max_ms': round(float(values.max()), 3),
+    }
+
+
+def time_calls(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def uncached(func):
+    """Bỏ qua cache truy vấn để đo đúng chi phí đọc database"""
+    return getattr(func, '__wrapped__', func)
+
+
+def dataset_info(app):
+    conn = app.get_db_connection()
+    try:
+        tables = ['users', 'vote_sessions', 'votes', 'expense_events', 'finances', 'rankings']
+        return {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in tables}
+    finally:
+        conn.close()
+
+
+def read_benchmarks(app):
+    """Các helper đọc: tên -> hàm không tham số"""
+    return {
+        'get_pending_members': uncached(app.get_pending_members),
+        'get_approved_members_page': lambda: uncached(app.get_approved_members_page)(),
+        'search_members': lambda: uncached(app.search_members)('nguyen van'),
+        'get_rankings': uncached(app.get_rankings),
+        'get_dashboard_snapshot': uncached(app.get_dashboard_snapshot),
+        'get_vote_sessions': lambda: uncached(app.get_vote_sessions)(),
+        'get_vote_sessions_for_expense': uncached(app.get_vote_sessions_for_expense),
+        'get_financial_summary': uncached(app.get_financial_summary),
+        'get_expense_history': lambda: uncached(app.get_expense_history)(),
+        'get_alerts': uncached(app.get_alerts),
+    }
+
+
+def write_benchmarks(app, rng):
+    """Các helper ghi: tên -> hàm không tham số (mỗi lần gọi ghi dữ liệu mới)"""
+    conn = app.get_db_connection()
+    try:
+        members = conn.execute(
+            'SELECT id, full_name FROM users WHERE is_approved = 1 AND is_admin = 0').fetchall()
+        session_ids = [row[0] for row in conn.execute('SELECT id FROM vote_sessions')]
+    finally:
+        conn.close()
+    if len(members) < 4 or not session_ids:
+        return {}
+
+    def vote():
+        app.vote_for_session(rng.choice(members)[0], rng.choice(session_ids))
+
+    def contribution():
+        app.add_contribution(rng.choice(members)[0], 100_000)
+
+    def expense():
+        app.add_expense(rng.choice(session_ids), 200_000, 50_000, 0, 'Benchmark')
+
+    def match():
+        players = [row[0] for row in rng.sample(members, 4)]
+        app.record_match(datetime.now().date(), players[:2], players[2:], rng.choice((1, 2)), 'Benchmark', '11-5')
+
+    return {
+        'vote_for_session': vote,
+        'add_contribution': contribution,
+        'add_expense': expense,
+        'record_match': match,
+    }
+
+
+def page_benchmarks(repeat, admin_id):
+    """Chạy từng trang qua Streamlit AppTest với tài khoản admin"""
+    from streamlit.testing.v1 import AppTest
+
+    results = {}
+    for label, page_name in PAGES.items():
+        samples = []
+        for _ in range(repeat):
+            at = AppTest.from_file(APP_FILE, default_timeout=600)
+            at.session_state['logged_in'] = True
+            at.session_state['user'] = {'id': admin_id, 'name': 'Administrator', 'is_admin': True}
+            at.session_state['current_page'] = label
+            started = time.perf_counter()
+            at.run()
+            samples.append(time.perf_counter() - started)
+            if at.exception:
+                raise RuntimeError(f"{page_name} lỗi: {at.exception[0].value}")
+        results[page_name] = summarize(samples)
+        quiet_streamlit()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark các helper dữ liệu và các trang của app")
+    parser.add_argument('db_file', help="Database nguồn (sẽ được sao chép trước khi đo)")
+    parser.add_argument('--repeat', type=int, default=20, help="Số lần đo mỗi helper")
+    parser.add_argument('--page-repeat', type=int, default=5, help="Số lần chạy mỗi trang qua AppTest")
+    parser.add_argument('--skip-writes', action='store_true')
+    parser.add_argument('--skip-pages', action='store_true')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Ghi JSON ra file thay vì stdout")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db_file):
+        sys.exit(f"Không tìm thấy {args.db_file}")
+
+    work_dir = tempfile.mkdtemp(prefix='pickleball-bench-')
+    try:
+        # Sao chép bằng backup API để lấy cả dữ liệu còn nằm trong file WAL
+        db_copy = os.path.join(work_dir, 'bench.db')
+        source = sqlite3.connect(args.db_file)
+        target = sqlite3.connect(db_copy)
+        source.backup(target)
+        source.close()
+        target.close()
+
+        app = load_app(db_copy)
+        rng = random.Random(args.seed)
+        report = {
+            'meta': {
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'source_db': os.path.abspath(args.db_file),
+                'sqlite_version': sqlite3.sqlite_version,
+                'repeat': args.repeat,
+                'page_repeat': args.page_repeat,
+                'dataset': dataset_info(app),
+            },
+            'helpers': {},
+            'pages': {},
+        }
+
+        for name, func in read_benchmarks(app).items():
+            report['helpers'][name] = time_calls(func, args.repeat)
+        if not args.skip_writes:
+            for name, func in write_benchmarks(app, rng).items():
+                report['helpers'][name] = time_calls(func, args.repeat)
+        if not args.skip_pages:
+            conn = app.get_db_connection()
+            admin_id = conn.execute('SELECT id FROM users WHERE is_admin = 1 ORDER BY id LIMIT 1').fetchone()[0]
+            conn.close()
+            report['pages'] = page_benchmarks(args.page_repeat, admin_id)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Kiểm tra query plan: chạy EXPLAIN QUERY PLAN cho mọi truy vấn nóng trên một database tạm vừa migrate
+
+Thoát với mã 1 nếu có bước quét toàn bảng. Truyền db_file để kiểm tra trên bản sao của database có sẵn
+(planner có thể chọn khác khi đã có dữ liệu và ANALYZE).
+
+Ví dụ:
+    python tools/check_query_plans.py
+    python tools/check_query_plans.py bench.db
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+from common import load_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kiểm tra các truy vấn nóng không quét toàn bảng")
+    parser.add_argument('db_file', nargs='?', help="Database nguồn (sẽ được sao chép); mặc định dùng database trống")
+    args = parser.parse_args()
+
+    if args.db_file and not os.path.exists(args.db_file):
+        sys.exit(f"Không tìm thấy {args.db_file}")
+
+    work_dir = tempfile.mkdtemp(prefix='pickleball-plans-')
+    db_file = os.path.join(work_dir, 'plans.db')
+    try:
+        if args.db_file:
+            source = sqlite3.connect(args.db_file)
+            target = sqlite3.connect(db_file)
+            source.backup(target)
+            source.close()
+            target.close()
+        app = load_app(db_file)
+        problems = app.check_query_plans()
+        report = {'queries': len(app.HOT_QUERIES), 'problems': problems}
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
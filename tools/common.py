@@ -0,0 +1,25 @@
+"""Tiện ích dùng chung cho các script trong tools/"""
+import logging
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILE = os.path.join(REPO_ROOT, 'streamlit_app.py')
+
+
+def quiet_streamlit():
+    """Tắt log cảnh báo của Streamlit khi chạy ngoài `streamlit run`"""
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith('streamlit'):
+            logging.getLogger(name).setLevel(logging.ERROR)
+
+
+def load_app(db_file):
+    """Import streamlit_app trỏ vào db_file (chế độ bare); import sẽ tạo schema và chạy migration"""
+    os.environ['PICKLEBALL_DB_FILE'] = os.path.abspath(db_file)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    import streamlit_app
+    quiet_streamlit()
+    return streamlit_app
@@ -0,0 +1,234 @@
+"""Sinh dữ liệu giả lập (có seed) theo schema của pickleball_club.db để đo hiệu năng
+
+Ví dụ:
+    python tools/generate_data.py bench.db --members 5000 --sessions 2000 --finance-rows 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from common import load_app
+
+HO = ['Nguyễn', 'Trần', 'Lê', 'Phạm', 'Hoàng', 'Huỳnh', 'Phan', 'Vũ', 'Võ', 'Đặng', 'Bùi', 'Đỗ', 'Hồ', 'Ngô', 'Dương']
+DEM = ['Văn', 'Thị', 'Hữu', 'Đức', 'Minh', 'Ngọc', 'Thanh', 'Quốc', 'Gia', 'Bảo', 'Xuân', 'Hoài']
+TEN = ['An', 'Bình', 'Cường', 'Dũng', 'Đạt', 'Giang', 'Hà', 'Hải', 'Hạnh', 'Hùng', 'Khánh', 'Lan', 'Linh',
+       'Long', 'Mai', 'Nam', 'Nga', 'Phong', 'Phúc', 'Quân', 'Sơn', 'Tâm', 'Thảo', 'Trang', 'Tuấn', 'Vy']
+LOCATIONS = ['Sân Cầu Giấy', 'Sân Mỹ Đình', 'Sân Thanh Xuân', 'Sân Long Biên', 'Sân Tây Hồ']
+SESSION_DESCRIPTIONS = ['Giao lưu cuối tuần', 'Tập luyện tối', 'Đánh đôi nam nữ', 'Giải nội bộ', 'Tập kỹ thuật']
+
+CHUNK_SIZE = 50_000
+
+
+def timestamp(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def random_time(rng, start, end):
+    return start + timedelta(seconds=rng.randrange(int((end - start).total_seconds())))
+
+
+def insert_chunked(cursor, sql, rows):
+    """executemany theo từng khối để không giữ toàn bộ dữ liệu trong bộ nhớ"""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            cursor.executemany(sql, chunk)
+            chunk = []
+    if chunk:
+        cursor.executemany(sql, chunk)
+
+
+def generate(app, members, sessions, finance_rows, voters_per_session, matches, days, seed):
+    """Ghi dữ liệu giả lập vào database của app, trả về số dòng đã tạo cho từng bảng"""
+    rng = random.Random(seed)
+    end = datetime.now().replace(microsecond=0)
+    start = end - timedelta(days=days)
+    counts = {}
+
+    conn = app.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        # Thành viên (đã phê duyệt)
+        password = app.hash_password('Member@123')
+        first_id = cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM users").fetchone()[0]
+
+        def member_rows():
+            for i in range(members):
+                created_at = timestamp(random_time(rng, start, end))
+                birth_date = date(1960, 1, 1) + timedelta(days=rng.randrange(365 * 45))
+                yield (f"{rng.choice(HO)} {rng.choice(DEM)} {rng.choice(TEN)}",
+                       f"member{first_id + i}@example.com", f"09{rng.randrange(10 ** 8):08d}",
+                       str(birth_date), password, 1, 0, created_at, created_at, 'Generator')
+
+        insert_chunked(cursor, '''
+            INSERT INTO users (full_name, email, phone, birth_date, password, is_approved, is_admin,
+                               created_at, approved_at, approved_by)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', member_rows())
+        member_ids = [row[0] for row in cursor.execute(
+            'SELECT id FROM users WHERE id >= ? AND is_admin = 0 ORDER BY id', (first_id,))]
+        counts['users'] = len(member_ids)
+
+        # Phiên bình chọn trải đều trong khoảng thời gian
+        step = (end - start) / max(sessions, 1)
+        session_rows = []
+        for i in range(sessions):
+            session_date = (start + step * i).date()
+            created_at = datetime.combine(session_date, datetime.min.time()) - timedelta(days=2)
+            session_rows.append((str(session_date), rng.choice(SESSION_DESCRIPTIONS), timestamp(created_at)))
+        cursor.executemany(
+            'INSERT INTO vote_sessions (session_date, description, created_at) VALUES (?, ?, ?)', session_rows)
+        session_list = cursor.execute(
+            'SELECT id, session_date FROM vote_sessions ORDER BY id DESC LIMIT ?', (sessions,)).fetchall()[::-1]
+        counts['vote_sessions'] = len(session_list)
+
+        # Vote và chi phí chia đều cho người vote của từng phiên
+        vote_rows = []
+        event_rows = []
+        expense_rows = []
+        next_event_id = cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM expense_events").fetchone()[0]
+        for session_id, session_date in session_list:
+            voter_count = max(1, min(len(member_ids), int(rng.gauss(voters_per_session, voters_per_session / 4))))
+            voters = sorted(rng.sample(member_ids, voter_count))
+            session_day = datetime.strptime(session_date, '%Y-%m-%d')
+            for user_id in voters:
+                voted_at = session_day - timedelta(minutes=rng.randrange(2 * 24 * 60))
+                vote_rows.append((user_id, session_id, session_date, timestamp(voted_at)))
+
+            if len(expense_rows) + voter_count > finance_rows:
+                continue
+            court_fee = rng.choice([200_000, 250_000, 300_000, 400_000])
+            water_fee = rng.choice([0, 30_000, 50_000])
+            other_fee = rng.choice([0, 0, 20_000])
+            created_at = timestamp(session_day + timedelta(hours=21))
+            total_fee = court_fee + water_fee + other_fee
+            event_id = next_event_id + len(event_rows)
+            event_rows.append((event_id, session_id, session_date, 'Chi phí buổi tập', court_fee, water_fee, other_fee,
+                               total_fee, voter_count, total_fee // voter_count, created_at))
+            shares = app.split_session_fees(court_fee, water_fee, other_fee, voter_count)
+            for user_id, (amount, court_share, water_share, other_share) in zip(voters, shares):
+                expense_rows.append((user_id, -amount, 'expense', 'Chi phí buổi tập', session_date,
+                                     court_share, water_share, other_share, voter_count, created_at, event_id))
+
+        insert_chunked(cursor, '''
+            INSERT INTO votes (user_id, session_id, session_date, created_at) VALUES (?, ?, ?, ?)
+        ''', vote_rows)
+        counts['votes'] = len(vote_rows)
+
+        cursor.executemany('''
+            INSERT INTO expense_events (id, session_id, session_date, description, court_fee, water_fee, other_fee,
+                                        total_amount, participants, cost_per_person, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', event_rows)
+        counts['expense_events'] = len(event_rows)
+
+        finance_sql = '''
+            INSERT INTO finances (user_id, amount, transaction_type, description, session_date,
+                                  court_fee, water_fee, other_fee, total_participants, created_at, expense_event_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        '''
+        insert_chunked(cursor, finance_sql, expense_rows)
+
+        # Phần còn lại của finance_rows là các lần đóng quỹ
+        contribution_count = finance_rows - len(expense_rows)
+
+        def contribution_rows():
+            for _ in range(contribution_count):
+                yield (rng.choice(member_ids), rng.choice([100_000, 200_000, 300_000, 500_000]), 'contribution',
+                       'Đóng quỹ', None, 0, 0, 0, 0, timestamp(random_time(rng, start, end)), None)
+
+        insert_chunked(cursor, finance_sql, contribution_rows())
+        counts['finances'] = len(expense_rows) + contribution_count
+
+        # Trận đấu (đánh đôi hoặc đánh đơn): đội thắng theo trình độ ẩn của từng người để bảng Elo có phân hóa
+        skill = {user_id: rng.gauss(app.ELO_INITIAL_RATING, 200) for user_id in member_ids}
+        next_match_id = cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM matches").fetchone()[0]
+        match_rows = []
+        participant_rows = []
+        winner_rows = []
+        for match_id in range(next_match_id, next_match_id + matches):
+            match_time = random_time(rng, start, end)
+            match_date = str(match_time.date())
+            team_size = 2 if len(member_ids) >= 4 and rng.random() < 0.8 else 1
+            players = rng.sample(member_ids, 2 * team_size)
+            teams = [players[:team_size], players[team_size:]]
+            means = [sum(skill[user_id] for user_id in team) / team_size for team in teams]
+            winning_team = 1 if rng.random() < app.elo_expected(means[0], means[1]) else 2
+            location = rng.choice(LOCATIONS)
+            score = f"11-{rng.randrange(10)}"
+            match_rows.append((match_id, match_date, location, score, winning_team, timestamp(match_time)))
+            for team, team_players in enumerate(teams, 1):
+                participant_rows += [(match_id, user_id, team, app.ELO_INITIAL_RATING, app.ELO_INITIAL_RATING)
+                                     for user_id in team_players]
+            winner_rows += [(user_id, match_date, location, score, timestamp(match_time), match_id)
+                            for user_id in teams[winning_team - 1]]
+
+        insert_chunked(cursor, '''
+            INSERT INTO matches (id, match_date, location, score, winning_team, created_at) VALUES (?, ?, ?, ?, ?, ?)
+        ''', match_rows)
+        insert_chunked(cursor, '''
+            INSERT INTO match_participants (match_id, user_id, team, rating_before, rating_after) VALUES (?, ?, ?, ?, ?)
+        ''', participant_rows)
+        insert_chunked(cursor, '''
+            INSERT INTO rankings (user_id, match_date, location, score, wins, created_at, match_id)
+            VALUES (?, ?, ?, ?, 1, ?, ?)
+        ''', winner_rows)
+        counts['matches'] = len(match_rows)
+        counts['rankings'] = len(winner_rows)
+
+        # Điểm Elo tính lại một lần theo đúng thứ tự trận (điền rating_before/after và player_ratings)
+        app.replay_ratings(cursor)
+        counts['player_ratings'] = cursor.execute('SELECT COUNT(*) FROM player_ratings').fetchone()[0]
+
+        # Dữ liệu ghi thẳng bằng SQL nên tính lại cảnh báo một lần ở cuối
+        app.refresh_alerts(cursor)
+        counts['alerts'] = cursor.execute('SELECT COUNT(*) FROM alerts').fetchone()[0]
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sinh dữ liệu giả lập cho benchmark")
+    parser.add_argument('db_file', help="File SQLite sẽ tạo (không được trùng file đang có, trừ khi dùng --force)")
+    parser.add_argument('--members', type=int, default=5000)
+    parser.add_argument('--sessions', type=int, default=2000)
+    parser.add_argument('--finance-rows', type=int, default=1_000_000)
+    parser.add_argument('--voters-per-session', type=int, default=30)
+    parser.add_argument('--matches', type=int, default=20_000)
+    parser.add_argument('--days', type=int, default=730, help="Dữ liệu trải đều trong bấy nhiêu ngày gần nhất")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--force', action='store_true', help="Xóa file đích nếu đã tồn tại")
+    args = parser.parse_args()
+
+    if os.path.exists(args.db_file):
+        if not args.force:
+            sys.exit(f"{args.db_file} đã tồn tại (dùng --force để ghi đè)")
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db_file + suffix):
+                os.remove(args.db_file + suffix)
+
+    app = load_app(args.db_file)
+    started = time.perf_counter()
+    counts = generate(app, args.members, args.sessions, args.finance_rows, args.voters_per_session,
+                      args.matches, args.days, args.seed)
+    elapsed = time.perf_counter() - started
+
+    for table, count in counts.items():
+        print(f"{table:>15}: {count:,}")
+    print(f"Xong trong {elapsed:.1f}s -> {args.db_file}")
+
+
+if __name__ == '__main__':
+    main()
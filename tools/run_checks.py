@@ -0,0 +1,46 @@
+"""Chạy toàn bộ các bước kiểm tra tự động: query plan của truy vấn nóng và stress test ghi đồng thời
+
+Mỗi bước chạy trong tiến trình riêng (app đọc đường dẫn database lúc import) trên database tạm;
+thoát với mã 1 nếu có bước nào thất bại.
+
+Ví dụ:
+    python tools/run_checks.py
+    python tools/run_checks.py --members 300 --threads 32
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_check(name, script, *args):
+    """Chạy một script kiểm tra, in kết quả và trả về True nếu thoát với mã 0"""
+    print(f"== {name}", flush=True)
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, os.path.join(TOOLS_DIR, script), *args])
+    status = 'OK' if result.returncode == 0 else f"LỖI (mã {result.returncode})"
+    print(f"== {name}: {status} sau {time.perf_counter() - started:.1f} s", flush=True)
+    return result.returncode == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chạy các bước kiểm tra query plan và ghi đồng thời")
+    parser.add_argument('--members', type=int, default=300, help="Số thành viên cho stress test")
+    parser.add_argument('--threads', type=int, default=32, help="Số luồng cho stress test")
+    args = parser.parse_args()
+
+    results = {
+        'query plans': run_check('query plans', 'check_query_plans.py'),
+        'stress writes': run_check('stress writes', 'stress_writes.py',
+                                   '--members', str(args.members), '--threads', str(args.threads)),
+    }
+    failed = [name for name, ok in results.items() if not ok]
+    print(f"{len(results) - len(failed)}/{len(results)} bước đạt" + (f"; lỗi: {', '.join(failed)}" if failed else ''))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
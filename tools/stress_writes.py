@@ -0,0 +1,156 @@
+"""Stress test ghi đồng thời: nhiều luồng vote và đóng quỹ cùng lúc trên một database tạm
+
+Một luồng "giữ khóa" liên tục chiếm quyền ghi bằng kết nối riêng để buộc các helper gặp
+SQLITE_BUSY và phải thử lại. Cuối cùng kiểm tra không có vote/khoản đóng quỹ nào bị mất hoặc
+bị ghi trùng; thoát với mã 1 nếu có sai lệch.
+
+Ví dụ:
+    python tools/stress_writes.py --members 300 --threads 32
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import load_app
+
+CONTRIBUTION_AMOUNT = 100_000
+
+
+def seed(app, members, sessions):
+    """Tạo thành viên (tên duy nhất) và các phiên bình chọn, trả về (danh sách (id, tên), danh sách session id)"""
+    conn = app.get_db_connection()
+    try:
+        password = app.hash_password('Stress@123')
+        conn.executemany('''
+            INSERT INTO users (full_name, email, phone, birth_date, password, is_approved, is_admin)
+            VALUES (?, ?, ?, ?, ?, 1, 0)
+        ''', [(f"Stress {i:05d}", f"stress{i}@example.com", '0900000000', '1990-01-01', password)
+              for i in range(members)])
+        conn.executemany('INSERT INTO vote_sessions (session_date, description) VALUES (?, ?)',
+                         [(f"2030-01-{i + 1:02d}", 'Stress') for i in range(sessions)])
+        conn.commit()
+        member_rows = conn.execute("SELECT id, full_name FROM users WHERE email LIKE 'stress%' ORDER BY id").fetchall()
+        session_ids = [row[0] for row in conn.execute("SELECT id FROM vote_sessions WHERE description = 'Stress'")]
+    finally:
+        conn.close()
+    return member_rows, session_ids
+
+
+def hold_write_lock(db_file, stop, hold_ms, pause_ms):
+    """Chiếm khóa ghi theo chu kỳ để tạo tranh chấp thật sự"""
+    conn = sqlite3.connect(db_file, timeout=30, isolation_level=None)
+    while not stop.is_set():
+        conn.execute('BEGIN IMMEDIATE')
+        time.sleep(hold_ms / 1000)
+        conn.execute('COMMIT')
+        time.sleep(pause_ms / 1000)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress test vote và đóng quỹ đồng thời")
+    parser.add_argument('--members', type=int, default=300)
+    parser.add_argument('--sessions', type=int, default=3)
+    parser.add_argument('--contributions', type=int, default=2, help="Số lần đóng quỹ mỗi thành viên")
+    parser.add_argument('--duplicates', type=int, default=1, help="Số lần bấm vote lặp lại cho mỗi cặp")
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--busy-timeout-ms', type=int, default=20,
+                        help="busy_timeout của app trong lúc chạy (nhỏ để buộc phải thử lại)")
+    parser.add_argument('--hold-ms', type=int, default=40, help="Thời gian luồng giữ khóa chiếm quyền ghi mỗi lần")
+    parser.add_argument('--pause-ms', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='pickleball-stress-')
+    db_file = os.path.join(work_dir, 'stress.db')
+    os.environ['PICKLEBALL_BUSY_TIMEOUT_MS'] = str(args.busy_timeout_ms)
+    try:
+        app = load_app(db_file)
+        members, session_ids = seed(app, args.members, args.sessions)
+
+        # Mỗi cặp (thành viên, phiên) vote 1 + duplicates lần, xen kẽ với các lần đóng quỹ
+        rng = random.Random(args.seed)
+        jobs = [('vote', user_id, session_id)
+                for user_id, _ in members for session_id in session_ids
+                for _ in range(1 + args.duplicates)]
+        jobs += [('contribution', user_id, None) for user_id, _ in members for _ in range(args.contributions)]
+        rng.shuffle(jobs)
+
+        def run(job):
+            kind, user_id, target = job
+            if kind == 'vote':
+                return kind, user_id, target, app.vote_for_session(user_id, target)[0]
+            return kind, user_id, target, app.add_contribution(user_id, CONTRIBUTION_AMOUNT)
+
+        stop = threading.Event()
+        hog = threading.Thread(target=hold_write_lock, args=(db_file, stop, args.hold_ms, args.pause_ms))
+        hog.start()
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(args.threads) as executor:
+                results = list(executor.map(run, jobs))
+        finally:
+            stop.set()
+            hog.join()
+        elapsed = time.perf_counter() - started
+
+        # Đối chiếu kết quả trả về với dữ liệu thật trong database
+        voted = {}
+        contributed = {}
+        failed = 0
+        for kind, user_id, target, ok in results:
+            if kind == 'vote':
+                voted.setdefault((user_id, target), 0)
+                voted[(user_id, target)] += bool(ok)
+            elif ok:
+                contributed[user_id] = contributed.get(user_id, 0) + 1
+            else:
+                failed += 1
+
+        conn = sqlite3.connect(db_file)
+        stored_votes = dict(((user_id, session_id), count) for user_id, session_id, count in conn.execute(
+            'SELECT user_id, session_id, COUNT(*) FROM votes GROUP BY user_id, session_id'))
+        stored_contributions = dict(conn.execute('''
+            SELECT user_id, SUM(amount) FROM finances WHERE transaction_type = 'contribution' GROUP BY user_id
+        '''))
+        conn.close()
+
+        problems = []
+        for pair, successes in voted.items():
+            if successes != 1:
+                problems.append(f"vote {pair}: {successes} lần báo thành công")
+            if stored_votes.get(pair, 0) != 1:
+                problems.append(f"vote {pair}: {stored_votes.get(pair, 0)} dòng trong database")
+        for user_id, _ in members:
+            expected = contributed.get(user_id, 0) * CONTRIBUTION_AMOUNT
+            if stored_contributions.get(user_id, 0) != expected:
+                problems.append(f"đóng quỹ user {user_id}: {stored_contributions.get(user_id, 0)} != {expected}")
+        problems += [f"số dư lệch: {row}" for row in app.check_member_balances().to_dict('records')]
+
+        report = {
+            'jobs': len(jobs),
+            'threads': args.threads,
+            'elapsed_s': round(elapsed, 2),
+            'writes_per_s': round(len(jobs) / elapsed, 1),
+            'failed_contributions': failed,
+            'write_queue': app.get_write_queue().stats(),
+            'retries': app.get_write_retry_stats().stats(),
+            'problems': problems[:20],
+        }
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    sys.exit(1 if problems or failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Kiểm tra checkpoint số dư đầu tháng: tính lại từ đầu sổ cái (gồm cả file lưu trữ) và so với bảng balance_checkpoints
+
+Mặc định tạo các checkpoint còn thiếu rồi kiểm tra checkpoint mới nhất; thoát với mã 1 nếu có sai lệch.
+
+Ví dụ:
+    python tools/verify_checkpoints.py pickleball_club.db
+    python tools/verify_checkpoints.py pickleball_club.db --all
+    python tools/verify_checkpoints.py pickleball_club.db --date 2025-01-01
+"""
+import argparse
+import json
+import os
+import sys
+
+from common import load_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kiểm tra checkpoint số dư với sổ cái")
+    parser.add_argument('db_file')
+    parser.add_argument('--date', action='append', help="Ngày checkpoint (YYYY-MM-01), có thể lặp lại")
+    parser.add_argument('--all', action='store_true', help="Kiểm tra mọi checkpoint")
+    parser.add_argument('--no-generate', action='store_true', help="Không tạo checkpoint còn thiếu trước khi kiểm tra")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db_file):
+        sys.exit(f"Không tìm thấy {args.db_file}")
+
+    app = load_app(args.db_file)
+    generated = 0 if args.no_generate else app.ensure_balance_checkpoints()
+    available = app.get_checkpoint_dates()
+    if args.date:
+        dates = args.date
+    elif args.all:
+        dates = available
+    else:
+        dates = available[-1:]
+
+    report = {'generated': generated, 'checkpoints': len(available), 'checked': {}}
+    problems = 0
+    for checkpoint_date in dates:
+        if checkpoint_date not in available:
+            report['checked'][checkpoint_date] = 'không có checkpoint'
+            problems += 1
+            continue
+        mismatches = app.verify_balance_checkpoint(checkpoint_date)
+        report['checked'][checkpoint_date] = mismatches.head(20).to_dict('records') if len(mismatches) else 'ok'
+        problems += len(mismatches)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False, default=str))
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()